@@ -0,0 +1,204 @@
+#
+# adaptive.py
+#
+# Selective Loop refinement of a hemesh.  Rather than splitting every
+# face, only the faces picked out by a mask or a predicate are split
+# four ways ("red" faces), and the faces around them are patched so
+# that no edge is split on one side but not on the other:
+#
+#   * a face with two or three split edges is made red too, and this
+#     is repeated until no such face is left;
+#   * a face with just one split edge is bisected, from the new vertex
+#     on that edge to its opposite corner ("green" faces).
+#
+# The result is again a closed-up manifold hemesh, so it can be
+# linked, compiled, and refined further like any other.
+#
+# The new vertices on split edges are placed by Loop's odd rule.  A
+# vertex all of whose faces are red is moved by Loop's even rule; the
+# others stay where they are, so the unselected part of the surface
+# is left exactly as it was.  Selecting every face gives the same mesh
+# as loop.refine.
+#
+# Faces can be selected with a per-face error metric, such as
+#
+#   m1 = refine(m,lambda m: dihedral(m) > 0.3)
+#
+# or by an explicit mask or list of face ids.
+#
+
+import numpy as np
+from math import pi
+from hemesh import hemesh, unit, made
+from loop import edge_ids, weights, apply, boundary
+import tracing
+
+#
+# selection(m,select)
+#
+# The boolean mask of the faces of m picked out by 'select', which is
+# either a function of the mesh giving such a mask, a mask, or an
+# array of face ids.
+#
+def selection(m,select):
+    if callable(select):
+        select = select(m)
+    select = np.asarray(select)
+    if select.dtype == bool:
+        return select.copy()
+    mask = np.zeros(len(m.side),dtype=bool)
+    mask[select] = True
+    return mask
+
+#
+# corners(m)
+#
+# The half-edges of the three sides of each face, as three arrays.
+#
+def corners(m):
+    e0 = m.side
+    e1 = m.next[e0]
+    return e0, e1, m.next[e1]
+
+#
+# close(m,red)
+#
+# Grows the mask 'red' of faces to be split four ways until every
+# other face has at most one split edge.  Returns the grown mask, the
+# mask of split (undirected) edges, and the edge id of each half-edge.
+#
+def close(m,red):
+    ne, eid = edge_ids(m)
+    e0, e1, e2 = corners(m)
+    while True:
+        cut = np.zeros(ne,dtype=bool)
+        for e in (e0,e1,e2):
+            cut[eid[e[red]]] = True
+        count = cut[eid[e0]].astype(np.int8) + cut[eid[e1]] + cut[eid[e2]]
+        more = ~red & (count >= 2)
+        if not more.any():
+            return red, cut, eid
+        red = red | more
+
+#
+# refine(m,select)
+#
+# Returns the selective refinement of hemesh m, splitting the faces
+# picked out by 'select' (see selection) along with any needed to
+# keep the mesh closed up.
+#
+# The faces of the result are grouped by the face of m they came
+# from, in order: a kept face, the four children of a red face (laid
+# out as by loop.split), or the two halves of a green face.  The even
+# vertices keep their ids, and the new ones follow in the order of
+# their edges.
+#
+@tracing.timed('adaptive.refine',made)
+def refine(m,select):
+    nv = len(m.position)
+    red, cut, eid = close(m,selection(m,select))
+    e0, e1, e2 = corners(m)
+    v = np.stack([m.source[e0],m.source[e1],m.source[e2]],axis=1)
+
+    # Number the new vertices, one on each split edge.
+    ncut = int(np.count_nonzero(cut))
+    odd = np.full(len(cut),-1,dtype=np.int64)
+    odd[cut] = nv + np.arange(ncut)
+    mid = np.stack([odd[eid[e0]],odd[eid[e1]],odd[eid[e2]]],axis=1)
+
+    # Red faces become four.
+    r = np.nonzero(red)[0]
+    (a,b,c),(x,y,z) = v[r].T, mid[r].T
+    reds = np.stack([a,x,z, b,y,x, c,z,y, x,y,z],axis=1).reshape(-1,3)
+
+    # Green faces are halved, from their split edge's new vertex to
+    # the opposite corner.  Rotate each so that its split edge is
+    # its first.
+    g = np.nonzero(~red & (mid >= 0).any(axis=1))[0]
+    k = np.argmax(mid[g] >= 0,axis=1)
+    turn = (k[:,None] + np.arange(3)) % 3
+    gv = np.take_along_axis(v[g],turn,axis=1)
+    gm = mid[g,k]
+    greens = np.stack([gv[:,0],gm,gv[:,2], gm,gv[:,1],gv[:,2]],axis=1).reshape(-1,3)
+
+    # The rest are kept as they are.
+    kept = np.nonzero(~red & (mid < 0).all(axis=1))[0]
+
+    parent = np.concatenate([kept,np.repeat(r,4),np.repeat(g,2)])
+    triangles = np.concatenate([v[kept],reds,greens])
+    triangles = triangles[np.argsort(parent,kind='stable')]
+
+    # Place the vertices.  Loop's even rule only applies to vertices
+    # surrounded by red faces; the others stay put.
+    rows, cols, vals = weights(m)
+    smooth = np.bincount(m.source[~red[m.face]],minlength=nv) == 0
+    even = rows < nv
+    keep = np.where(even,smooth[np.minimum(rows,nv-1)],cut[np.maximum(rows-nv,0)])
+    rows, cols, vals = rows[keep], cols[keep], vals[keep]
+    rows = np.where(rows < nv,rows,odd[np.maximum(rows-nv,0)])
+    still = np.nonzero(~smooth)[0]
+    rows = np.concatenate([rows,still])
+    cols = np.concatenate([cols,still])
+    vals = np.concatenate([vals,np.ones(len(still))])
+
+    return hemesh(apply(rows,cols,vals,nv+ncut,m.position),triangles)
+
+#
+# adapt(m,select,levels=1)
+#
+# Applies refine(m,select) the given number of times.  The selection
+# should be a function of the mesh, so that it can be made anew on
+# each level.  Returns the finest mesh.
+#
+def adapt(m,select,levels=1):
+    for _ in range(levels):
+        m = refine(m,select)
+    return m
+
+#
+# savings(m,refined,levels=1)
+#
+# A printable comparison of the face count of 'refined', made from m
+# by 'levels' selective refinements, with that of uniform refinement.
+#
+def savings(m,refined,levels=1):
+    uniform = len(m.side) * 4**levels
+    have = len(refined.side)
+    return ('%d faces instead of %d for uniform refinement (%.1f%% fewer)'
+            % (have,uniform,100.0 * (uniform - have) / max(uniform,1)))
+
+#
+# dihedral(m)
+#
+# For each face of m, the largest angle between its normal and that
+# of a neighboring face.  Flat regions give 0, creases and highly
+# curved regions larger angles.
+#
+def dihedral(m):
+    fn = m.face_normals()
+    h = np.nonzero(m.twin >= 0)[0]
+    angle = np.zeros(len(m.source))
+    cos = np.einsum('ij,ij->i',fn[m.face[h]],fn[m.face[m.twin[h]]])
+    angle[h] = np.arccos(np.clip(cos,-1.0,1.0))
+    e0, e1, e2 = corners(m)
+    return np.maximum(np.maximum(angle[e0],angle[e1]),angle[e2])
+
+#
+# curvature(m)
+#
+# For each face of m, the largest angle defect at its corners: how
+# far the angles of the faces around a vertex fall short of 2 pi (or
+# of pi on the boundary).  This estimates the Gaussian curvature
+# gathered around each vertex.
+#
+def curvature(m):
+    P = m.position
+    V = P[m.source]
+    a = unit(P[m.source[m.next]] - V)
+    b = unit(P[m.source[m.next[m.next]]] - V)
+    angles = np.arccos(np.clip(np.einsum('ij,ij->i',a,b),-1.0,1.0))
+    total = np.bincount(m.source,angles,minlength=len(P))
+    defect = np.abs(np.where(boundary(m),pi,2.0*pi) - total)
+    e0, e1, e2 = corners(m)
+    return np.maximum(np.maximum(defect[m.source[e0]],defect[m.source[e1]]),
+                      defect[m.source[e2]])
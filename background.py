@@ -0,0 +1,101 @@
+#
+# background.py
+#
+# Builds a refinement level on a worker thread, so that the viewer
+# keeps drawing, and turning, the level it has while the next one is
+# made.  A job refines a mesh some number of times (see levels.build)
+# and then prepares it for drawing with a given function, typically
+# gpu.compile, which makes no GL calls.  The thread that owns the GL
+# context polls the job and, once it is done, uploads the result.
+#
+# A job can be cancelled.  The worker stops at the next stage it
+# starts; numpy work already under way runs to its end, but its
+# result is thrown away.
+#
+
+import threading
+import time
+from levels import build
+
+#
+# class job
+#
+# The making of level k from a coarser level's hemesh.
+#
+#  * k: the level being made
+#  * stage: what the worker is doing, for showing progress
+#  * done: whether the worker has finished, or given up
+#  * mesh, prepared: the refined hemesh and what prepare(mesh) gave
+#  * error: the exception that stopped the worker, or None
+#
+class job:
+
+    #
+    # job(k,below,mesh,prepare)
+    #
+    # Starts refining 'mesh', which is level 'below', up to level k,
+    # and then calling prepare(refined) on it.
+    #
+    def __init__(self,k,below,mesh,prepare):
+        self.k = k
+        self.below = below
+        self.source = mesh
+        self.prepare = prepare
+        self.stage = 'starting'
+        self.started = time.perf_counter()
+        self.finished = None
+        self.done = False
+        self.mesh = None
+        self.prepared = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    #
+    # J.run()
+    #
+    # The work of the worker thread.
+    #
+    def run(self):
+        try:
+            steps = self.k - self.below
+            if steps > 0 and not self.cancelled.is_set():
+                self.stage = 'refining %d level%s' % (steps,'s' if steps > 1 else '')
+                self.mesh = build(self.source,steps)
+            else:
+                self.mesh = self.source
+            if not self.cancelled.is_set():
+                self.stage = 'preparing %d faces' % len(self.mesh.side)
+                self.prepared = self.prepare(self.mesh)
+                self.stage = 'done, %d faces' % len(self.mesh.side)
+        except Exception as e:
+            self.error = e
+        self.source = None
+        self.finished = time.perf_counter()
+        self.done = True
+
+    #
+    # J.cancel()
+    #
+    # Asks the worker to stop.
+    #
+    def cancel(self):
+        self.cancelled.set()
+
+    #
+    # J.ready()
+    #
+    # Whether the job has finished with a result to use.
+    #
+    def ready(self):
+        return self.done and self.error is None and not self.cancelled.is_set()
+
+    #
+    # J.progress()
+    #
+    # A line telling what the job is doing and how long it has taken.
+    #
+    def progress(self):
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return 'level %d: %s, %.1fs' % (self.k,self.stage,end - self.started)
@@ -0,0 +1,208 @@
+#
+# batch.py
+#
+# Refines .obj files from the command line, with no window, display,
+# or GPU needed.  Each file is read with object.read(), refined to the
+# level asked for as a hemesh (see lattice.py), and written back out
+# as an .obj file, or as a binary .ply file (see objio.py).  Several
+# files are worked on at once, by a pool of processes.
+#
+#    python3 batch.py -l 3 -o refined objs/*.obj
+#
+# writes refined/stell-3.obj, and so on.  Files whose names clash
+# are each given a name of their own (see targets).  With --normals
+# the vertex normals are written too, and with --limit the vertices
+# are moved onto the Loop limit surface (see limit.py) and given its
+# normals.
+# Progress is printed as each file is finished, along with how long
+# each of its steps took.
+#
+# Before refining, the memory that the refined mesh will take is
+# estimated (see outofcore.estimate).  When it would not fit in the
+# memory that is free, shared among the jobs, the file is refined out
+# of core instead, in a scratch directory under the output directory,
+# and streamed to the output from there.  --out-of-core always or
+# never overrides the choice.  Normals and the limit surface need the
+# mesh in memory.
+#
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+from we import object
+from hemesh import hemesh
+from limit import project
+import lattice
+import objio
+import outofcore
+
+#
+# process(job)
+#
+# Reads, refines, and writes one file.  The job is a tuple
+# (source,target,levels,normals,limit,core,budget), where core is
+# 'auto', 'always', or 'never', and budget is the bytes of memory the
+# job may use, or None.  Returns a dictionary giving the source, the
+# target, the number of faces written, the seconds taken by each step,
+# the bytes/sec of the writing, whether it was refined out of core,
+# and the error, if any.
+#
+def process(job):
+    source, target, levels, normals, limit, core, budget = job
+    report = {'source': source,'target': target,'faces': 0,'times': [],'rate': 0.0,
+              'outofcore': False,'error': None}
+    try:
+        start = time.time()
+        o = object()
+        o.read(source)
+        report['times'].append(('read',time.time() - start))
+
+        m = hemesh.from_object(o)
+        del o
+        if core == 'always' or (core == 'auto' and levels > 0 and not (normals or limit)):
+            if core == 'always' or not outofcore.fits(m,levels,budget):
+                if normals or limit:
+                    raise ValueError('normals and the limit surface need the mesh in memory')
+                return refine_out_of_core(m,levels,report)
+
+        start = time.time()
+        m = lattice.refine_to(m,levels)
+        report['times'].append(('refine',time.time() - start))
+
+        if limit:
+            start = time.time()
+            m = project(m)
+            report['times'].append(('limit',time.time() - start))
+
+        result = objio.save(target,m,normals or limit)
+        report['times'].append(('write',result.seconds))
+        report['rate'] = result.rate()
+        report['faces'] = len(m.side)
+    except Exception as e:
+        report['error'] = '%s: %s' % (type(e).__name__,e)
+    return report
+
+#
+# refine_out_of_core(m,levels,report)
+#
+# The rest of process(), for a hemesh m refined out of core.  The
+# levels are kept in a scratch directory of the job's own beside the
+# target, which is deleted once the target is written.
+#
+def refine_out_of_core(m,levels,report):
+    target = report['target']
+    stem = os.path.splitext(os.path.basename(target))[0]
+    scratch = tempfile.mkdtemp(prefix=stem + '.',suffix='.scratch',dir=os.path.dirname(target) or '.')
+    report['outofcore'] = True
+    try:
+        start = time.time()
+        m = outofcore.refine_to(m,levels,scratch)
+        report['times'].append(('refine',time.time() - start))
+
+        result = outofcore.save(target,m)
+        report['times'].append(('write',result.seconds))
+        report['rate'] = result.rate()
+        report['faces'] = len(m.side)
+    finally:
+        del m
+        shutil.rmtree(scratch,ignore_errors=True)
+    return report
+
+#
+# target(source,directory,levels,kind='.obj',stem=None)
+#
+# Where the refinement of the file 'source' is written, named by the
+# stem of its file name unless given another.
+#
+def target(source,directory,levels,kind='.obj',stem=None):
+    if stem is None:
+        stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(directory,'%s-%d%s' % (stem,levels,kind))
+
+#
+# targets(sources,directory,levels,kind='.obj')
+#
+# Where the refinement of each file is written, each to a file of its
+# own.  Files whose names share a stem are told apart by the name of
+# the directory they are in, and then, if need be, by a count.
+#
+def targets(sources,directory,levels,kind='.obj'):
+    plain = [target(f,directory,levels,kind) for f in sources]
+    taken = set()
+    result = []
+    for f,t in zip(sources,plain):
+        stem = os.path.splitext(os.path.basename(f))[0]
+        if plain.count(t) > 1:
+            parent = os.path.basename(os.path.dirname(os.path.abspath(f)))
+            stem = '%s-%s' % (parent,stem) if parent else stem
+            t = target(f,directory,levels,kind,stem)
+        count = 1
+        while t in taken:
+            count += 1
+            t = target(f,directory,levels,kind,'%s.%d' % (stem,count))
+        taken.add(t)
+        result.append(t)
+    return result
+
+#
+# main(args)
+#
+# Runs the tool on the command line arguments.  Returns the exit
+# status: 1 if any file failed, otherwise 0.
+#
+def main(args):
+    parser = argparse.ArgumentParser(description='Refine .obj files by Loop subdivision.')
+    parser.add_argument('files',nargs='+',help='the .obj files to refine')
+    parser.add_argument('-l','--levels',type=int,default=1,help='how many times to refine (default: 1)')
+    parser.add_argument('-o','--output',default='.',help='directory for the results (default: .)')
+    parser.add_argument('-j','--jobs',type=int,default=os.cpu_count() or 1,
+                        help='files to work on at once (default: one per processor)')
+    parser.add_argument('-f','--format',choices=('obj','ply'),default='obj',
+                        help='write .obj files or binary .ply files (default: obj)')
+    parser.add_argument('--normals',action='store_true',help='write vertex normals')
+    parser.add_argument('--limit',action='store_true',
+                        help='move the vertices onto the limit surface, and write its normals')
+    parser.add_argument('--out-of-core',choices=('auto','always','never'),default='auto',
+                        help='refine in memory-mapped files: when the mesh would not fit in '
+                             'free memory, always, or never (default: auto)')
+    options = parser.parse_args(args)
+
+    os.makedirs(options.output,exist_ok=True)
+    workers = max(1,min(options.jobs,len(options.files)))
+    free = outofcore.available()
+    budget = free // workers if free is not None else None
+    places = targets(options.files,options.output,options.levels,'.' + options.format)
+    jobs = [(f,t,options.levels,options.normals,options.limit,options.out_of_core,budget)
+            for f,t in zip(options.files,places)]
+
+    start = time.time()
+    failed = 0
+    if workers == 1:
+        reports = map(process,jobs)
+    else:
+        pool = get_context().Pool(workers)
+        reports = pool.imap_unordered(process,jobs)
+    for done,report in enumerate(reports,1):
+        if report['error'] is not None:
+            failed += 1
+            print('[%d/%d] %s: FAILED, %s' % (done,len(jobs),report['source'],report['error']))
+        else:
+            steps = ', '.join('%s %.2fs' % step for step in report['times'])
+            print('[%d/%d] %s -> %s: %d faces%s (%s, %.1f MB/s)'
+                  % (done,len(jobs),report['source'],report['target'],report['faces'],
+                     ', out of core' if report['outofcore'] else '',steps,report['rate'] / 2**20))
+        sys.stdout.flush()
+    if workers > 1:
+        pool.close()
+        pool.join()
+
+    print('%d file(s) in %.2fs, %d failed' % (len(jobs),time.time() - start,failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
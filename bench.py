@@ -0,0 +1,254 @@
+#
+# bench.py
+#
+# Benchmarks of reading, refining, and compiling meshes, run on the
+# procedural meshes of shapes.py at chosen face counts.  Nothing here
+# needs a GPU or a display.
+#
+# For each shape and size, the mesh is written out as an .obj file and
+# then put through these stages, each timed and, unless --no-memory is
+# given, run again under tracemalloc for its peak memory:
+#
+#   read             object.read() of the .obj file
+#   finish           object.finish()
+#   rebox            object.rebox()
+#   compile          object.compile()
+#   compile indexed  object.compile(indexed=True)
+#   refine k         object.refine() from level k-1 to level k
+#   load             objio.load() of the .obj file, into a hemesh
+#   pack             hemesh.pack(), the interleaved buffer data
+#   pack indexed     hemesh.pack(indexed=True)
+#   loop.refine k    loop.refine() from level k-1 to level k
+#
+# The results are printed as a table and can be saved as JSON.  A run
+# saved earlier can be compared with a new one, or two saved runs with
+# each other, listing the stages that got slower or larger:
+#
+#    python3 bench.py --faces 5000,20000 --levels 2 --json new.json
+#    python3 bench.py --compare old.json new.json
+#
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import loop
+import objio
+import shapes
+from we import object
+
+#
+# How much slower or larger a stage may get before compare() flags it,
+# as a fraction, and the smallest change in seconds or bytes that
+# counts at all.
+#
+THRESHOLD = 0.10
+NOISE = (0.002,1 << 16)
+
+#
+# class run
+#
+# The results of one benchmark run: a list of records, each a
+# dictionary giving the shape, its face count, the stage, the
+# seconds it took, and its peak memory in bytes (or None).
+#
+class run:
+
+    def __init__(self,repeat=1,memory=True):
+        self.repeat = repeat
+        self.memory = memory
+        self.records = []
+
+    #
+    # R.stage(shape,faces,name,work)
+    #
+    # Times work(), the best of 'repeat' tries, measures its peak
+    # memory, and records them.  Returns what work() returned.
+    #
+    def stage(self,shape,faces,name,work):
+        best = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = work()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best,seconds)
+        peak = None
+        if self.memory:
+            del result
+            tracemalloc.start()
+            result = work()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.records.append({'shape': shape,'faces': faces,'stage': name,
+                             'seconds': best,'peak': peak})
+        return result
+
+    #
+    # R.table()
+    #
+    # The results as a printable table.
+    #
+    def table(self):
+        lines = ['%-10s %9s  %-16s %10s %12s' % ('shape','faces','stage','seconds','peak MB')]
+        for r in self.records:
+            peak = '-' if r['peak'] is None else '%.1f' % (r['peak'] / 2**20)
+            lines.append('%-10s %9d  %-16s %10.4f %12s'
+                         % (r['shape'],r['faces'],r['stage'],r['seconds'],peak))
+        return '\n'.join(lines)
+
+    #
+    # R.save(filename)
+    #
+    # Writes the results, and a description of this machine, as JSON.
+    #
+    def save(self,filename):
+        with open(filename,'w') as f:
+            json.dump({'machine': machine(),'records': self.records},f,indent=1)
+
+#
+# machine()
+#
+# A description of where the benchmarks ran.
+#
+def machine():
+    return {'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'processors': os.cpu_count(),
+            'when': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+#
+# suite(R,shape,faces,levels,most,directory)
+#
+# Runs all the stages on the named shape of about 'faces' faces,
+# recording them in run R.  Meshes are refined up to 'levels' times,
+# but not past 'most' faces.  The .obj file goes in 'directory'.
+#
+def suite(R,shape,faces,levels,most,directory):
+    P, F = shapes.GENERATORS[shape](faces)
+    n = len(F)
+    path = os.path.join(directory,'%s-%d.obj' % (shape,n))
+    shapes.save(path,P,F)
+
+    def read():
+        o = object()
+        o.read(path)
+        return o
+
+    o = R.stage(shape,n,'read',read)
+    R.stage(shape,n,'finish',o.finish)
+    R.stage(shape,n,'rebox',o.rebox)
+    R.stage(shape,n,'compile',o.compile)
+    R.stage(shape,n,'compile indexed',lambda: o.compile(indexed=True))
+    for k in range(1,levels+1):
+        if n * 4**k > most:
+            break
+        o = R.stage(shape,n,'refine %d' % k,o.refine)
+    del o
+
+    m = R.stage(shape,n,'load',lambda: objio.load(path))
+    R.stage(shape,n,'pack',m.pack)
+    R.stage(shape,n,'pack indexed',lambda: m.pack(indexed=True))
+    for k in range(1,levels+1):
+        if n * 4**k > most:
+            break
+        m = R.stage(shape,n,'loop.refine %d' % k,lambda: loop.refine(m))
+    os.remove(path)
+
+#
+# compare(old,new,threshold=THRESHOLD)
+#
+# Compares the records of two runs, as loaded from their JSON.  Returns
+# a printable report, and the number of stages that got slower or
+# larger by more than the threshold.
+#
+def compare(old,new,threshold=THRESHOLD):
+    before = {(r['shape'],r['faces'],r['stage']): r for r in old['records']}
+    lines = ['%-10s %9s  %-16s %10s %10s %7s %9s' %
+             ('shape','faces','stage','was','now','time','memory')]
+    worse = 0
+    for r in new['records']:
+        key = (r['shape'],r['faces'],r['stage'])
+        if key not in before:
+            continue
+        b = before[key]
+        flags = []
+        time_ratio = r['seconds'] / max(b['seconds'],1e-9)
+        if time_ratio > 1.0 + threshold and r['seconds'] - b['seconds'] > NOISE[0]:
+            flags.append('SLOWER')
+        memory = '-'
+        if r['peak'] is not None and b['peak'] is not None:
+            peak_ratio = r['peak'] / max(b['peak'],1)
+            memory = '%.2fx' % peak_ratio
+            if peak_ratio > 1.0 + threshold and r['peak'] - b['peak'] > NOISE[1]:
+                flags.append('LARGER')
+        worse += len(flags) > 0
+        lines.append('%-10s %9d  %-16s %10.4f %10.4f %6.2fx %9s  %s'
+                     % (key[0],key[1],key[2],b['seconds'],r['seconds'],
+                        time_ratio,memory,' '.join(flags)))
+    lines.append('%d stage(s) got worse by more than %d%%' % (worse,round(100*threshold)))
+    return '\n'.join(lines), worse
+
+#
+# load(filename)
+#
+# Reads a run saved by run.save.
+#
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+#
+# main(args)
+#
+# Runs the benchmarks as asked by the command line arguments, and
+# returns the exit status: 1 when a comparison found stages that got
+# worse, otherwise 0.
+#
+def main(args):
+    parser = argparse.ArgumentParser(description='Benchmark mesh reading, refining, and compiling.')
+    parser.add_argument('--shapes',default=','.join(shapes.GENERATORS),
+                        help='which of %s to run (default: all)' % ', '.join(shapes.GENERATORS))
+    parser.add_argument('--faces',default='5000,20000',
+                        help='comma-separated target face counts (default: 5000,20000)')
+    parser.add_argument('--levels',type=int,default=2,help='refinement levels (default: 2)')
+    parser.add_argument('--most',type=int,default=400000,
+                        help='largest refined face count to benchmark (default: 400000)')
+    parser.add_argument('--repeat',type=int,default=1,help='times to run each stage, keeping the best')
+    parser.add_argument('--no-memory',action='store_true',help='skip measuring peak memory')
+    parser.add_argument('--json',help='save the results to this file')
+    parser.add_argument('--compare',nargs='+',metavar='RUN',
+                        help='compare with a saved run; given two, compare those without running')
+    parser.add_argument('--threshold',type=float,default=THRESHOLD,
+                        help='fraction of slowdown to flag (default: %.2f)' % THRESHOLD)
+    options = parser.parse_args(args)
+
+    if options.compare and len(options.compare) > 1:
+        report, worse = compare(load(options.compare[0]),load(options.compare[1]),options.threshold)
+        print(report)
+        return 1 if worse else 0
+
+    R = run(options.repeat,not options.no_memory)
+    with tempfile.TemporaryDirectory() as directory:
+        for shape in options.shapes.split(','):
+            for faces in options.faces.split(','):
+                suite(R,shape,int(faces),options.levels,options.most,directory)
+    print(R.table())
+    if options.json:
+        R.save(options.json)
+
+    if options.compare:
+        report, worse = compare(load(options.compare[0]),{'records': R.records},options.threshold)
+        print()
+        print(report)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1 +1,6 @@
 EPSILON = 1.0e-8
+
+#
+# The material color of every vertex.  See vertex.color in we.py.
+#
+COLOR = (0.5,0.45,0.57)
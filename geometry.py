@@ -6,17 +6,32 @@
 #
 # Version: 01.27.15a
 #
-# This defines three names: 
+# This defines five names: 
 #
 #    point: a class of locations in 3-space
 #    vector: a class of offsets between points within 3-space
+#    points: a class of arrays of points
+#    vectors: a class of arrays of vectors
 #    ORIGIN: a point at the origin 
 #
 # The two classes/datatypes are designed based on Chapter 3 of
 # "Coordinate-Free Geometric Programming" (UW-CSE TR-89-09-16)
 # by Tony DeRose.
 #
+# Meshes make a great many of these, so both classes are slotted,
+# holding just their three coordinates, and their methods work on the
+# coordinates directly rather than through intermediate points and
+# vectors.
+#
+# For work on many at once, 'points' and 'vectors' hold N of them as
+# the rows of one N x 3 numpy array, and offer the same operations,
+# row by row, keeping the same distinctions: the difference of points
+# is a vector, a point plus a vector is a point, and points can only
+# be combined affinely.  Each operation takes single points and
+# vectors, too, applying them to every row.
+#
 
+import numpy as np
 from random import random
 from math import sqrt, pi, sin, cos, acos
 from constants import EPSILON
@@ -27,6 +42,8 @@ from OpenGL.GL import *
 #
 class point:
 
+    __slots__ = ('x','y','z')
+
     def __init__(self,_x,_y,_z):
         """ Construct a new point instance from its coordinates. """
         self.x = _x
@@ -44,34 +61,45 @@ class point:
 
     def glVertex3(self):
         """ Issues a glVertex3f call with the coordinates of self. """
-        glVertex3f(self[0],self[1],self[2])
+        glVertex3f(self.x,self.y,self.z)
 
     def plus(self,offset):
-        """ Computes a point-vector sum, yielding a new point. """
+        """ Computes a point-vector sum, yielding a new point.  Plus
+            an array of vectors, yields an array of points. """
+        if isinstance(offset,(points,vectors)):
+            return points.of([self]).plus(offset)
         return point(self.x+offset.dx,self.y+offset.dy,self.z+offset.dz)
 
     def minus(self,other):
-        """ Computes point-point subtraction, yielding a vector. """
+        """ Computes point-point subtraction, yielding a vector.  Less
+            an array of points, yields an array of vectors. """
+        if isinstance(other,(points,vectors)):
+            return points.of([self]).minus(other)
         return vector(self.x-other.x,self.y-other.y,self.z-other.z)
 
     def dist2(self,other):
         """ Computes the squared distance between self and other. """
-        return (self-other).norm2()
+        dx, dy, dz = self.x-other.x, self.y-other.y, self.z-other.z
+        return dx*dx+dy*dy+dz*dz
 
     def dist(self,other):
         """ Computes the distance between self and other. """
-        return (self-other).norm()
+        return sqrt(self.dist2(other))
 
     def combo(self,scalar,other):
         """ Computes the affine combination of self with other. """
-        return self.plus(other.minus(self).scale(scalar))
+        x, y, z = self.x, self.y, self.z
+        return point(x+scalar*(other.x-x),y+scalar*(other.y-y),z+scalar*(other.z-z))
 
     def combos(self,scalars,others):
         """ Computes the affine combination of self with other. """
-        P = self
-        for i in range(min(len(scalars),len(others))):
-            P = P + scalars[i] * (others[i] - self)
-        return P
+        x, y, z = self.x, self.y, self.z
+        px, py, pz = x, y, z
+        for scalar,other in zip(scalars,others):
+            px += scalar*(other.x-x)
+            py += scalar*(other.y-y)
+            pz += scalar*(other.z-z)
+        return point(px,py,pz)
 
     def max(self,other):
         return point(max(self.x,other.x),max(self.y,other.y),max(self.z,other.z))
@@ -99,7 +127,13 @@ class point:
 
     def __getitem__(self,i):
         """ Defines p[i] """
-        return (self.components())[i]
+        if i == 0:
+            return self.x
+        if i == 1:
+            return self.y
+        if i == 2:
+            return self.z
+        return (self.x,self.y,self.z)[i]
 
 
 #
@@ -107,6 +141,8 @@ class point:
 #
 class vector:
 
+    __slots__ = ('dx','dy','dz')
+
     def __init__(self,_dx,_dy,_dz):
         """ Construct a new vector instance. """
         self.dx = _dx
@@ -140,7 +176,7 @@ class vector:
 
     def minus(self,other):
         """ Vector that results from subtracting other from self. """
-        return self.plus(other.neg())
+        return vector(self.dx-other.dx,self.dy-other.dy,self.dz-other.dz)
 
     def scale(self,scalar):
         """ Same vector as self, but scaled by the given value. """
@@ -148,7 +184,7 @@ class vector:
 
     def neg(self):
         """ Additive inverse of self. """
-        return self.scale(-1.0)
+        return vector(-self.dx,-self.dy,-self.dz)
 
     def dot(self,other):
         """ Dot product of self with other. """
@@ -162,7 +198,8 @@ class vector:
 
     def norm2(self):
         """ Length of self, squared. """
-        return self.dot(self)
+        dx, dy, dz = self.dx, self.dy, self.dz
+        return dx*dx+dy*dy+dz*dz
 
     def norm(self):
         """ Length of self. """
@@ -170,11 +207,12 @@ class vector:
 
     def unit(self):
         """ Unit vector in the same direction as self. """
-        n = self.norm()
+        n = sqrt(self.norm2())
         if n < EPSILON:
             return vector(1.0,0.0,0.0)
         else:
-            return self.scale(1.0/n)
+            s = 1.0/n
+            return vector(s*self.dx,s*self.dy,s*self.dz)
 
     #
     # Special methods, hooks into Python syntax.
@@ -200,7 +238,7 @@ class vector:
 
     def __bool__(self):
         """ Defines if v: """
-        return self.norm() > EPSILON
+        return sqrt(self.norm2()) > EPSILON
 
     def __str__(self):
         """ Defines str(v) """
@@ -210,10 +248,255 @@ class vector:
 
     def __getitem__(self,i):
         """ Defines v[i] """
-        return (self.components())[i]
+        if i == 0:
+            return self.dx
+        if i == 1:
+            return self.dy
+        if i == 2:
+            return self.dz
+        return (self.dx,self.dy,self.dz)[i]
 
 # 
 # The point at the origin.
 #
 ORIGIN = point(0.0,0.0,0.0)
 
+
+#
+# rows(x,kind)
+#
+# The coordinates of x, a single 'kind' (point or vector) or an array
+# of them (points or vectors), for numpy to broadcast.  Anything else
+# is a TypeError, so that, say, points can't be added to points.
+#
+def rows(x,kind):
+    if kind is point:
+        if isinstance(x,points):
+            return x.array
+        if isinstance(x,point):
+            return np.array([x.x,x.y,x.z])
+    else:
+        if isinstance(x,vectors):
+            return x.array
+        if isinstance(x,vector):
+            return np.array([x.dx,x.dy,x.dz])
+    raise TypeError('expected %s, got %s' % (kind.__name__,type(x).__name__))
+
+#
+# Description of arrays of 3-D points and their methods.
+#
+class points:
+
+    __slots__ = ('array',)
+
+    def __init__(self,array):
+        """ Construct an array of points from an N x 3 array. """
+        self.array = np.asarray(array,dtype=np.float64).reshape(-1,3)
+
+    @classmethod
+    def of(cls,ps):
+        """ Construct an array of points from point instances. """
+        return points([(p.x,p.y,p.z) for p in ps])
+
+    def components(self):
+        """ Object self as an N x 3 numpy array. """
+        return self.array
+
+    def plus(self,offsets):
+        """ Point-vector sums, yielding points. """
+        return points(self.array + rows(offsets,vector))
+
+    def minus(self,others):
+        """ Point-point differences, yielding vectors. """
+        return vectors(self.array - rows(others,point))
+
+    def dist2(self,others):
+        """ The squared distance of each point from others. """
+        return self.minus(others).norm2()
+
+    def dist(self,others):
+        """ The distance of each point from others. """
+        return np.sqrt(self.dist2(others))
+
+    def combo(self,scalars,others):
+        """ The affine combination of each point with others, by a
+            scalar or by a scalar for each row. """
+        P = self.array
+        return points(P + column(scalars) * (rows(others,point) - P))
+
+    def combos(self,weights,others):
+        """ The affine combinations of each point with others, a list
+            of points or arrays of points.  The weights are one list
+            of scalars, or an N x k array of them, one row per point. """
+        P = self.array
+        W = np.asarray(weights,dtype=np.float64)
+        result = P.copy()
+        for j,other in enumerate(others):
+            w = W[j] if W.ndim == 1 else W[:,j:j+1]
+            result += w * (rows(other,point) - P)
+        return points(result)
+
+    def max(self):
+        """ The largest coordinates of the points, as a point. """
+        return point(*self.array.max(axis=0).tolist())
+
+    def min(self):
+        """ The smallest coordinates of the points, as a point. """
+        return point(*self.array.min(axis=0).tolist())
+
+    def centroid(self):
+        """ The average of the points. """
+        return point(*self.array.mean(axis=0).tolist())
+
+    #
+    # Special methods, hooks into Python syntax.
+    #
+
+    __add__ = plus  # Defines Ps + vs
+
+    __sub__ = minus # Defines Ps - Qs
+
+    def __len__(self):
+        """ Defines len(Ps) """
+        return len(self.array)
+
+    def __getitem__(self,i):
+        """ Defines Ps[i] as a point, and Ps[indices] as points. """
+        if isinstance(i,(int,np.integer)):
+            return point(*self.array[i].tolist())
+        return points(self.array[i])
+
+    def __iter__(self):
+        """ Defines for P in Ps: """
+        for x,y,z in self.array.tolist():
+            yield point(x,y,z)
+
+    def __str__(self):
+        return 'points(%s)' % self.array
+
+    __repr__ = __str__
+
+#
+# Description of arrays of 3-D vectors and their methods.
+#
+class vectors:
+
+    __slots__ = ('array',)
+
+    def __init__(self,array):
+        """ Construct an array of vectors from an N x 3 array. """
+        self.array = np.asarray(array,dtype=np.float64).reshape(-1,3)
+
+    @classmethod
+    def of(cls,vs):
+        """ Construct an array of vectors from vector instances. """
+        return vectors([(v.dx,v.dy,v.dz) for v in vs])
+
+    def components(self):
+        """ Object self as an N x 3 numpy array. """
+        return self.array
+
+    def plus(self,others):
+        """ Sums of self and others. """
+        return vectors(self.array + rows(others,vector))
+
+    def minus(self,others):
+        """ Differences of self and others. """
+        return vectors(self.array - rows(others,vector))
+
+    def scale(self,scalars):
+        """ Each vector scaled by a scalar, or by a scalar per row. """
+        return vectors(column(scalars) * self.array)
+
+    def neg(self):
+        """ Additive inverses. """
+        return vectors(-self.array)
+
+    def dot(self,others):
+        """ Dot product of each vector with others. """
+        V = self.array
+        W = np.broadcast_to(rows(others,vector),V.shape)
+        return V[:,0]*W[:,0]+V[:,1]*W[:,1]+V[:,2]*W[:,2]
+
+    def cross(self,others):
+        """ Cross product of each vector with others. """
+        return vectors(np.cross(self.array,rows(others,vector)))
+
+    def norm2(self):
+        """ Length of each vector, squared. """
+        return self.dot(self)
+
+    def norm(self):
+        """ Length of each vector. """
+        return np.sqrt(self.norm2())
+
+    def unit(self):
+        """ Unit vectors in the same directions, with those too short
+            to have one made (1,0,0), as by vector.unit. """
+        n = self.norm()
+        small = n < EPSILON
+        us = (1.0 / np.where(small,1.0,n))[:,None] * self.array
+        us[small] = (1.0,0.0,0.0)
+        return vectors(us)
+
+    def sum(self):
+        """ The sum of the vectors, as a vector. """
+        return vector(*self.array.sum(axis=0).tolist())
+
+    def max(self):
+        """ The largest components of the vectors, as a vector. """
+        return vector(*self.array.max(axis=0).tolist())
+
+    def min(self):
+        """ The smallest components of the vectors, as a vector. """
+        return vector(*self.array.min(axis=0).tolist())
+
+    #
+    # Special methods, hooks into Python syntax.
+    #
+
+    __abs__ = norm  # Defines abs(vs).
+
+    __add__ = plus  # Defines vs + ws
+
+    __sub__ = minus # Defines vs - ws
+
+    __neg__ = neg   # Defines -vs
+
+    __mul__ = scale # Defines vs * a
+
+    __rmul__ = scale # Defines a * vs
+
+    def __truediv__(self,scalars):
+        """ Defines vs / a """
+        return self.scale(1.0 / np.asarray(scalars,dtype=np.float64))
+
+    def __len__(self):
+        """ Defines len(vs) """
+        return len(self.array)
+
+    def __getitem__(self,i):
+        """ Defines vs[i] as a vector, and vs[indices] as vectors. """
+        if isinstance(i,(int,np.integer)):
+            return vector(*self.array[i].tolist())
+        return vectors(self.array[i])
+
+    def __iter__(self):
+        """ Defines for v in vs: """
+        for dx,dy,dz in self.array.tolist():
+            yield vector(dx,dy,dz)
+
+    def __str__(self):
+        return 'vectors(%s)' % self.array
+
+    __repr__ = __str__
+
+#
+# column(scalars)
+#
+# A scalar, or an array of one scalar per row shaped to scale the
+# rows of an N x 3 array.
+#
+def column(scalars):
+    s = np.asarray(scalars,dtype=np.float64)
+    return s[:,None] if s.ndim == 1 else s
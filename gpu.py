@@ -0,0 +1,405 @@
+#
+# gpu.py
+#
+# Ownership of the GPU buffers that meshes are drawn from.
+#
+# A 'manager' makes, refills, and deletes every buffer object, and
+# keeps count of how many are live and how many bytes they hold, so a
+# leak shows up as a count that only grows.  A 'buffers' instance is
+# the GPU side of one mesh: its vertex data, its index and line
+# buffers when drawn indexed, and the vertex array objects that record
+# how the shaders' attributes are fed from them.  The attribute setup
+# is done once, when the buffers are made, and drawing just binds the
+# vertex array object.
+#
+# The attributes have the fixed locations given by ATTRIBUTES, which
+# init_shaders binds before linking each program, so the same vertex
+# array object serves both the mesh and the shadow shaders.
+#
+# A 'program' is a linked shader program, looked over once for the
+# locations of its attributes and uniforms.  It remembers the value
+# last given to each uniform, so that drawing can set every uniform
+# every frame and only the ones that changed reach GL.
+#
+
+from ctypes import c_void_p
+import numpy as np
+from OpenGL.GL import *
+from hemesh import LAYOUT
+import tracing
+
+#
+# The location of each vertex attribute of the shaders.
+#
+ATTRIBUTES = (('vertex',0),('normal',1),('color',2),('bary',3))
+LOCATION = dict(ATTRIBUTES)
+
+#
+# class manager
+#
+# Makes and deletes buffer objects, and tracks
+#
+#  * live: how many buffers are made and not yet deleted
+#  * allocated: the bytes of storage held by those
+#  * made, deleted: how many buffers have been made and deleted
+#  * orphaned: how many refills went into a buffer's old storage
+#  * grown: how many refills needed larger storage
+#
+class manager:
+
+    def __init__(self):
+        self.capacity = {}
+        self.made = 0
+        self.deleted = 0
+        self.orphaned = 0
+        self.grown = 0
+
+    @property
+    def live(self):
+        return len(self.capacity)
+
+    @property
+    def allocated(self):
+        return sum(self.capacity.values())
+
+    #
+    # M.make(target,array)
+    #
+    # Makes a buffer holding the given array, and returns its name.
+    # The array is handed to glBufferData through the buffer protocol,
+    # so it is sent without a copy.
+    #
+    def make(self,target,array):
+        name = int(glGenBuffers(1))
+        glBindBuffer(target,name)
+        glBufferData(target,array.nbytes,array,GL_STATIC_DRAW)
+        self.capacity[name] = array.nbytes
+        self.made += 1
+        tracing.count('bytes uploaded',array.nbytes)
+        return name
+
+    #
+    # M.fill(target,name,array)
+    #
+    # Replaces the contents of buffer 'name' with the given array.  If
+    # the array fits in the buffer's storage, that storage is orphaned
+    # and refilled, so the driver needn't wait for draws still reading
+    # the old contents.  Otherwise the buffer is given new storage.
+    #
+    def fill(self,target,name,array):
+        glBindBuffer(target,name)
+        if array.nbytes <= self.capacity[name]:
+            glBufferData(target,self.capacity[name],None,GL_STATIC_DRAW)
+            glBufferSubData(target,0,array.nbytes,array)
+            self.orphaned += 1
+        else:
+            glBufferData(target,array.nbytes,array,GL_STATIC_DRAW)
+            self.capacity[name] = array.nbytes
+            self.grown += 1
+        tracing.count('bytes uploaded',array.nbytes)
+
+    #
+    # M.delete(names)
+    #
+    # Deletes the given buffers.
+    #
+    def delete(self,names):
+        names = [name for name in names if name in self.capacity]
+        if names:
+            glDeleteBuffers(len(names),names)
+        for name in names:
+            del self.capacity[name]
+        self.deleted += len(names)
+
+    #
+    # M.nbytes(names)
+    #
+    # The bytes of storage held by the given buffers.
+    #
+    def nbytes(self,names):
+        return sum(self.capacity.get(name,0) for name in names)
+
+    #
+    # M.report()
+    #
+    # A printable summary of the counters.
+    #
+    def report(self):
+        return ('gpu: %d buffers live, %d bytes (%d made, %d deleted, %d orphaned, %d grown)'
+                % (self.live,self.allocated,self.made,self.deleted,self.orphaned,self.grown))
+
+#
+# class compiled
+#
+# The arrays to be sent for a mesh, made by compile().
+#
+#  * arrays: the target and contents of each buffer role
+#  * width: the floats in each row of interleaved vertex data
+#  * count: the number of vertices (or indices) of the faces
+#  * nlines: the number of edge end indices
+#
+class compiled:
+
+    def __init__(self,arrays,width,count,nlines):
+        self.arrays = arrays
+        self.width = width
+        self.count = count
+        self.nlines = nlines
+
+#
+# compile(mesh,indexed=True,interleave=True)
+#
+# The arrays to be sent for hemesh 'mesh', laid out as asked (see
+# buffers).  No GL calls are made, so this can run on any thread,
+# leaving the upload to the thread that owns the GL context.
+#
+def compile(mesh,indexed=True,interleave=True):
+    arrays = {}
+    width = 0
+    nlines = 0
+    if interleave:
+        data, indices, lines = mesh.pack(indexed)
+        arrays['data'] = (GL_ARRAY_BUFFER,np.ascontiguousarray(data,dtype=np.float32))
+        width = data.shape[1]
+        count = len(data)
+    else:
+        lists = mesh.compile(indexed)
+        names = ['vertex','normal','color']
+        values = list(lists[:3])
+        if indexed:
+            indices, lines = lists[3:]
+        else:
+            indices, lines = None, None
+            names.append('bary')
+            values.append(np.tile(np.eye(3,dtype=np.float32).reshape(-1),len(values[0]) // 9))
+        for name,array in zip(names,values):
+            arrays[name] = (GL_ARRAY_BUFFER,np.ascontiguousarray(array,dtype=np.float32))
+        count = len(values[0]) // 3
+
+    if indexed:
+        arrays['index'] = (GL_ELEMENT_ARRAY_BUFFER,np.ascontiguousarray(indices,dtype=np.uint32))
+        arrays['lines'] = (GL_ELEMENT_ARRAY_BUFFER,np.ascontiguousarray(lines,dtype=np.uint32))
+        count = len(indices)
+        nlines = len(lines)
+    return compiled(arrays,width,count,nlines)
+
+#
+# class buffers
+#
+# The GPU buffers compiled from one hemesh.
+#
+#  * names: the buffer of each role, which is 'data' for interleaved
+#    vertex data, or the attribute name for separate ones, and
+#    'index' and 'lines' for the elements of indexed geometry
+#  * layout: the buffer, stride, and offset of each attribute
+#  * count: the number of vertices (or indices) of the faces
+#  * nlines: the number of edge end indices
+#
+class buffers:
+
+    #
+    # buffers(manager,mesh,indexed=True,interleave=True)
+    #
+    # Compiles hemesh 'mesh', or uploads the arrays already compiled
+    # for it, into buffers made by 'manager'.
+    #
+    # When 'indexed' is set, each vertex is sent once, and the faces
+    # are given by an index buffer.  Otherwise every face corner gets
+    # its own copy of its vertex, labelled by its barycentric
+    # coordinates for drawing the wireframe.
+    #
+    # When 'interleave' is set, the attributes of each vertex are
+    # packed next to each other in one buffer; otherwise each
+    # attribute gets a buffer of its own.
+    #
+    def __init__(self,manager,mesh,indexed=True,interleave=True):
+        self.manager = manager
+        self.indexed = indexed
+        self.interleave = interleave
+        self.names = {}
+        self.layout = {}
+        self.count = 0
+        self.nlines = 0
+        self.arrays = None
+        self.update(mesh)
+
+    #
+    # B.update(mesh)
+    #
+    # Recompiles the buffers from hemesh 'mesh', refilling the ones
+    # already made.  The mesh may instead be given already compiled,
+    # as by compile(), in which case only the upload is left to do.
+    #
+    @tracing.timed('upload')
+    def update(self,mesh):
+        if not isinstance(mesh,compiled):
+            mesh = compile(mesh,self.indexed,self.interleave)
+        self.width = mesh.width
+        self.count = mesh.count
+        self.nlines = mesh.nlines
+        for role,(target,array) in mesh.arrays.items():
+            if role in self.names:
+                self.manager.fill(target,self.names[role],array)
+            else:
+                self.names[role] = self.manager.make(target,array)
+
+        if self.interleave:
+            stride = self.width * 4
+            self.layout = {name: (self.names['data'],stride,offset * 4)
+                           for name,offset in LAYOUT if offset < self.width}
+        else:
+            self.layout = {name: (self.names[name],0,0)
+                           for name,_ in ATTRIBUTES if name in self.names}
+
+        if self.arrays is None and bool(glGenVertexArrays):
+            self.arrays = {'faces': self.record(self.names.get('index')),
+                           'lines': self.record(self.names.get('lines'))}
+
+    #
+    # B.specify(elements)
+    #
+    # Points each attribute location at its data, and binds the given
+    # element buffer, if any.
+    #
+    def specify(self,elements):
+        for name,(buffer,stride,offset) in self.layout.items():
+            h = LOCATION[name]
+            glEnableVertexAttribArray(h)
+            glBindBuffer(GL_ARRAY_BUFFER,buffer)
+            glVertexAttribPointer(h,3,GL_FLOAT,GL_FALSE,stride,c_void_p(offset))
+        if elements is not None:
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER,elements)
+
+    #
+    # B.record(elements)
+    #
+    # Makes a vertex array object capturing specify(elements).
+    #
+    def record(self,elements):
+        vao = glGenVertexArrays(1)
+        glBindVertexArray(vao)
+        self.specify(elements)
+        glBindVertexArray(0)
+        return vao
+
+    #
+    # B.bind(kind='faces')
+    #
+    # Sets up the attributes for drawing, with the element buffer of
+    # the faces or of the 'lines'.  Geometry without barycentric
+    # labels gives every vertex (1,1,1), which the shaders never take
+    # to be on an edge.
+    #
+    def bind(self,kind='faces'):
+        if self.arrays is not None:
+            glBindVertexArray(self.arrays[kind])
+        else:
+            self.specify(self.names.get('index' if kind == 'faces' else kind))
+        if 'bary' not in self.layout:
+            glVertexAttrib3f(LOCATION['bary'],1.0,1.0,1.0)
+
+    #
+    # B.unbind()
+    #
+    def unbind(self):
+        if self.arrays is not None:
+            glBindVertexArray(0)
+        else:
+            for name in self.layout:
+                glDisableVertexAttribArray(LOCATION[name])
+
+    #
+    # B.triangles()
+    #
+    # Draws the faces.  The buffers should be bound.
+    #
+    def triangles(self):
+        if self.indexed:
+            glDrawElements(GL_TRIANGLES,self.count,GL_UNSIGNED_INT,None)
+        else:
+            glDrawArrays(GL_TRIANGLES,0,self.count)
+
+    #
+    # B.lines()
+    #
+    # Draws the edges of indexed geometry.  The buffers should be
+    # bound for 'lines'.
+    #
+    def lines(self):
+        glDrawElements(GL_LINES,self.nlines,GL_UNSIGNED_INT,None)
+
+    #
+    # B.delete()
+    #
+    # Deletes the buffers and vertex array objects.
+    #
+    def delete(self):
+        if self.arrays is not None:
+            vaos = list(self.arrays.values())
+            glDeleteVertexArrays(len(vaos),vaos)
+            self.arrays = None
+        self.manager.delete(list(self.names.values()))
+        self.names = {}
+        self.layout = {}
+
+    @property
+    def nbytes(self):
+        return self.manager.nbytes(self.names.values())
+
+#
+# The glUniform call that sets a uniform of each type.
+#
+SETTERS = {GL_INT: lambda h,v: glUniform1i(h,v),
+           GL_FLOAT: lambda h,v: glUniform1f(h,v),
+           GL_FLOAT_VEC3: lambda h,v: glUniform3f(h,v[0],v[1],v[2])}
+
+#
+# class program
+#
+# A linked shader program, with
+#
+#  * name: its GL name
+#  * attributes: the location of each active attribute
+#  * uniforms: the location and type of each active uniform
+#  * values: the value last set for each uniform
+#
+# The built-in gl_ uniforms are left out.
+#
+class program:
+
+    def __init__(self,name):
+        self.name = name
+        self.attributes = {}
+        self.uniforms = {}
+        self.values = {}
+        for i in range(glGetProgramiv(name,GL_ACTIVE_ATTRIBUTES)):
+            attribute = glGetActiveAttrib(name,i)[0].decode()
+            if not attribute.startswith('gl_'):
+                self.attributes[attribute] = glGetAttribLocation(name,attribute)
+        for i in range(glGetProgramiv(name,GL_ACTIVE_UNIFORMS)):
+            uniform, _, kind = glGetActiveUniform(name,i)
+            uniform = uniform.decode()
+            if not uniform.startswith('gl_'):
+                self.uniforms[uniform] = (glGetUniformLocation(name,uniform),int(kind))
+
+    #
+    # S.use()
+    #
+    # Makes this the current program.
+    #
+    def use(self):
+        glUseProgram(self.name)
+
+    #
+    # S.set(uniform,value)
+    #
+    # Sets a uniform of this program, which should be in use, unless
+    # it already holds that value.  A vec3 is given as a tuple.
+    # Uniforms the program doesn't use are ignored.
+    #
+    def set(self,uniform,value):
+        if uniform not in self.uniforms or self.values.get(uniform) == value:
+            return
+        location, kind = self.uniforms[uniform]
+        SETTERS[kind](location,value)
+        self.values[uniform] = value
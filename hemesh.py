@@ -0,0 +1,738 @@
+#
+# hemesh.py
+#
+# Defines an array-backed twinned half-edge mesh, class "hemesh".  It
+# holds the same information as the "object" class of we.py, but
+# rather than building a Python object for every vertex, half-edge,
+# and face, it stores the connectivity as flat integer arrays and the
+# vertex positions as one contiguous float array:
+#
+#   source[h]: the vertex that half-edge h emanates from
+#   next[h]:   the next half-edge, counterclockwise, around h's face
+#   twin[h]:   the opposite half-edge, or -1 on the boundary
+#   face[h]:   the face to the left of half-edge h
+#
+#   out[v]:    an out-edge of vertex v, first on its fan if v is
+#              on the boundary (see vertex.set_first_edge in we.py)
+#   side[f]:   the first of the three half-edges bordering face f
+#
+#   position:  a V x 3 array of vertex coordinates
+#   normal:    a V x 3 array of vertex normals, or None
+#
+# When no vertex normals are given, they are computed in one pass over
+# the arrays, weighting each face by its area or by the angle of its
+# corner at the vertex (see WEIGHTINGS).  Moving vertices through
+# m.move marks them dirty, so that only the face and vertex normals
+# around them are recomputed when the normals are next asked for.
+#
+# Half-edges are laid out face by face, so that face f is bordered
+# by half-edges 3f, 3f+1, and 3f+2.
+#
+# The traversal vocabulary of we.py is kept by thin views.  The
+# classes hvertex, hedge, and hface each hold just a mesh and an
+# index, and answer around(), vertex(i), edge(i), and so on by
+# looking into the arrays.  Use hemesh.from_object and m.to_object
+# to move between the two representations.
+#
+
+import numpy as np
+from constants import EPSILON, COLOR
+from geometry import point, vector
+from we import vertex, face, object
+import tracing
+
+#
+# class hfan
+#
+# An iterator over the out-edges of a vertex, just like the fan
+# class of we.py, but walking the twin and next arrays.
+#
+class hfan:
+
+    __slots__ = ('vertex','which')
+
+    def __init__(self,vertex):
+        self.vertex = vertex
+        self.which = -1
+
+    def __iter__(self):
+        self.which = self.vertex.mesh.out[self.vertex.id]
+        return self
+
+    def __next__(self):
+        m = self.vertex.mesh
+        if self.which < 0:
+            raise StopIteration
+
+        current = self.which
+        after = m.twin[m.next[m.next[current]]]
+        if after >= 0 and after != m.out[self.vertex.id]:
+            self.which = after
+        else:
+            self.which = -1
+        return hedge(m,current)
+
+#
+# class hvertex
+#
+# A view of vertex 'id' of a hemesh.
+#
+class hvertex:
+
+    __slots__ = ('mesh','id')
+
+    def __init__(self,mesh,id):
+        self.mesh = mesh
+        self.id = int(id)
+
+    @property
+    def position(self):
+        return point.with_components(self.mesh.position[self.id].tolist())
+
+    @property
+    def edge(self):
+        h = self.mesh.out[self.id]
+        return hedge(self.mesh,h) if h >= 0 else None
+
+    def normal(self):
+        return vector.with_components(self.mesh.normals()[self.id].tolist())
+
+    def color(self):
+        return vector(*COLOR)
+
+    def around(self):
+        return hfan(self)
+
+    def __eq__(self,other):
+        return isinstance(other,hvertex) \
+            and other.mesh is self.mesh and other.id == self.id
+
+    def __hash__(self):
+        return hash((id(self.mesh),self.id,'v'))
+
+#
+# class hedge
+#
+# A view of half-edge 'id' of a hemesh.
+#
+class hedge:
+
+    __slots__ = ('mesh','id')
+
+    def __init__(self,mesh,id):
+        self.mesh = mesh
+        self.id = int(id)
+
+    @property
+    def source(self):
+        return hvertex(self.mesh,self.mesh.source[self.id])
+
+    @property
+    def next(self):
+        return hedge(self.mesh,self.mesh.next[self.id])
+
+    @property
+    def twin(self):
+        h = self.mesh.twin[self.id]
+        return hedge(self.mesh,h) if h >= 0 else None
+
+    @property
+    def face(self):
+        return hface(self.mesh,self.mesh.face[self.id])
+
+    def vertex(self,i):
+        if i == 0:
+            return self.source
+        elif i == 1:
+            return self.next.source
+        else:
+            return None
+
+    def vector(self):
+        return self.vertex(1).position - self.vertex(0).position
+
+    def direction(self):
+        return self.vector().unit()
+
+    def __eq__(self,other):
+        return isinstance(other,hedge) \
+            and other.mesh is self.mesh and other.id == self.id
+
+    def __hash__(self):
+        return hash((id(self.mesh),self.id,'e'))
+
+    def __str__(self):
+        return '<edge '+str(self.vertex(0).id)+':'+str(self.vertex(1).id)+'>'
+
+#
+# class hface
+#
+# A view of face 'id' of a hemesh.
+#
+class hface:
+
+    __slots__ = ('mesh','id')
+
+    def __init__(self,mesh,id):
+        self.mesh = mesh
+        self.id = int(id)
+
+    @property
+    def side(self):
+        return hedge(self.mesh,self.mesh.side[self.id])
+
+    def normal(self):
+        return vector.with_components(self.mesh.face_normals()[self.id].tolist())
+
+    def vertex(self,i):
+        if i > 2:
+            return None
+        else:
+            return self.edge(i).source
+
+    def edges(self):
+        return [self.edge(0),self.edge(1),self.edge(2)]
+
+    def edge(self,i):
+        if i == 0:
+            return self.side
+        elif i == 1:
+            return self.side.next
+        elif i == 2:
+            return self.side.next.next
+        else:
+            return None
+
+    def __eq__(self,other):
+        return isinstance(other,hface) \
+            and other.mesh is self.mesh and other.id == self.id
+
+    def __hash__(self):
+        return hash((id(self.mesh),self.id,'f'))
+
+#
+# class elements
+#
+# A read-only sequence of views, so that m.vertices[i], m.edges[i],
+# and m.faces[i] read like o.vertex[i] and o.face[i] do for objects.
+#
+class elements:
+
+    def __init__(self,mesh,kind,count):
+        self.mesh = mesh
+        self.kind = kind
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self,i):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError(i)
+        return self.kind(self.mesh,i)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.kind(self.mesh,i)
+
+#
+# The names of the arrays that make up a hemesh.
+#
+ARRAYS = ('position','normal','source','next','twin','face','out','side')
+
+#
+# Where each vertex attribute sits, in floats, within a row of the
+# interleaved data made by hemesh.pack.
+#
+LAYOUT = (('vertex',0),('normal',3),('color',6),('bary',9))
+
+#
+# The ways the normals of the faces around a vertex can be weighted
+# in its normal, the first being the default:
+#
+#  * 'area': by the area of each face
+#  * 'angle': by the angle of each face's corner at the vertex
+#
+WEIGHTINGS = ('area','angle')
+
+#
+# layout(arrays,lo,hi)
+#
+# Writes the entries of a mesh's arrays that follow from laying its
+# half-edges out face by face, for the half-edges lo..hi-1, which
+# must cover whole faces: their 'next' and 'face', the 'side' of
+# their faces, and the 'out' of each vertex that one of them leaves
+# along the boundary, so that its fan starts there as in m.link.
+# The arrays may be memory-mapped and written a range at a time.
+#
+def layout(arrays,lo,hi):
+    h = np.arange(lo,hi,dtype=np.int32)
+    arrays['next'][lo:hi] = h - h % 3 + (h + 1) % 3
+    arrays['face'][lo:hi] = h // 3
+    arrays['side'][lo // 3:hi // 3] = h[::3]
+    border = lo + np.nonzero(arrays['twin'][lo:hi] < 0)[0]
+    arrays['out'][arrays['source'][border]] = border
+
+#
+# laid_out(arrays,nv)
+#
+# Adds to a dictionary holding the 'source' and 'twin' arrays of a
+# mesh with nv vertices, laid out face by face, the 'next', 'face',
+# 'side', and 'out' arrays that m.link would make.  Returns the
+# dictionary.
+#
+def laid_out(arrays,nv):
+    nh = len(arrays['source'])
+    arrays['next'] = np.empty(nh,dtype=np.int32)
+    arrays['face'] = np.empty(nh,dtype=np.int32)
+    arrays['side'] = np.empty(nh // 3,dtype=np.int32)
+    arrays['out'] = np.full(nv,-1,dtype=np.int32)
+    arrays['out'][arrays['source']] = np.arange(nh,dtype=np.int32)
+    layout(arrays,0,nh)
+    return arrays
+
+#
+# match(source,target,nv)
+#
+# Finds the twin of every half-edge from source[h] to target[h] by
+# sorting the half-edges by their packed (source,target) key and
+# searching for each reversed key.  Returns the twin array, along
+# with the half-edges that share their directed key with another
+# half-edge (a badly oriented or non-manifold face).  These are
+# left without a twin.
+#
+def match(source,target,nv):
+    nv = np.int64(max(nv,1))
+    keys = source.astype(np.int64) * nv + target
+    order = np.argsort(keys,kind='stable')
+    ordered = keys[order]
+
+    same = ordered[1:] == ordered[:-1]
+    dup = np.zeros(len(keys),dtype=bool)
+    dup[order[1:][same]] = True
+    dup[order[:-1][same]] = True
+
+    twin = np.full(len(keys),-1,dtype=np.int32)
+    if len(keys) == 0:
+        return twin, np.nonzero(dup)[0]
+
+    rkeys = target.astype(np.int64) * nv + source
+    at = np.minimum(np.searchsorted(ordered,rkeys),len(keys)-1)
+    found = ordered[at] == rkeys
+    twin[found] = order[at[found]]
+
+    # Don't pair up anything whose key (or whose twin's key) is
+    # ambiguous.
+    bad = dup | (found & dup[np.maximum(twin,0)])
+    twin[bad] = -1
+
+    return twin, np.nonzero(dup)[0]
+
+#
+# class hemesh
+#
+# Array-backed twinned half-edge representation of an .obj file,
+# or its finer meshes.
+#
+class hemesh:
+
+    #
+    # hemesh(position,triangles,normal=None)
+    #
+    # Builds a mesh from a V x 3 array of positions and an F x 3
+    # array of vertex indices, each row giving the corners of a
+    # face in counterclockwise order.
+    #
+    def __init__(self,position,triangles,normal=None):
+        self.position = np.ascontiguousarray(position,dtype=np.float64).reshape(-1,3)
+        self.normal = None
+        if normal is not None:
+            self.normal = np.ascontiguousarray(normal,dtype=np.float64).reshape(-1,3)
+        self.weighting = WEIGHTINGS[0]
+        self.link(triangles)
+
+    #
+    # m.link(triangles)
+    #
+    # (Re)builds all the connectivity arrays from an F x 3 array of
+    # face corners.
+    #
+    def link(self,triangles):
+        tri = np.ascontiguousarray(triangles,dtype=np.int32).reshape(-1,3)
+        nf = len(tri)
+        nv = len(self.position)
+
+        self.source = tri.reshape(-1).copy()
+        h = np.arange(3*nf,dtype=np.int32)
+        self.next = (h - h % 3 + (h + 1) % 3).astype(np.int32)
+        self.face = (h // 3).astype(np.int32)
+        self.side = np.arange(0,3*nf,3,dtype=np.int32)
+
+        target = self.source[self.next]
+        self.twin, self.bad = match(self.source,target,nv)
+        if len(self.bad):
+            print('Bad orientation for %d half-edges, left without twins' % len(self.bad))
+
+        # Set each vertex's out edge, preferring the edge that
+        # starts an open fan.
+        self.out = np.full(nv,-1,dtype=np.int32)
+        self.out[self.source] = h
+        border = np.nonzero(self.twin < 0)[0].astype(np.int32)
+        self.out[self.source[border]] = border
+
+        self.forget_normals()
+
+    #
+    # hemesh.of_arrays(arrays)
+    #
+    # Rebuilds a mesh from a dictionary of the arrays named in ARRAYS,
+    # as were saved from another mesh, without relinking it.  The
+    # 'normal' entry may be missing.
+    #
+    @classmethod
+    def of_arrays(cls,arrays):
+        m = cls.__new__(cls)
+        for name in ARRAYS:
+            setattr(m,name,arrays.get(name))
+        m.bad = np.zeros(0,dtype=np.int64)
+        m.weighting = WEIGHTINGS[0]
+        m.forget_normals()
+        return m
+
+    #
+    # m.arrays()
+    #
+    # The dictionary of the mesh's arrays, by the names in ARRAYS.
+    #
+    def arrays(self):
+        return {name: getattr(self,name) for name in ARRAYS
+                if getattr(self,name) is not None}
+
+    #
+    # hemesh.from_object(o,normals=True)
+    #
+    # Builds the array representation of a we.py object.  Vertex and
+    # face ids are kept.  Vertex normals are carried over if the
+    # object's vertices have them set, unless normals is False.
+    #
+    @classmethod
+    def from_object(cls,o,normals=True):
+        position = np.array([V.position.components() for V in o.vertex],
+                            dtype=np.float64).reshape(-1,3)
+        triangles = np.array([[f.vertex(0).id,f.vertex(1).id,f.vertex(2).id]
+                              for f in o.face],dtype=np.int32).reshape(-1,3)
+        normal = None
+        if normals and any(V.vn is not None for V in o.vertex):
+            normal = np.array([(V.vn if V.vn is not None else V.normal()).components()
+                               for V in o.vertex],dtype=np.float64)
+        return cls(position,triangles,normal)
+
+    #
+    # m.to_object()
+    #
+    # Builds the we.py object, with its linked vertex, edge, and face
+    # instances, that matches this mesh.
+    #
+    def to_object(self):
+        o = object()
+        for P in self.position.tolist():
+            vertex(point(P[0],P[1],P[2]),o)
+        if self.normal is not None:
+            for V,n in zip(o.vertex,self.normal.tolist()):
+                V.set_normal(vector(n[0],n[1],n[2]))
+        vs = o.vertex
+        for a,b,c in self.triangles().tolist():
+            face(vs[a],vs[b],vs[c],o)
+        o.finish()
+        return o
+
+    #
+    # m.triangles()
+    #
+    # The F x 3 array of face corners.
+    #
+    def triangles(self):
+        e0 = self.side
+        e1 = self.next[e0]
+        e2 = self.next[e1]
+        return np.stack([self.source[e0],self.source[e1],self.source[e2]],axis=1)
+
+    #
+    # m.seats(hs)
+    #
+    # The face of each half-edge h in hs, and which of that face's
+    # sides h is: 0 for side[f], 1 for the one after, and 2 for the
+    # last.
+    #
+    def seats(self,hs):
+        f = self.face[hs]
+        e0 = self.side[f]
+        return f, np.where(e0 == hs,0,np.where(self.next[e0] == hs,1,2))
+
+    #
+    # m.target()
+    #
+    # The vertex that each half-edge points to.
+    #
+    def target(self):
+        return self.source[self.next]
+
+    #
+    # m.forget_normals()
+    #
+    # Drops the computed normals, so that they are all recomputed
+    # when next asked for.
+    #
+    def forget_normals(self):
+        self._cross = None
+        self._face_normals = None
+        self._sums = None
+        self._normals = None
+        self._moved = []
+
+    #
+    # m.set_weighting(weighting)
+    #
+    # Chooses how the vertex normals are weighted, one of WEIGHTINGS.
+    #
+    def set_weighting(self,weighting):
+        if weighting not in WEIGHTINGS:
+            raise ValueError('Unknown normal weighting: %s' % weighting)
+        if weighting != self.weighting:
+            self.weighting = weighting
+            self._sums = None
+            self._normals = None
+
+    #
+    # m.move(ids,P)
+    #
+    # Moves vertices ids to the positions in the rows of P, and marks
+    # the normals around them for recomputing.
+    #
+    def move(self,ids,P):
+        self.position[ids] = P
+        self.touch(ids)
+
+    #
+    # m.touch(ids)
+    #
+    # Marks the normals around vertices ids for recomputing, for when
+    # their positions were changed in place.
+    #
+    def touch(self,ids):
+        self._moved.append(np.asarray(ids,dtype=np.int64).reshape(-1))
+
+    #
+    # m.refresh()
+    #
+    # Recomputes the normals around the vertices that were moved.  The
+    # faces touching them get new normals, and then the vertices of
+    # those faces get new sums over their fans.
+    #
+    def refresh(self):
+        if not self._moved:
+            return
+        moved = np.unique(np.concatenate(self._moved))
+        self._moved = []
+        if self._cross is None:
+            self._normals = None
+            return
+
+        nv = len(self.position)
+        mark = np.zeros(nv,dtype=bool)
+        mark[moved] = True
+        faces = np.unique(self.face[mark[self.source]])
+        self._cross[faces] = self.crosses(faces)
+        self._face_normals[faces] = unit(self._cross[faces])
+
+        if self._sums is None:
+            self._normals = None
+            return
+        e0 = self.side[faces]
+        e1 = self.next[e0]
+        mark[self.source[e0]] = True
+        mark[self.source[e1]] = True
+        mark[self.source[self.next[e1]]] = True
+        hs = np.nonzero(mark[self.source])[0]
+        vs = np.nonzero(mark)[0]
+        self._sums[vs] = sums(np.searchsorted(vs,self.source[hs]),self.corners(hs),len(vs))
+        self._normals[vs] = unit(self._sums[vs])
+
+    #
+    # m.crosses(faces)
+    #
+    # The cross product of two sides of each of the given faces.  Its
+    # direction is the face's normal, and its length twice its area.
+    #
+    def crosses(self,faces):
+        e0 = self.side[faces]
+        e1 = self.next[e0]
+        P = self.position
+        A = P[self.source[e0]]
+        return np.cross(P[self.source[e1]] - A,P[self.source[self.next[e1]]] - A)
+
+    #
+    # m.corners(hs)
+    #
+    # The weighted normal that the corner of each half-edge h in hs,
+    # at the vertex source[h], adds to that vertex's normal.
+    #
+    def corners(self,hs):
+        if self.weighting == 'angle':
+            P = self.position
+            V = P[self.source[hs]]
+            n1 = self.next[hs]
+            a = unit(P[self.source[n1]] - V)
+            b = unit(P[self.source[self.next[n1]]] - V)
+            angle = np.arccos(np.clip(np.einsum('ij,ij->i',a,b),-1.0,1.0))
+            return self._face_normals[self.face[hs]] * angle[:,None]
+        return self._cross[self.face[hs]]
+
+    #
+    # m.face_normals()
+    #
+    # An F x 3 array of unit face normals, as by face.normal in we.py.
+    #
+    def face_normals(self):
+        self.refresh()
+        if self._face_normals is None:
+            self._cross = self.crosses(np.arange(len(self.side)))
+            self._face_normals = unit(self._cross)
+        return self._face_normals
+
+    #
+    # m.normals()
+    #
+    # A V x 3 array of vertex normals.  These are the ones given to
+    # the mesh, if any, otherwise the normalized, weighted sum of the
+    # normals of the faces around each vertex, as by vertex.normal in
+    # we.py.
+    #
+    def normals(self):
+        if self.normal is not None:
+            return self.normal
+        self.refresh()
+        if self._normals is None:
+            self.face_normals()
+            self._sums = sums(self.source,self.corners(np.arange(len(self.source))),
+                              len(self.position))
+            self._normals = unit(self._sums)
+        return self._normals
+
+    #
+    # m.compile(indexed=False)
+    #
+    # Produces the same triple of flat arrays as object.compile:
+    # positions, normals, and colors for every corner of every face.
+    # They are float32, ready to be handed to glBufferData as they
+    # are.
+    #
+    # With indexed=True, the three arrays instead hold one entry per
+    # vertex, and two more arrays of vertex indices follow them: the
+    # corners of each face, for drawing triangles, and the ends of
+    # each (undirected) edge, for drawing a wireframe as lines.
+    #
+    def compile(self,indexed=False):
+        data, indices, lines = self.pack(indexed)
+        varray = data[:,0:3].reshape(-1)
+        narray = data[:,3:6].reshape(-1)
+        carray = data[:,6:9].reshape(-1)
+        if not indexed:
+            return (varray,narray,carray)
+        return (varray,narray,carray,indices,lines)
+
+    #
+    # m.pack(indexed=False)
+    #
+    # Produces the vertex data of m.compile interleaved into a single
+    # float32 array, one row per vertex laid out as given by LAYOUT.
+    # Without indexing there is a row per face corner, which also
+    # carries that corner's barycentric coordinates.  Returns the
+    # array along with the triangle and line indices, which are None
+    # when not indexed.
+    #
+    @tracing.timed('pack')
+    def pack(self,indexed=False):
+        if indexed:
+            data = np.empty((len(self.position),9),dtype=np.float32)
+            data[:,0:3] = self.position
+            data[:,3:6] = self.normals()
+            data[:,6:9] = COLOR
+            indices = self.triangles().reshape(-1).astype(np.uint32)
+            return data, indices, self.lines()
+
+        corners = self.triangles().reshape(-1)
+        data = np.empty((len(corners),12),dtype=np.float32)
+        data[:,0:3] = self.position[corners]
+        data[:,3:6] = self.normals()[corners]
+        data[:,6:9] = COLOR
+        data[:,9:12].reshape(-1,3,3)[:] = np.eye(3,dtype=np.float32)
+        return data, None, None
+
+    #
+    # m.lines()
+    #
+    # The two ends of each undirected edge, as a flat uint32 array.
+    #
+    def lines(self):
+        h = np.arange(len(self.source))
+        first = (self.twin < 0) | (h < self.twin)
+        lines = np.stack([self.source[first],self.target()[first]],axis=1)
+        return lines.reshape(-1).astype(np.uint32)
+
+    #
+    # Element views, to be used like o.vertex, o.edge, and o.face.
+    #
+    @property
+    def vertices(self):
+        return elements(self,hvertex,len(self.position))
+
+    @property
+    def edges(self):
+        return elements(self,hedge,len(self.source))
+
+    @property
+    def faces(self):
+        return elements(self,hface,len(self.side))
+
+    #
+    # m.nbytes
+    #
+    # The number of bytes held by the mesh's arrays.
+    #
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays().values())
+
+#
+# sums(into,values,n)
+#
+# Sums the rows of an N x 3 array into n rows, row into[h] for each h.
+#
+def sums(into,values,n):
+    return np.stack([np.bincount(into,values[:,k],minlength=n) for k in range(3)],axis=1)
+
+#
+# unit(vs)
+#
+# Normalizes each row of an N x 3 array, sending tiny rows to
+# (1,0,0) like vector.unit does.
+#
+def unit(vs):
+    n = np.sqrt(np.einsum('ij,ij->i',vs,vs))
+    small = n < EPSILON
+    us = vs / np.where(small,1.0,n)[:,None]
+    us[small] = (1.0,0.0,0.0)
+    return us
+
+#
+# made(m)
+#
+# The size of hemesh m, as increments of the tracing counters of what
+# refinement has made.
+#
+def made(m):
+    return {'faces made': len(m.side),'half-edges made': len(m.source),
+            'vertices made': len(m.position)}
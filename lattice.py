@@ -0,0 +1,321 @@
+#
+# lattice.py
+#
+# Loop refinement straight to level N.  After N levels each face of
+# the control mesh has become a regular triangular lattice with 2^N
+# segments to a side, so the topology of the level-N mesh can be
+# written down directly, face by face, rather than found by splitting
+# and relinking each level in between.
+#
+# With s = 2^k, the lattice of a face with corners v0, v1, v2 has a
+# point (i,j) for each i,j >= 0 with i+j <= s; (0,0) is v0, (s,0) is
+# v1, and (0,s) is v2.  Its vertices are numbered the same way on
+# every level:
+#
+#   * the control vertices, keeping their ids;
+#   * then, for each control edge in the order of loop.edge_ids, its
+#     s-1 inner points, running from the source of its first
+#     half-edge to its target;
+#   * then, for each face, its inner points, row by row.
+#
+# so that a point on an edge gets the same id from the faces on both
+# sides of it.  Only the positions need to be carried from level to
+# level.  Each step applies Loop's rules over the triangles of the
+# lattices, without building the twinned mesh for that level, and the
+# twins of the level N mesh are read off the lattices too, rather than
+# found by sorting.  So little more than the level N mesh is ever
+# held at once.
+#
+# The result has the same vertices, faces, and positions as N calls
+# of loop.refine, to rounding, but numbered differently.
+#
+# To compare the time and peak memory with repeated refinement:
+#
+#    python3 lattice.py objs/stell.obj 3 7
+#
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+from hemesh import hemesh, made, laid_out
+from loop import edge_ids, beta, boundary
+import loop
+import tracing
+
+#
+# class template
+#
+# The lattice of one face on the level with s segments to a side:
+#
+#  * I, J: the lattice coordinates of each of its T points
+#  * at: the point index of each (i,j), as an (s+1) x (s+1) array
+#  * triangles: its s*s triangles, as point indices, counterclockwise
+#  * sides: for each triangle side that lies along a side of the
+#    face, which side (0 from v0 to v1, 1 from v1 to v2, 2 from v2
+#    to v0), or -1
+#
+class template:
+
+    def __init__(self,s):
+        self.s = s
+        I, J = np.nonzero(np.add.outer(np.arange(s+1),np.arange(s+1)) <= s)
+        self.I = I
+        self.J = J
+        self.at = np.full((s+1,s+1),-1,dtype=np.int64)
+        self.at[I,J] = np.arange(len(I))
+
+        # 'Up' triangles (i,j),(i+1,j),(i,j+1), and 'down' ones
+        # (i+1,j),(i+1,j+1),(i,j+1).
+        up = (I + J) < s
+        i, j = I[up], J[up]
+        ups = np.stack([self.at[i,j],self.at[i+1,j],self.at[i,j+1]],axis=1)
+        sides = np.full((len(i),3),-1,dtype=np.int64)
+        sides[j == 0,0] = 0
+        sides[i + j == s - 1,1] = 1
+        sides[i == 0,2] = 2
+        down = (I + J) < s - 1
+        i, j = I[down], J[down]
+        downs = np.stack([self.at[i+1,j],self.at[i+1,j+1],self.at[i,j+1]],axis=1)
+        self.triangles = np.concatenate([ups,downs])
+        self.sides = np.concatenate([sides,np.full((len(i),3),-1,dtype=np.int64)])
+        self.link()
+
+    #
+    # T.link()
+    #
+    # Finds the twin of each half-edge 3t+k of the lattice's
+    # triangles, from corner k of triangle t to the next.  Those
+    # inside the lattice are kept in 'twin', and those along its
+    # sides, which are -1 there, in 'outside': the half-edge of
+    # segment u of side q, counting from the side's start, is
+    # outside[q,u].
+    #
+    def link(self):
+        s = self.s
+        n = len(self.I)
+        a = self.triangles.reshape(-1)
+        b = np.roll(self.triangles,-1,axis=1).reshape(-1)
+        keys = a * n + b
+        order = np.argsort(keys)
+        found = np.searchsorted(keys[order],b * n + a)
+        found = np.minimum(found,len(keys) - 1)
+        hit = keys[order][found] == b * n + a
+        self.twin = np.where(hit,order[found],-1)
+
+        q = self.sides.reshape(-1)
+        self.outside = np.empty((3,s),dtype=np.int64)
+        for side,u in ((0,self.I[a]),(1,self.J[a]),(2,s - self.J[a])):
+            on = q == side
+            self.outside[side,u[on]] = np.nonzero(on)[0]
+
+    def __len__(self):
+        return len(self.I)
+
+    #
+    # T.edge(t,side)
+    #
+    # The point at step t along the given side of the face.
+    #
+    def edge(self,t,side):
+        s = self.s
+        return [self.at[t,0],self.at[s-t,t],self.at[0,s-t]][side]
+
+#
+# numbering(m,T,eid,first)
+#
+# The global vertex id of every lattice point of every face of m, as
+# an F x len(T) array, for the level given by template T.
+#
+def numbering(m,T,eid,first):
+    s = T.s
+    nv = len(m.position)
+    ne = len(first)
+    nf = len(m.side)
+    e0 = m.side
+    sides = [e0,m.next[e0],m.next[m.next[e0]]]
+
+    ids = np.empty((nf,len(T)),dtype=np.int64)
+    for k,h in enumerate(sides):
+        ids[:,T.edge(0,k)] = m.source[h]
+        if s > 1:
+            t = np.arange(1,s)
+            forward = (first[eid[h]] == h)[:,None]
+            along = np.where(forward,t - 1,s - 1 - t)
+            ids[:,[T.edge(u,k) for u in t]] = nv + eid[h][:,None] * (s - 1) + along
+
+    inner = (T.I > 0) & (T.J > 0) & (T.I + T.J < s)
+    ni = int(np.count_nonzero(inner))
+    ids[:,inner] = nv + ne * (s - 1) + np.arange(nf)[:,None] * ni + np.arange(ni)
+    return ids
+
+#
+# step(P,tri,sides,rim,even,odd,n)
+#
+# Applies one level of Loop's rules to positions P of the vertices of
+# the triangles tri.  Triangle sides flagged in 'sides' lie on the
+# boundary, and the vertices flagged in 'rim' are on it.  The old
+# vertex v becomes new vertex even[v], and the point between the
+# corners of side k of triangle t is new vertex odd[t,k].  Returns
+# the n x 3 array of new positions.
+#
+def step(P,tri,sides,rim,even,odd,n):
+    nv = len(P)
+    a = tri.reshape(-1)
+    b = np.roll(tri,-1,axis=1).reshape(-1)
+    c = np.roll(tri,-2,axis=1).reshape(-1)
+    border = sides.reshape(-1)
+
+    def total(into,values,n):
+        return np.stack([np.bincount(into,values[:,k],minlength=n) for k in range(3)],axis=1)
+
+    # Even vertices.
+    valence = np.bincount(a,minlength=nv)
+    bs = beta(valence)
+    ring = total(a,P[b],nv)
+    Q = np.where(valence[:,None] > 0,(1.0 - valence*bs)[:,None] * P + bs[:,None] * ring,P)
+    ends = np.concatenate([a[border],b[border]])
+    others = np.concatenate([b[border],a[border]])
+    Q[rim] = 3.0/4.0 * P[rim] + 1.0/8.0 * total(ends,P[others],nv)[rim]
+
+    # Odd vertices.  Inner sides get half of the weights from each of
+    # their two triangles.
+    mid = odd.reshape(-1)
+    w = np.where(border,1.0/2.0,3.0/16.0)[:,None]
+    v = np.where(border,0.0,1.0/8.0)[:,None]
+    R = total(mid,w * (P[a] + P[b]) + v * P[c],n)
+    R[even] = Q
+    return R
+
+#
+# refine_to(m,levels)
+#
+# Returns the hemesh made by refining m the given number of times, as
+# by repeated loop.refine, without building the levels in between.
+#
+@tracing.timed('lattice.refine_to',made)
+def refine_to(m,levels):
+    if levels == 0:
+        return hemesh(m.position,m.triangles())
+
+    ne, eid = edge_ids(m)
+    h = np.arange(len(m.source))
+    first = np.nonzero((m.twin < 0) | (h < m.twin))[0]
+    outer = np.stack([m.twin[m.side] < 0,
+                      m.twin[m.next[m.side]] < 0,
+                      m.twin[m.next[m.next[m.side]]] < 0],axis=1)
+    rim_edges = np.nonzero(m.twin[first] < 0)[0]
+    on = boundary(m)
+
+    P = m.position
+    T = template(1)
+    ids = numbering(m,T,eid,first)
+    for k in range(levels):
+        U = template(2*T.s)
+        after = numbering(m,U,eid,first)
+        n = len(m.position) + ne * (U.s - 1) + len(m.side) * (U.s - 1) * (U.s - 2) // 2
+
+        # The triangles of this level, and which of their sides lie
+        # on the boundary.
+        tri = ids[:,T.triangles].reshape(-1,3)
+        fs = np.repeat(np.arange(len(m.side)),len(T.triangles))
+        which = np.tile(T.sides,(len(m.side),1))
+        sides = (which >= 0) & outer[fs[:,None],np.maximum(which,0)]
+
+        # The boundary vertices of this level: those on the control
+        # boundary, and the points along its edges.
+        rim = np.zeros(len(P),dtype=bool)
+        rim[:len(m.position)] = on
+        if T.s > 1:
+            along = rim_edges[:,None] * (T.s - 1) + np.arange(T.s - 1)
+            rim[len(m.position) + along] = True
+
+        # Where each old vertex and each side's midpoint land.
+        even = np.empty(len(P),dtype=np.int64)
+        even[ids] = after[:,U.at[2*T.I,2*T.J]]
+        corners = T.triangles
+        I2 = T.I[corners] + T.I[np.roll(corners,-1,axis=1)]
+        J2 = T.J[corners] + T.J[np.roll(corners,-1,axis=1)]
+        odd = after[:,U.at[I2,J2].reshape(-1)].reshape(-1,3)
+
+        P = step(P,tri,sides,rim,even,odd,n)
+        del tri, fs, which, sides, even, odd
+        T, ids = U, after
+
+    return assemble(m,T,ids,P)
+
+#
+# assemble(m,T,ids,P)
+#
+# Builds the hemesh of the lattices of template T over the faces of m,
+# numbered by ids, with vertex positions P.  The half-edges are laid
+# out as by hemesh.link, but their twins are read off the template
+# and the control mesh rather than found by matching.
+#
+def assemble(m,T,ids,P):
+    nf = len(m.side)
+    per = 3 * len(T.triangles)
+    s = T.s
+    base = np.arange(nf,dtype=np.int64)[:,None] * per
+    twin = np.where(T.twin >= 0,base + T.twin,-1)
+
+    # The half-edges along each side of a face run against those
+    # along the matching side of its neighbor, in reverse.
+    e0 = m.side
+    sides = [e0,m.next[e0],m.next[m.next[e0]]]
+    for q,h in enumerate(sides):
+        tw = m.twin[h]
+        g, l = m.seats(np.maximum(tw,0))
+        u = np.arange(s)
+        across = g[:,None].astype(np.int64) * per + T.outside[l][:,::-1]
+        twin[:,T.outside[q][u]] = np.where((tw >= 0)[:,None],across,-1)
+
+    arrays = {'position': P,
+              'source': ids[:,T.triangles].reshape(-1).astype(np.int32),
+              'twin': twin.reshape(-1).astype(np.int32)}
+    del twin
+    return hemesh.of_arrays(laid_out(arrays,len(P)))
+
+#
+# measure(run)
+#
+# Runs run() and returns its result, the seconds it took, and the
+# peak bytes allocated while it ran.
+#
+def measure(run):
+    tracemalloc.start()
+    start = time.time()
+    result = run()
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+#
+# compare(m,lo,hi)
+#
+# Prints the time and peak memory of refine_to(m,N) and of N calls of
+# loop.refine(m), for N from lo to hi.
+#
+def compare(m,lo,hi):
+    print('%5s %10s %10s %12s %10s %12s' % ('level','faces','refine_to','peak','repeated','peak'))
+    for levels in range(lo,hi+1):
+        def repeated():
+            r = m
+            for _ in range(levels):
+                r = loop.refine(r)
+            return r
+        r, t1, p1 = measure(lambda: refine_to(m,levels))
+        del r
+        r, t2, p2 = measure(repeated)
+        print('%5d %10d %9.3fs %12d %9.3fs %12d'
+              % (levels,len(r.side),t1,p1,t2,p2))
+        del r
+
+
+if __name__ == '__main__':
+    import objio
+    m = objio.load(sys.argv[1] if len(sys.argv) > 1 else 'objs/stell.obj')
+    lo = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    hi = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+    compare(m,lo,hi)
@@ -0,0 +1,207 @@
+#
+# levels.py
+#
+# Defines class "hierarchy", the refinement levels of a control mesh
+# kept around for viewing.  Level 0 is the control mesh, and level
+# k+1 is the Loop refinement of level k.  Each level holds its hemesh
+# and, once it has been shown, whatever GPU buffers were compiled for
+# it.  Moving between levels that are held is then just a matter of
+# switching buffers.
+#
+# Levels cost memory, quadrupling with each refinement.  When the
+# bytes held by all levels exceed a budget, the least recently viewed
+# levels are dropped first.  The control mesh and the level being
+# viewed are never dropped; a dropped level is rebuilt from the
+# nearest coarser level still held when it is asked for again.
+#
+# A level can also be built away from the hierarchy, say on another
+# thread, by refining the mesh that below(k) gives with build(), and
+# then handed over with put().
+#
+
+from loop import refine
+from lattice import refine_to
+
+#
+# build(mesh,steps)
+#
+# The hemesh made by refining 'mesh' the given number of times.
+#
+def build(mesh,steps):
+    if steps == 0:
+        return mesh
+    if steps == 1:
+        return refine(mesh)
+    return refine_to(mesh,steps)
+
+#
+# class level
+#
+# One level of the hierarchy.
+#
+#  * mesh: its hemesh
+#  * buffers: the GPU buffers compiled for it, or None
+#  * nbytes: the size of those buffers in bytes
+#  * stale: whether those buffers are to be refilled before drawing
+#  * viewed: when it was last viewed, as a tick of the hierarchy
+#
+class level:
+
+    def __init__(self,mesh):
+        self.mesh = mesh
+        self.buffers = None
+        self.nbytes = 0
+        self.stale = False
+        self.viewed = 0
+
+    #
+    # L.usage()
+    #
+    # Bytes held by this level's mesh and its GPU buffers.
+    #
+    def usage(self):
+        return self.mesh.nbytes + self.nbytes
+
+#
+# class hierarchy
+#
+class hierarchy:
+
+    #
+    # hierarchy(control,budget,release=None)
+    #
+    # Starts a hierarchy at the hemesh 'control', holding at most
+    # 'budget' bytes.  When a level with GPU buffers is dropped, those
+    # buffers are given to release(buffers) to be freed.
+    #
+    def __init__(self,control,budget,release=None):
+        self.levels = {0: level(control)}
+        self.budget = budget
+        self.release = release
+        self.current = 0
+        self.tick = 0
+
+    #
+    # H.get(k)
+    #
+    # Returns level k, refined straight from the finest level below
+    # it that is held, without building the levels in between.
+    #
+    def get(self,k):
+        if k not in self.levels:
+            below, mesh = self.below(k)
+            self.levels[k] = level(build(mesh,k - below))
+        return self.levels[k]
+
+    #
+    # H.below(k)
+    #
+    # The finest level at or below k that is held, and its hemesh.
+    #
+    def below(self,k):
+        j = max(j for j in self.levels if j <= k)
+        return j, self.levels[j].mesh
+
+    #
+    # H.put(k,mesh)
+    #
+    # Holds hemesh 'mesh', built elsewhere, as level k, unless level k
+    # is already held.  Returns the level.
+    #
+    def put(self,k,mesh):
+        if k not in self.levels:
+            self.levels[k] = level(mesh)
+        return self.levels[k]
+
+    #
+    # H.view(k)
+    #
+    # Makes level k the one being viewed, building it if needed, and
+    # then drops levels to get back under budget.  Returns the level.
+    #
+    def view(self,k):
+        L = self.get(k)
+        self.current = k
+        self.tick += 1
+        L.viewed = self.tick
+        self.evict()
+        return L
+
+    #
+    # H.attach(k,buffers,nbytes)
+    #
+    # Records the GPU buffers compiled, or refilled, for level k.
+    #
+    def attach(self,k,buffers,nbytes):
+        L = self.levels[k]
+        L.buffers = buffers
+        L.nbytes = nbytes
+        L.stale = False
+        self.evict()
+
+    #
+    # H.drop(k)
+    #
+    # Lets go of level k and its buffers.
+    #
+    def drop(self,k):
+        L = self.levels.pop(k)
+        if L.buffers is not None and self.release is not None:
+            self.release(L.buffers)
+        L.buffers = None
+
+    #
+    # H.outdate()
+    #
+    # Marks the GPU buffers of every level stale, for when they are to
+    # be compiled differently.  The buffers are kept, to be refilled
+    # when their level is next shown.
+    #
+    def outdate(self):
+        for L in self.levels.values():
+            L.stale = L.buffers is not None
+
+    #
+    # H.evict()
+    #
+    # Drops the least recently viewed levels until the hierarchy fits
+    # its budget, or until only the control mesh and the current
+    # level are left.
+    #
+    def evict(self):
+        while self.total() > self.budget:
+            victims = [k for k in self.levels if k != 0 and k != self.current]
+            if not victims:
+                break
+            self.drop(min(victims,key=lambda k: (self.levels[k].viewed,-k)))
+
+    #
+    # H.usage()
+    #
+    # A dictionary giving the bytes held by each level.
+    #
+    def usage(self):
+        return {k: self.levels[k].usage() for k in sorted(self.levels)}
+
+    #
+    # H.total()
+    #
+    # The bytes held by all the levels.
+    #
+    def total(self):
+        return sum(L.usage() for L in self.levels.values())
+
+    #
+    # H.report()
+    #
+    # A printable summary of the levels held and their sizes.
+    #
+    def report(self):
+        lines = []
+        for k,nbytes in self.usage().items():
+            L = self.levels[k]
+            mark = '*' if k == self.current else ' '
+            lines.append('%s level %d: %8d faces %12d bytes (mesh %d, buffers %d)'
+                         % (mark,k,len(L.mesh.side),nbytes,L.mesh.nbytes,L.nbytes))
+        lines.append('  total: %d of %d bytes' % (self.total(),self.budget))
+        return '\n'.join(lines)
@@ -0,0 +1,191 @@
+#
+# limit.py
+#
+# The points and normals of the Loop limit surface at the vertices of
+# a hemesh.  Repeated refinement moves every vertex toward a limit
+# position that can be found directly from its one-ring, and the
+# surface's tangent plane there is found from the ring too.  Moving
+# the vertices of a mesh to their limit positions, and shading it
+# with the limit normals, makes a coarse level look like a much finer
+# one.
+#
+# For an interior vertex v of valence n, with neighbors p_0..p_{n-1}
+# in counterclockwise order,
+#
+#   limit:    (w v + sum(p_i)) / (w + n), where w = 3 / (8 beta(n))
+#   tangents: sum(cos(2 pi i/n) p_i) and sum(sin(2 pi i/n) p_i)
+#
+# For a boundary vertex v with neighbors p_0..p_k, from one boundary
+# neighbor around to the other, the boundary is a cubic B-spline:
+#
+#   limit:    1/6 p_0 + 2/3 v + 1/6 p_k
+#
+# and the tangents are the left eigenvectors of the subdivision matrix
+# of v's ring, for its two largest eigenvalues below 1.  Under this
+# scheme's boundary rules (3/4 v + 1/8 p_0 + 1/8 p_k for v itself,
+# 1/2 v + 1/2 p_i for the boundary edges, 3/8 v + 3/8 p_i + 1/8 p_{i-1}
+# + 1/8 p_{i+1} for the interior ones) these are not the masks that
+# Hoppe et al. give for their modified rules, and for k > 6 neither is
+# p_0 - p_k.  The normal is the cross product of the tangents.
+#
+
+import numpy as np
+from math import pi
+from hemesh import hemesh, unit
+from loop import beta
+
+#
+# rings(m)
+#
+# The one-ring of every vertex of m, all walked at once.  Returns a
+# V x K array of neighbors, each row in counterclockwise order and
+# padded with -1, along with the number of neighbors of each vertex
+# and a flag for the vertices whose ring is open (on the boundary).
+# The ring of a boundary vertex starts and ends at its two boundary
+# neighbors.
+#
+def rings(m):
+    nv = len(m.position)
+    start = m.out.astype(np.int64)
+    target = m.target()
+    valence = np.bincount(m.source,minlength=nv)
+    width = int(valence.max()) + 1 if nv > 0 else 1
+    ring = np.full((nv,width),-1,dtype=np.int64)
+    count = np.zeros(nv,dtype=np.int64)
+    border = np.zeros(nv,dtype=bool)
+
+    walking = np.nonzero(start >= 0)[0]
+    h = start[walking]
+    for k in range(width):
+        if len(walking) == 0:
+            break
+        ring[walking,k] = target[h]
+        count[walking] += 1
+        back = m.next[m.next[h]]
+        after = m.twin[back]
+
+        # An edge with no twin ends an open fan with the source of
+        # the face's last edge.
+        ends = after < 0
+        v = walking[ends]
+        ring[v,k+1] = m.source[back[ends]]
+        count[v] += 1
+        border[v] = True
+
+        going = ~ends & (after != start[walking])
+        walking = walking[going]
+        h = after[going].astype(np.int64)
+    return ring, count, border
+
+#
+# The tangent masks of boundary vertices, by their number of faces.
+#
+MASKS = {}
+
+#
+# masks(k)
+#
+# The two tangent masks of a boundary vertex with k faces, as arrays
+# of weights for v, p_0..p_k: the left eigenvectors of its subdivision
+# matrix for the two largest eigenvalues below 1, the first running
+# from p_k toward p_0 and the second into the surface.
+#
+def masks(k):
+    if k not in MASKS:
+        S = np.zeros((k+2,k+2))
+        S[0,[0,1,k+1]] = 3/4, 1/8, 1/8
+        for r in range(1,k+2):
+            if r == 1 or r == k+1:
+                S[r,[0,r]] = 1/2, 1/2
+            else:
+                S[r,[0,r,r-1,r+1]] = 3/8, 3/8, 1/8, 1/8
+        value, vector = np.linalg.eig(S.T)
+        value, vector = value.real, vector.real
+        order = [j for j in np.argsort(-value,kind='stable') if value[j] < 1 - 1e-9]
+        along = vector[:,order[0]]
+        for j in order[1:]:
+            across = vector[:,j]
+            if np.linalg.matrix_rank(np.c_[along,across],tol=1e-8) == 2:
+                break
+
+        # Orient them on a flat ring, counterclockwise about v.
+        t = pi * np.arange(k+1) / k
+        flat = np.c_[np.r_[0.0,np.cos(t)],np.r_[-0.25,np.sin(t)]]
+        a, b = along @ flat, across @ flat
+        if a[0] < 0:
+            along = -along
+            a = -a
+        if a[0]*b[1] - a[1]*b[0] < 0:
+            across = -across
+        MASKS[k] = along, across
+    return MASKS[k]
+
+#
+# stencils(m)
+#
+# The limit position and two tangents of every vertex of m, as three
+# V x 3 arrays.
+#
+def stencils(m):
+    P = m.position
+    ring, count, border = rings(m)
+    width = ring.shape[1]
+    Q = np.where((ring >= 0)[:,:,None],P[np.maximum(ring,0)],0.0)
+    i = np.arange(width)[None,:]
+
+    limit = P.copy()
+    t1 = np.zeros_like(P)
+    t2 = np.zeros_like(P)
+
+    # Interior vertices.
+    inner = ~border & (count > 0)
+    n = count[inner]
+    w = 3.0 / (8.0 * beta(n))
+    limit[inner] = (w[:,None] * P[inner] + Q[inner].sum(axis=1)) / (w + n)[:,None]
+    angle = 2.0 * pi * i / np.maximum(n,1)[:,None]
+    t1[inner] = np.einsum('vk,vkj->vj',np.cos(angle),Q[inner])
+    t2[inner] = np.einsum('vk,vkj->vj',np.sin(angle),Q[inner])
+
+    # Boundary vertices, with k+1 neighbors p_0..p_k.
+    rim = np.nonzero(border)[0]
+    k = count[rim] - 1
+    first = Q[rim,0]
+    last = Q[rim,k]
+    V = P[rim]
+    limit[rim] = first/6.0 + 2.0*V/3.0 + last/6.0
+    for j in np.unique(k):
+        row = k == j
+        along, across = masks(int(j))
+        around = np.concatenate((V[row,None],Q[rim[row],:j+1]),axis=1)
+        t1[rim[row]] = np.einsum('k,vkj->vj',along,around)
+        t2[rim[row]] = np.einsum('k,vkj->vj',across,around)
+
+    return limit, t1, t2
+
+#
+# positions(m)
+#
+# The limit position of every vertex of m, as a V x 3 array.
+#
+def positions(m):
+    return stencils(m)[0]
+
+#
+# normals(m)
+#
+# The unit normal of the limit surface at every vertex of m, as a
+# V x 3 array.
+#
+def normals(m):
+    _, t1, t2 = stencils(m)
+    return unit(np.cross(t1,t2))
+
+#
+# project(m)
+#
+# A copy of hemesh m with every vertex moved to its limit position,
+# and carrying the limit normals as its vertex normals.
+#
+def project(m):
+    limit, t1, t2 = stencils(m)
+    return hemesh(limit,m.triangles(),unit(np.cross(t1,t2)))
@@ -0,0 +1,187 @@
+#
+# loop.py
+#
+# Batched Loop subdivision of a hemesh.  Rather than walking faces one
+# at a time, each refinement is done with whole-array operations in
+# two parts:
+#
+#   split(m):   the connectivity of the refined mesh.  Every face is
+#               split into four, with one new "odd" vertex per
+#               undirected edge.
+#
+#   weights(m): the refined positions, as a sparse matrix of weights
+#               applied to the positions of m.  The old "even"
+#               vertices come first, numbered as in m, and then the
+#               odd vertices in the order of their edges.
+#
+# The weights are Loop's:
+#
+#   odd, interior edge ab with opposite corners c and d:
+#       3/8 (a + b) + 1/8 (c + d)
+#   odd, boundary edge ab:
+#       1/2 (a + b)
+#   even, interior vertex v of valence n with neighbors p_i:
+#       (1 - n beta) v + beta sum(p_i),
+#       where beta = (5/8 - (3/8 + 1/4 cos(2 pi/n))^2) / n
+#   even, boundary vertex v with boundary neighbors b0 and b1:
+#       3/4 v + 1/8 (b0 + b1)
+#
+# This yields the same mesh, vertex for vertex and face for face, as
+# object.refine(batched=False) in we.py.
+#
+
+import numpy as np
+from math import pi
+from hemesh import hemesh, made
+import tracing
+
+#
+# edge_ids(m)
+#
+# Numbers the undirected edges of m.  Returns the number of edges,
+# along with an array giving the edge number of each half-edge.
+# Edges are numbered in the order of their first half-edge.
+#
+def edge_ids(m):
+    h = np.arange(len(m.source),dtype=np.int32)
+    first = (m.twin < 0) | (h < m.twin)
+    ne = int(np.count_nonzero(first))
+    eid = np.empty(len(h),dtype=np.int32)
+    eid[first] = np.arange(ne,dtype=np.int32)
+    eid[~first] = eid[m.twin[~first]]
+    return ne, eid
+
+#
+# split(m)
+#
+# Computes the faces of the refinement of m.  Face f with corners
+# v0,v1,v2 and edge points m0,m1,m2 (m0 on edge v0v1, and so on)
+# becomes the four faces
+#
+#   (v0,m0,m2) (v1,m1,m0) (v2,m2,m1) (m0,m1,m2)
+#
+# numbered 4f through 4f+3.  Returns the 4F x 3 array of corners and
+# the number of vertices of the refined mesh.
+#
+def split(m):
+    nv = len(m.position)
+    ne, eid = edge_ids(m)
+
+    e0 = m.side
+    e1 = m.next[e0]
+    e2 = m.next[e1]
+    v0, v1, v2 = m.source[e0], m.source[e1], m.source[e2]
+    m0, m1, m2 = nv + eid[e0], nv + eid[e1], nv + eid[e2]
+
+    children = np.stack([v0,m0,m2, v1,m1,m0, v2,m2,m1, m0,m1,m2],axis=1)
+    return children.reshape(-1,3), nv + ne
+
+#
+# boundary(m)
+#
+# Flags the vertices of m that lie on a boundary edge.
+#
+def boundary(m):
+    border = np.nonzero(m.twin < 0)[0]
+    on = np.zeros(len(m.position),dtype=bool)
+    on[m.source[border]] = True
+    on[m.source[m.next[border]]] = True
+    return on
+
+#
+# beta(n)
+#
+# Loop's neighbor weight for interior vertices of valence n.
+#
+def beta(n):
+    n = np.maximum(n,1).astype(np.float64)
+    return (5.0/8.0 - (3.0/8.0 + np.cos(2.0*pi/n)/4.0)**2) / n
+
+#
+# weights(m)
+#
+# Computes the sparse matrix that takes the positions of m to those
+# of its refinement.  Returns it as three arrays (rows, cols, vals)
+# of matching length, one entry per weight.  Repeated (row,col)
+# pairs are to be summed.
+#
+def weights(m):
+    nv = len(m.position)
+    nh = len(m.source)
+    ne, eid = edge_ids(m)
+
+    h = np.arange(nh,dtype=np.int32)
+    a = m.source
+    b = m.source[m.next]
+    c = m.source[m.next[m.next]]
+    border = m.twin < 0
+    on = boundary(m)
+
+    rows = []
+    cols = []
+    vals = []
+
+    # Even vertices in the interior.
+    valence = np.bincount(a,minlength=nv)
+    inner = ~on
+    bs = beta(valence)
+    centers = np.nonzero(inner)[0]
+    rows.append(centers)
+    cols.append(centers)
+    vals.append(np.where(valence[centers] > 0,1.0 - valence[centers]*bs[centers],1.0))
+    spokes = np.nonzero(inner[a])[0]
+    rows.append(a[spokes])
+    cols.append(b[spokes])
+    vals.append(bs[a[spokes]])
+
+    # Even vertices on the boundary.
+    centers = np.nonzero(on)[0]
+    rows.append(centers)
+    cols.append(centers)
+    vals.append(np.full(len(centers),3.0/4.0))
+    rim = np.nonzero(border)[0]
+    rows.append(np.concatenate([a[rim],b[rim]]))
+    cols.append(np.concatenate([b[rim],a[rim]]))
+    vals.append(np.full(2*len(rim),1.0/8.0))
+
+    # Odd vertices on interior edges.  Each of the two half-edges
+    # contributes half of the endpoints' weight, and its own
+    # opposite corner.
+    inside = np.nonzero(~border)[0]
+    odd = nv + eid[inside]
+    rows.append(np.concatenate([odd,odd,odd]))
+    cols.append(np.concatenate([a[inside],b[inside],c[inside]]))
+    vals.append(np.concatenate([np.full(2*len(inside),3.0/16.0),
+                                np.full(len(inside),1.0/8.0)]))
+
+    # Odd vertices on boundary edges.
+    odd = nv + eid[rim]
+    rows.append(np.concatenate([odd,odd]))
+    cols.append(np.concatenate([a[rim],b[rim]]))
+    vals.append(np.full(2*len(rim),1.0/2.0))
+
+    return (np.concatenate(rows).astype(np.int64),
+            np.concatenate(cols).astype(np.int64),
+            np.concatenate(vals))
+
+#
+# apply(rows,cols,vals,n,P)
+#
+# Multiplies the sparse weights by the V x 3 array of positions P,
+# giving an n x 3 array.
+#
+def apply(rows,cols,vals,n,P):
+    Q = P[cols] * vals[:,None]
+    return np.stack([np.bincount(rows,Q[:,k],minlength=n) for k in range(3)],axis=1)
+
+#
+# refine(m)
+#
+# Returns the hemesh that results from one level of Loop subdivision
+# of m.
+#
+@tracing.timed('loop.refine',made)
+def refine(m):
+    triangles, n = split(m)
+    rows, cols, vals = weights(m)
+    return hemesh(apply(rows,cols,vals,n,m.position),triangles)
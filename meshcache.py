@@ -0,0 +1,265 @@
+#
+# meshcache.py
+#
+# An on-disk cache of loaded meshes, so that opening an .obj file that
+# has been opened before skips parsing, linking, and reboxing, as well
+# as any refinement levels that were asked for.
+#
+# Each entry is a directory named by a hash of the .obj file's contents
+# and of the number of refinement levels.  It holds one .npy file per
+# array of each level's hemesh (see hemesh.ARRAYS), the vertex normals
+# of each level, and a 'meta.json' describing them:
+#
+#   <cache>/<key>/meta.json
+#   <cache>/<key>/0/position.npy, 0/source.npy, ..., 0/normals.npy
+#   <cache>/<key>/1/...
+#
+# The arrays are opened memory-mapped, copy on write, so an entry opens
+# almost at once and its pages are only read as they are touched.
+#
+# An entry that was written by another version of this module, that is
+# missing files, or whose arrays don't have the recorded shapes, is
+# stale; it is deleted and rebuilt.  Entries for an older version of the
+# same file are deleted when a new one is written.  When the cache as a
+# whole grows past its size limit, the least recently opened entries
+# are deleted.
+#
+# Only directories that this module wrote are ever deleted: those
+# named by a key whose meta.json carries a version, and those named by
+# a key and left half written.  Entries of another version are stale:
+# they count toward the size limit, are the first to go when pruning,
+# and are deleted whenever a new entry is written.  Anything else in
+# the cache directory is left alone, and not counted in its size.
+#
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+from hemesh import hemesh
+from loop import refine
+import objio
+import tracing
+
+#
+# Where entries go, and how large the cache may grow, in bytes.  The
+# environment variables MESH_CACHE and MESH_CACHE_LIMIT override them.
+#
+DIRECTORY = os.environ.get('MESH_CACHE',
+                           os.path.join(os.path.expanduser('~'),'.cache','mesh_refinement'))
+LIMIT = int(os.environ.get('MESH_CACHE_LIMIT',1 << 30))
+
+#
+# Bumped whenever the layout of an entry changes.
+#
+VERSION = 2
+
+#
+# The names of entries, and of entries being written.
+#
+NAME = re.compile(r'[0-9a-f]{40}$')
+PARTIAL = re.compile(r'[0-9a-f]{40}\.\d+\.partial$')
+
+#
+# digest(filename)
+#
+# The SHA-1 of a file's contents.
+#
+def digest(filename):
+    h = hashlib.sha1()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(1 << 22),b''):
+            h.update(block)
+    return h.hexdigest()
+
+#
+# key(content,levels)
+#
+# The name of the entry for a file with the given content digest,
+# refined the given number of times.
+#
+def key(content,levels):
+    return hashlib.sha1(('%s:%d:%d' % (content,levels,VERSION)).encode()).hexdigest()
+
+#
+# save(path,meshes,meta)
+#
+# Writes the levels of a mesh into a new entry at path.  The entry is
+# built under a temporary name and then renamed into place, so a
+# reader never sees half of one.
+#
+def save(path,meshes,meta):
+    partial = path + '.%d.partial' % os.getpid()
+    shutil.rmtree(partial,ignore_errors=True)
+    os.makedirs(partial)
+
+    shapes = []
+    for k,m in enumerate(meshes):
+        os.mkdir(os.path.join(partial,str(k)))
+        arrays = m.arrays()
+        arrays['normals'] = m.normals()
+        for name,a in arrays.items():
+            np.save(os.path.join(partial,str(k),name + '.npy'),np.ascontiguousarray(a))
+        shapes.append({name: list(a.shape) for name,a in arrays.items()})
+
+    meta = dict(meta,version=VERSION,shapes=shapes)
+    with open(os.path.join(partial,'meta.json'),'w') as f:
+        json.dump(meta,f)
+
+    shutil.rmtree(path,ignore_errors=True)
+    os.rename(partial,path)
+
+#
+# load(path)
+#
+# Opens the levels of the entry at path, memory-mapped.  Returns None
+# should the entry be missing or stale.
+#
+def load(path):
+    try:
+        with open(os.path.join(path,'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != VERSION:
+            return None
+
+        meshes = []
+        for k,shapes in enumerate(meta['shapes']):
+            arrays = {}
+            for name,shape in shapes.items():
+                a = np.load(os.path.join(path,str(k),name + '.npy'),mmap_mode='c')
+                if list(a.shape) != shape:
+                    return None
+                arrays[name] = a
+            normals = arrays.pop('normals')
+            m = hemesh.of_arrays(arrays)
+            if m.normal is None:
+                m._normals = normals
+            meshes.append(m)
+    except (OSError,ValueError,KeyError):
+        return None
+
+    os.utime(path)
+    return meshes
+
+#
+# fetch(filename,levels=0,directory=DIRECTORY,limit=LIMIT)
+#
+# Returns the reboxed hemesh read from an .obj file, followed by its
+# first 'levels' Loop refinements, from the cache if possible.
+# Otherwise they are built, and then cached.
+#
+@tracing.timed('load')
+def fetch(filename,levels=0,directory=None,limit=None):
+    directory = directory or DIRECTORY
+    limit = LIMIT if limit is None else limit
+
+    content = digest(filename)
+    path = os.path.join(directory,key(content,levels))
+    meshes = load(path)
+    if meshes is not None:
+        return meshes
+
+    meshes = [objio.load(filename)]
+    for _ in range(levels):
+        meshes.append(refine(meshes[-1]))
+
+    os.makedirs(directory,exist_ok=True)
+    forget(directory,os.path.abspath(filename),levels)
+    save(path,meshes,{'source': os.path.abspath(filename),
+                      'content': content,
+                      'levels': levels})
+    prune(directory,limit)
+    return meshes
+
+#
+# entries(directory)
+#
+# The paths of the entries in the cache: the directories named by a
+# key whose meta.json was written by some version of this module.
+#
+def entries(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory,name) for name in os.listdir(directory)
+            if NAME.match(name) and meta(os.path.join(directory,name)) is not None]
+
+#
+# meta(path)
+#
+# The description of the entry at path, or None if it has none that
+# this module wrote.  Check its 'version' to tell whether it is stale.
+#
+def meta(path):
+    try:
+        with open(os.path.join(path,'meta.json')) as f:
+            described = json.load(f)
+    except (OSError,ValueError):
+        return None
+    if not isinstance(described,dict) or 'version' not in described:
+        return None
+    return described
+
+#
+# size(path)
+#
+# The bytes held by an entry.
+#
+def size(path):
+    total = 0
+    for root,dirs,files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root,name))
+    return total
+
+#
+# forget(directory,source,levels)
+#
+# Deletes the entries made from an earlier version of the file at
+# 'source', those written by another version of this module, and any
+# that were left half written an hour ago or more.
+#
+def forget(directory,source,levels):
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        path = os.path.join(directory,name)
+        if PARTIAL.match(name) and os.path.isdir(path):
+            if os.path.getmtime(path) < time.time() - 3600:
+                shutil.rmtree(path,ignore_errors=True)
+    for path in entries(directory):
+        m = meta(path)
+        if m is None:
+            continue
+        if m['version'] != VERSION or (m.get('source') == source and m.get('levels') == levels):
+            shutil.rmtree(path,ignore_errors=True)
+
+#
+# prune(directory,limit)
+#
+# Deletes stale entries, and then the least recently opened ones,
+# until the cache holds at most 'limit' bytes.
+#
+def prune(directory,limit):
+    sized = []
+    for path in entries(directory):
+        m = meta(path)
+        if m is not None:
+            sized.append((m['version'] == VERSION,os.path.getmtime(path),size(path),path))
+    total = sum(s for _,_,s,_ in sized)
+    for _,_,s,path in sorted(sized):
+        if total <= limit:
+            break
+        shutil.rmtree(path,ignore_errors=True)
+        total -= s
+
+#
+# clear(directory=DIRECTORY)
+#
+# Empties the cache.
+#
+def clear(directory=None):
+    for path in entries(directory or DIRECTORY):
+        shutil.rmtree(path,ignore_errors=True)
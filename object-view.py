@@ -12,7 +12,8 @@
 #
 # In the code below, that object/mesh is constructed from
 # an Alias/Wavefront .OBJ file and displayed in an OpenGL
-# window.  It can then be 'refined' by pressing the '/'
+# window.  The file is read through the cache of meshcache.py,
+# so that opening it again later is nearly instant.  It can then be 'refined' by pressing the '/'
 # key.  The effect should be to build a new mesh, one 
 # where each triangular face of the 'input mesh' is 
 # split into four triangles, and where the placement of
@@ -22,7 +23,12 @@
 # becomes what's displayed by the code below.
 #
 # The refinement happens in the 'slash key handler'
-# code under the procedure 'keypress'.
+# code under the procedure 'keypress'.  The levels of
+# refinement are kept in a hierarchy (see levels.py), so
+# that the ',' key can step back down to a coarser mesh
+# and '/' back up without refining again.  Levels are
+# dropped, least recently viewed first, when they exceed
+# a memory budget.
 #
 # Your assignment is to modify the 'refine' method code 
 # at the bottom of 'we.py', under the definition of 
@@ -33,6 +39,21 @@
 # To run the code:
 #    python3 object-view.py objs/stell.obj
 #
+# or, to hold at most 64 megabytes of refinement levels:
+#    python3 object-view.py objs/stell.obj 64
+#
+# Refinement runs on a worker thread (see background.py), so the
+# current level goes on being drawn, and can be turned, while the next
+# is built; the window's title shows how it is going, and the 'c' key
+# cancels it.  Only the upload to the GPU happens in the GLUT
+# callbacks.
+#
+# The 't' key switches on timing of reading, refining, uploading,
+# and drawing (see tracing.py); pressing it again prints a summary
+# and saves the timings to trace.json and, for chrome://tracing,
+# trace-chrome.json.  The 'f' key shows the frame time and level in
+# the corner of the window.
+#
 # There are several interesting low-resolution meshes found
 # in the 'objs' folder.
 #
@@ -41,6 +62,13 @@ import sys
 from geometry import point, vector, EPSILON, ORIGIN
 from quat import quat
 from we import vertex, edge, face, object
+from levels import hierarchy
+import gpu
+import limit
+import meshcache
+import background
+import time
+import tracing
 from random import random
 from math import sin, cos, acos, asin, pi, sqrt
 from ctypes import *
@@ -52,16 +80,25 @@ from OpenGL.GLUT.freeglut import *
 trackball = None   # Orientation of the mesh.
 flashlight = None  # Light position illuminating the object.
 
-vertex_buffer = None  # The VBOs
-normal_buffer = None  #
-color_buffer = None   #
+gpu_buffers = None    # The manager of all the GPU buffers.
+current = None        # The GPU buffers of the level being viewed.
+indexed = True        # Compile shared vertices once, with indices?
+interleave = True     # Put all the attributes into a single VBO?
 
-shaders = None    # The two shading programs.
+shaders = None    # The two shading programs (gpu.program instances).
 shadowers = None  #
+seen = None       # The trackball, flashlight, light, and eye of view().
 
 wireframe = 0  # Show the wireframe?  1 means 'Yes.'
+overlay = False  # Show the frame time and level?
+frame_ms = 0.0   # How long the last frame took to draw.
+job = None       # The level being built in the background, if any.
+POLL = 50        # Milliseconds between checks on that job.
+limited = False  # Move the vertices onto the limit surface?
 mesh = None    # The mesh of facets of the object
 mesh0 = None   # Perhaps keep around the control mesh.
+levels = None  # The hierarchy of refinements of mesh0.
+budget = 256   # Megabytes that the levels may hold.
 
 xStart = 0
 yStart = 0
@@ -69,6 +106,8 @@ width = 512
 height = 512
 scale = 1.0/min(width,height)
 
+TITLE = 'object-view.py - Press ESC to quit'
+
 def init_shaders(vs_name,fs_name):
     """Compile the vertex and fragment shaders from source."""
 
@@ -97,16 +136,20 @@ def init_shaders(vs_name,fs_name):
     shs = glCreateProgram()
     glAttachShader(shs,vertex_shader)
     glAttachShader(shs,fragment_shader)
+    for name, location in gpu.ATTRIBUTES:
+        glBindAttribLocation(shs, location, name)
     glLinkProgram(shs)
 
     return shs
 
 
+@tracing.timed('draw')
 def draw():
     """ Issue GL calls to draw the scene. """
     global trackball, flashlight, \
-           vertex_buffer, normal_buffer, color_buffer, \
-           shaders, wireframe, mesh
+           current, shaders, wireframe, mesh, frame_ms
+
+    start = time.perf_counter()
 
     # Clear the rendering information.
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -119,108 +162,123 @@ def draw():
     # Transform the objects drawn below by a rotation.
     trackball.glRotate()
 
+    # The light and eye positions follow the flashlight and the
+    # trackball.
+    light, eye = view()
+
     # * * * * * * * * * * * * * * * *
     # Draw all the triangular facets.
     shs = shaders
-    glUseProgram(shs)
-    h_vertex = glGetAttribLocation(shs,'vertex')
-    h_normal = glGetAttribLocation(shs,'normal')
-    h_color =  glGetAttribLocation(shs,'color')
-    h_bary =   glGetAttribLocation(shs,'bary')
-    h_eye =    glGetUniformLocation(shs,'eye')
-    h_light =  glGetUniformLocation(shs,'light')
-    h_wires =  glGetUniformLocation(shs,'wires')
-
-    # all the vertex positions
-    glEnableVertexAttribArray(h_vertex)
-    glBindBuffer (GL_ARRAY_BUFFER, vertex_buffer)
-    glVertexAttribPointer(h_vertex, 3, GL_FLOAT, GL_FALSE, 0, None)
-        
-    # all the vertex normals
-    glEnableVertexAttribArray(h_normal)
-    glBindBuffer (GL_ARRAY_BUFFER, normal_buffer)
-    glVertexAttribPointer(h_normal, 3, GL_FLOAT, GL_FALSE, 0, None)
-
-    # all the face vertex colors
-    glEnableVertexAttribArray(h_color)
-    glBindBuffer (GL_ARRAY_BUFFER, color_buffer)
-    glVertexAttribPointer(h_color, 3, GL_FLOAT, GL_FALSE, 0, None)
-
-    # all the vertex barycentric labels
-    glEnableVertexAttribArray(h_bary)
-    glBindBuffer (GL_ARRAY_BUFFER, bary_buffer)
-    glVertexAttribPointer(h_bary, 3, GL_FLOAT, GL_FALSE, 0, None)
-        
+    shs.use()
+
+    # all the vertex positions, normals, colors, and
+    # barycentric labels
+    current.bind()
+
     # position of the flashlight
-    light = flashlight.rotate(vector(0.0,1.0,0.0));
-    glUniform3fv(h_light, 1, (4.0*light).components())
+    shs.set('light', light)
 
     # position of the viewer's eye
-    eye = trackball.recip().rotate(vector(0.0,0.0,1.0))
-    glUniform3fv(h_eye, 1, eye.components())
+    shs.set('eye', eye)
 
     # show wireframe?
-    glUniform1i(h_wires, wireframe)
+    shs.set('wires', wireframe)
+
+    current.triangles()
 
-    glDrawArrays (GL_TRIANGLES, 0, len(mesh.face) * 3)
+    # indexed vertices have no barycentric labels, so draw
+    # the wireframe over the faces as lines instead
+    if current.indexed and wireframe:
+        shs.set('wires', 2)
+        current.bind('lines')
+        current.lines()
 
-    glDisableVertexAttribArray(h_vertex)
-    glDisableVertexAttribArray(h_normal)
-    glDisableVertexAttribArray(h_color)
-    glDisableVertexAttribArray(h_bary)
+    current.unbind()
 
 
     # * * * * * * * * * * * * * * * *
     # Draw the object's shadow
     shs = shadowers
-    glUseProgram(shs)
-    h_vertex = glGetAttribLocation(shs,'vertex')
-    h_bary = glGetAttribLocation(shs,'bary')
-    h_normal = glGetUniformLocation(shs,'normal')
-    h_plane = glGetUniformLocation(shs,'plane')
-    h_light =  glGetUniformLocation(shs,'light')
-    h_wires =  glGetUniformLocation(shs,'wires')
-
-    # all the vertex positions
-    glEnableVertexAttribArray(h_vertex)
-    glBindBuffer (GL_ARRAY_BUFFER, vertex_buffer)
-    glVertexAttribPointer(h_vertex, 3, GL_FLOAT, GL_FALSE, 0, None)
-
-    # all the vertex barycentric labels
-    glEnableVertexAttribArray(h_bary)
-    glBindBuffer (GL_ARRAY_BUFFER, bary_buffer)
-    glVertexAttribPointer(h_bary, 3, GL_FLOAT, GL_FALSE, 0, None)
-        
+    shs.use()
+
+    # all the vertex positions and barycentric labels
+    current.bind()
+
     # position of the flashlight
-    light = flashlight.rotate(vector(0.0,1.0,0.0));
-    glUniform3fv(h_light, 1, (4.0*light).components())
+    shs.set('light', light)
 
     # position of the plane
-    glUniform3fv(h_plane, 1, [0.0,-0.50,0.0])
+    shs.set('plane', (0.0,-0.50,0.0))
 
     # normal to the plane's surface
-    glUniform3fv(h_normal, 1, [0.0,+1.0,0.0])
+    shs.set('normal', (0.0,+1.0,0.0))
 
     # Show as a wireframe? No.
-    # glUniform1i(h_wires, wireframe)
-    glUniform1i(h_wires, 0)
+    shs.set('wires', 0)
 
-    glDrawArrays (GL_TRIANGLES, 0, len(mesh.face) * 3)
+    current.triangles()
 
-    glDisableVertexAttribArray(h_vertex)
-    glDisableVertexAttribArray(h_bary)
+    current.unbind()
 
     glPopMatrix()
 
+    if overlay or job is not None:
+        draw_overlay()
+
     # Render the scene.
     glFlush()
 
     glutSwapBuffers()
 
+    frame_ms = 1000.0 * (time.perf_counter() - start)
+    tracing.gauge('frame ms', frame_ms)
+    tracing.count('frames')
+
+
+def view():
+    """ The light and eye positions, as of the last turn of the
+        flashlight or the trackball. """
+    global seen
+
+    if seen is None or seen[0] is not trackball or seen[1] is not flashlight:
+        light = flashlight.rotate(vector(0.0,1.0,0.0))
+        eye = trackball.recip().rotate(vector(0.0,0.0,1.0))
+        seen = (trackball, flashlight,
+                tuple((4.0*light).components()), tuple(eye.components()))
+    return seen[2], seen[3]
+
+
+def draw_overlay():
+    """ Write the frame time and level, and the progress of any
+        refinement, in the window's corner. """
+    glUseProgram(0)
+    glDisable(GL_DEPTH_TEST)
+    glColor3f(1.0, 1.0, 1.0)
+    glWindowPos2i(8, height - 20)
+    text = 'level %d  %d faces  %.1f ms' % (levels.current, len(mesh.side), frame_ms)
+    glutBitmapString(GLUT_BITMAP_HELVETICA_12, text.encode())
+    if job is not None:
+        glWindowPos2i(8, height - 36)
+        glutBitmapString(GLUT_BITMAP_HELVETICA_12, job.progress().encode())
+    glEnable(GL_DEPTH_TEST)
+
+
+def toggle_tracing():
+    """ Switch tracing on, or off and save what it recorded. """
+    if not tracing.on:
+        tracing.enable()
+        print('Tracing on.')
+    else:
+        tracing.disable()
+        print(tracing.summary())
+        tracing.save_json('trace.json')
+        tracing.save_chrome('trace-chrome.json')
+        print('Saved trace.json and trace-chrome.json.')
+
 
 def keypress(key, x, y):
     """ Handle a "normal" keypress. """
-    global wireframe, mesh, control
+    global wireframe, mesh, control, limited, overlay
 
     # Handle ESC key.
     if key == b'\033':	
@@ -234,8 +292,30 @@ def keypress(key, x, y):
 
     # Handle slash key.
     if key == b'/':	
-        mesh = mesh.refine()
-        vbo_ify(mesh)
+        request(levels.current + 1)
+
+    # Handle comma key.
+    if key == b',' and levels.current > 0:
+        request(levels.current - 1)
+
+    # Handle 'c' key.
+    if key == b'c':
+        cancel()
+
+    # Handle 'l' key.
+    if key == b'l':
+        cancel()
+        limited = not limited
+        levels.outdate()
+        request(levels.current)
+
+    # Handle 't' key.
+    if key == b't':
+        toggle_tracing()
+
+    # Handle 'f' key.
+    if key == b'f':
+        overlay = not overlay
         glutPostRedisplay()
 
     # Handle slash key.
@@ -285,58 +365,117 @@ def motion(x, y):
     yStart = yNow
     glutPostRedisplay()
 
-def vbo_ify(mesh):
-    global vertex_buffer, normal_buffer, color_buffer, bary_buffer
-
-    vertices, normals, colors = mesh.compile()
-
-    nf = len(mesh.face)
+def release(buffers):
+    """ Free the GPU buffers of a dropped level. """
+    buffers.delete()
+
+def prepare(mesh):
+    """ The arrays to upload for a level's mesh.  Makes no GL calls. """
+    shown = limit.project(mesh) if limited else mesh
+    return gpu.compile(shown, indexed, interleave)
+
+def request(k):
+    """ View level k, building it in the background unless it is
+        ready to draw.  A level whose buffers are stale is prepared
+        again in the background, and refilled once that is done. """
+    global job
+
+    if job is not None:
+        print('Still building level %d; press "c" to cancel.' % job.k)
+        return
+
+    L = levels.levels.get(k)
+    if L is not None and L.buffers is not None and not L.stale:
+        show(k)
+        return
+
+    below, source = levels.below(k)
+    job = background.job(k, below, source, prepare)
+    glutTimerFunc(POLL, poll, 0)
+    glutPostRedisplay()
 
-    barys = [1.0,0.0,0.0, 0.0,1.0,0.0, 0.0,0.0,1.0]*nf
-    
-    vertex_buffer = glGenBuffers(1)
-    glBindBuffer (GL_ARRAY_BUFFER, vertex_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(vertices)*4, 
-                  (c_float*len(vertices))(*vertices), GL_STATIC_DRAW)
+def poll(value):
+    """ Check on the background job, and view its level once done. """
+    global job
 
-    normal_buffer = glGenBuffers(1)
-    glBindBuffer (GL_ARRAY_BUFFER, normal_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(normals)*4, 
-                  (c_float*len(normals))(*normals), GL_STATIC_DRAW)
+    if job is None:
+        return
+    if not job.done:
+        glutSetWindowTitle('object-view.py - ' + job.progress())
+        glutTimerFunc(POLL, poll, 0)
+        glutPostRedisplay()
+        return
 
-    color_buffer = glGenBuffers(1)
-    glBindBuffer (GL_ARRAY_BUFFER, color_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(colors)*4, 
-                  (c_float*len(colors))(*colors), GL_STATIC_DRAW)
+    finished = job
+    job = None
+    glutSetWindowTitle(TITLE)
+    if finished.error is not None:
+        print('Building level %d FAILED: %s' % (finished.k, finished.error))
+    else:
+        print(finished.progress())
+        levels.put(finished.k, finished.mesh)
+        show(finished.k, finished.prepared)
+
+def cancel():
+    """ Give up on the level being built in the background. """
+    global job
+
+    if job is not None:
+        job.cancel()
+        print('Cancelled level %d.' % job.k)
+        job = None
+        glutSetWindowTitle(TITLE)
+        glutPostRedisplay()
 
-    bary_buffer = glGenBuffers(1)
-    glBindBuffer (GL_ARRAY_BUFFER, bary_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(barys)*4, 
-                  (c_float*len(barys))(*barys), GL_STATIC_DRAW)
+def show(k, prepared=None):
+    """ View level k of the refinement hierarchy, uploading the
+        arrays prepared for it, if given.  Stale buffers are refilled
+        in place. """
+    global current, mesh
+
+    L = levels.view(k)
+    if L.buffers is None:
+        B = gpu.buffers(gpu_buffers, prepared or prepare(L.mesh), indexed, interleave)
+        levels.attach(k, B, B.nbytes)
+    elif L.stale:
+        L.buffers.update(prepared or prepare(L.mesh))
+        levels.attach(k, L.buffers, L.buffers.nbytes)
+
+    current = L.buffers
+    mesh = L.mesh
+    tracing.gauge('level', k)
+
+    print(levels.report())
+    print(gpu_buffers.report())
+    glutPostRedisplay()
 
 def init(filename):
     """ Initialize aspects of the GL scene rendering.  """
     global trackball, flashlight, \
-           shaders, shadowers, mesh, mesh0
+           shaders, shadowers, mesh, mesh0, levels, gpu_buffers
 
     # Initialize quaternions for the light and trackball
     flashlight = quat.for_rotation(0.0,vector(1.0,0.0,0.0))
     trackball = quat.for_rotation(0.0,vector(1.0,0.0,0.0))
 
-    # Read the .OBJ file into VBOs.
-    mesh0 = object()
-    mesh0.read(filename)
-    vbo_ify(mesh0)
-    mesh = mesh0
+    # Read the .OBJ file into VBOs, through the mesh cache.
+    gpu_buffers = gpu.manager()
+    mesh0 = meshcache.fetch(filename)[0]
+    levels = hierarchy(mesh0, budget * 2**20, release)
+    show(0)
 
     # Set up the shaders.
-    shaders = init_shaders('shaders/vs-mesh.c',
-                           'shaders/fs-mesh.c')
-    shadowers = init_shaders('shaders/vs-shadow.c',
-                             'shaders/fs-shadow.c')
+    shaders = gpu.program(init_shaders('shaders/vs-mesh.c',
+                                       'shaders/fs-mesh.c'))
+    shadowers = gpu.program(init_shaders('shaders/vs-shadow.c',
+                                         'shaders/fs-shadow.c'))
                  
-    # Set up OpenGL state.
+    # Set up OpenGL state.  The faces are pushed back a little so
+    # that the wireframe lines drawn over them win the depth test.
     glEnable (GL_DEPTH_TEST)
+    glDepthFunc (GL_LEQUAL)
+    glEnable (GL_POLYGON_OFFSET_FILL)
+    glPolygonOffset (1.0, 1.0)
 
 
 def resize(w, h):
@@ -365,7 +504,7 @@ def run(filename):
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
     glutInitWindowPosition(0, 20)
     glutInitWindowSize(width, height)
-    glutCreateWindow( 'object-view.py - Press ESC to quit' )
+    glutCreateWindow(TITLE)
 
     # Initialize the object viewer's state.
     init(filename)
@@ -384,6 +523,10 @@ def run(filename):
     print('Press the arrow keys move the flashlight.')
     print('Press SPACE to show the mesh.')
     print('Press "/" to refine the mesh.')
+    print('Press "," to go back to a coarser mesh.')
+    print('Press "c" to cancel a refinement under way.')
+    print('Press "l" to place the mesh on its limit surface.')
+    print('Press "t" to start or stop timing, "f" to show the frame time.')
     print('Press ESC to quit.')
     print()
 
@@ -391,6 +534,9 @@ def run(filename):
     return 0
 
 
+if len(sys.argv) > 2:
+    budget = float(sys.argv[2])
+
 if len(sys.argv) > 1:
     run(sys.argv[1])
 else:
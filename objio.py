@@ -0,0 +1,449 @@
+#
+# objio.py
+#
+# Bulk reading of Alias/Wavefront .obj files into arrays.
+#
+# Rather than splitting each line and building a point or a face per
+# record, the file is read in large chunks.  Within a chunk, the 'v',
+# 'vn', and 'f' records are picked out with one regular expression
+# each, and their numbers are converted by numpy's text parser in a
+# single call.  Faces may be given in any of the forms
+#
+#    f 1 2 3    f 1/4 2/5 3/6    f 1//7 2//8 3//9    f 1/4/7 2/5/8 3/6/9
+#
+# with only the vertex index kept, and polygons with more than three
+# corners are split into a fan of triangles about their first corner.
+# Negative (relative) vertex indices are resolved too, and records may
+# be indented.
+#
+# The bounding box of the vertex positions is accumulated as the
+# chunks are read, so rebox() needs no second pass over the points.
+#
+# Meshes are written, to .obj or to binary little-endian .ply files,
+# in blocks of many records.  Each block of an .obj file is formatted
+# by a single string operation, and each block of a .ply file is laid
+# out in a numpy record array and written as is.
+#
+
+import io
+import os
+import re
+import time
+import numpy as np
+from hemesh import hemesh, unit
+import tracing
+
+#
+# How many bytes to read at a time.
+#
+CHUNK = 1 << 24
+
+#
+# How many records to write at a time.
+#
+BLOCK = 1 << 16
+
+#
+# Patterns picking out the text after the tag of each kind of record.
+# Chunks are given a leading line break so that every record starts
+# with one.
+#
+PATTERNS = {tag: re.compile(rb'\n' + tag + rb'[ \t]+([^\n]*)')
+            for tag in (b'v',b'vn',b'f')}
+RECORD = re.compile(rb'\n(v|f)[ \t]')
+SLASHES = re.compile(rb'/[^ \t\r\n]*')
+
+#
+# Blanks at the start of a line, which are dropped before the records
+# are picked out.
+#
+INDENT = re.compile(rb'\n[ \t]+')
+
+#
+# class contents
+#
+# What parse() found in a .obj file:
+#
+#  * position: a V x 3 array of vertex positions
+#  * normal: an N x 3 array of vertex normals, in the order given
+#  * triangles: an F x 3 array of (0-based) vertex indices
+#  * lo, hi: the corners of the bounding box of the positions
+#
+class contents:
+
+    def __init__(self,position,normal,triangles,lo,hi):
+        self.position = position
+        self.normal = normal
+        self.triangles = triangles
+        self.lo = lo
+        self.hi = hi
+
+#
+# records(chunk,tag)
+#
+# Finds the records of a chunk that start with the given tag.  Returns
+# the text that follows the tag on each, one record per line, along
+# with the number of records.
+#
+# Files almost always list their records in runs of one kind, so this
+# first checks whether everything from the first such record to the
+# last is of that kind, in which case the tags can just be cut out.
+#
+def records(chunk,tag):
+    mark = b'\n' + tag + b' '
+    start = chunk.find(mark)
+    if start >= 0:
+        end = chunk.find(b'\n',chunk.rfind(mark)+1)
+        run = chunk[start:end] if end >= 0 else chunk[start:]
+        n = run.count(mark)
+        if run.count(b'\n') == n:
+            return run.replace(mark,b'\n')[1:], n
+
+    found = PATTERNS[tag].findall(chunk)
+    return b'\n'.join(found), len(found)
+
+#
+# words(text,n)
+#
+# The number of whitespace separated words on each of the n lines of
+# text, counted over the bytes of the text at once.
+#
+def words(text,n):
+    b = np.frombuffer(text,dtype=np.uint8)
+    blank = b <= 32
+    starts = np.flatnonzero(blank[:-1] > blank[1:]) + 1
+    if len(b) > 0 and not blank[0]:
+        starts = np.r_[0,starts]
+    lines = np.r_[0,np.flatnonzero(b == 10) + 1]
+    return np.diff(np.r_[np.searchsorted(starts,lines),len(starts)]).astype(np.int64)
+
+#
+# numbers(text,n,dtype,width,counts=None)
+#
+# Parses n records, given one per line of text, of whitespace
+# separated numbers.  If every record is 'width' numbers wide, returns
+# them as a 2-D array with one row per record, and None.  Otherwise
+# returns them as a flat array, along with the count of numbers on
+# each record.  The counts are found unless given.
+#
+def numbers(text,n,dtype,width,counts=None):
+    values = np.fromstring(text,dtype=dtype,sep=' ')
+    if counts is None:
+        counts = words(text,n)
+    if len(values) == width * n and (counts == width).all():
+        return values.reshape(-1,width), None
+    return values, counts
+
+#
+# coordinates(text,n)
+#
+# The first three numbers of each of n 'v' or 'vn' records, as an
+# n x 3 array.
+#
+def coordinates(text,n):
+    if n == 0:
+        return np.zeros((0,3))
+    values, counts = numbers(text,n,np.float64,3)
+    if counts is None:
+        return values
+    starts = np.cumsum(counts) - counts
+    at = starts[:,None] + np.arange(3)
+    return values[at]
+
+#
+# fans(text,n,before)
+#
+# The triangles of n 'f' records.  The array 'before' gives the number
+# of vertices read prior to each record, for resolving relative
+# indices.
+#
+def fans(text,n,before):
+    if n == 0:
+        return np.zeros((0,3),dtype=np.int64)
+
+    # The corners of each record, each a word whatever its form.
+    corners = words(text,n)
+    values = None
+    if b'/' in text:
+        # Most files give every corner of every triangle in the same
+        # form, so try taking every k-th number after turning the
+        # slashes into spaces.
+        corner = text.split(None,1)[0]
+        k = len(corner.replace(b'/',b' ').split())
+        if (corners == 3).all():
+            every = np.fromstring(text.replace(b'/',b' '),dtype=np.int64,sep=' ')
+            if len(every) == 3*k*n \
+                    and text.count(b'/') == 3*corner.count(b'/')*n:
+                values, counts = every[::k].reshape(-1,3), None
+        if values is None:
+            text = SLASHES.sub(b'',text)
+    if values is None:
+        values, counts = numbers(text,n,np.int64,3,corners)
+    if counts is None:
+        counts = np.full(n,3,dtype=np.int64)
+        values = values.reshape(-1)
+
+    starts = np.cumsum(counts) - counts
+    if (values < 0).any():
+        values = np.where(values < 0,values + np.repeat(before,counts) + 1,values)
+    values = values - 1
+
+    # Triangle j of a fan joins its corners 0, j+1, and j+2.  Records
+    # of fewer than three corners make no triangles, and are skipped.
+    pieces = np.maximum(counts - 2,0)
+    first = np.repeat(starts,pieces)
+    j = np.arange(int(pieces.sum())) - np.repeat(np.cumsum(pieces) - pieces,pieces)
+    return np.stack([values[first],values[first+j+1],values[first+j+2]],axis=1)
+
+#
+# chunks(obj_file)
+#
+# Reads an open binary file in large blocks, each ending at a line
+# break.
+#
+def chunks(obj_file,size=CHUNK):
+    rest = b''
+    while True:
+        block = obj_file.read(size)
+        if not block:
+            break
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        if cut == 0:
+            rest = block
+            continue
+        rest = block[cut:]
+        yield block[:cut]
+    if rest:
+        yield rest + b'\n'
+
+#
+# parse(filename)
+#
+# Reads the 'v', 'vn', and 'f' records of a .obj file into arrays.
+# Returns a contents instance.
+#
+@tracing.timed('parse',lambda c: {'faces read': len(c.triangles),
+                                  'vertices read': len(c.position)})
+def parse(filename,size=CHUNK):
+    positions = []
+    normals = []
+    triangles = []
+    lo = np.full(3,np.inf)
+    hi = np.full(3,-np.inf)
+    nv = 0
+
+    with open(filename,'rb') as obj_file:
+        for chunk in chunks(obj_file,size):
+            chunk = b'\n' + chunk
+            if b'\n ' in chunk or b'\n\t' in chunk:
+                chunk = INDENT.sub(b'\n',chunk)
+
+            P = coordinates(*records(chunk,b'v'))
+            if len(P) > 0:
+                lo = np.minimum(lo,P.min(axis=0))
+                hi = np.maximum(hi,P.max(axis=0))
+            positions.append(P)
+            normals.append(coordinates(*records(chunk,b'vn')))
+
+            text, n = records(chunk,b'f')
+            before = None
+            if b'-' in text:
+                # Count the vertices read before each face.
+                kinds = RECORD.findall(chunk)
+                isv = np.array([k == b'v' for k in kinds])
+                before = nv + np.cumsum(isv)[~isv]
+            triangles.append(fans(text,n,before))
+            nv += len(P)
+
+    position = np.concatenate(positions) if positions else np.zeros((0,3))
+    normal = np.concatenate(normals) if normals else np.zeros((0,3))
+    triangle = np.concatenate(triangles) if triangles else np.zeros((0,3),dtype=np.int64)
+    return contents(position,normal,triangle.astype(np.int32),lo,hi)
+
+#
+# box(lo,hi)
+#
+# The center and scale used by object.rebox for a bounding box:
+# centered in x and z, resting on y = lo, and scaled to fit the
+# canonical volume.
+#
+def box(lo,hi):
+    center = np.array([(lo[0]+hi[0])/2.0,lo[1],(lo[2]+hi[2])/2.0])
+    return center, 1.4/np.linalg.norm(hi - center)
+
+#
+# load(filename)
+#
+# Reads a .obj file straight into a reboxed hemesh.
+#
+def load(filename):
+    c = parse(filename)
+    center, scale = box(c.lo,c.hi)
+    normal = None
+    if len(c.normal) > 0 and len(c.normal) >= len(c.position):
+        normal = unit(c.normal[:len(c.position)])
+    return hemesh(scale * (c.position - center),c.triangles,normal)
+
+
+#
+# class written
+#
+# What a writer wrote: the number of bytes, and the seconds it took.
+#
+class written:
+
+    def __init__(self,nbytes,seconds):
+        self.nbytes = nbytes
+        self.seconds = seconds
+
+    def rate(self):
+        return self.nbytes / max(self.seconds,1e-9)
+
+    def __str__(self):
+        return '%.1f MB in %.2fs, %.1f MB/s' % (self.nbytes / 2**20,self.seconds,self.rate() / 2**20)
+
+#
+# class sink
+#
+# Where a writer's bytes go: the file named by 'target', which is
+# opened and closed here, or else an already open file-like object,
+# binary or text, which is left open.  Counts the bytes written.
+#
+class sink:
+
+    def __init__(self,target):
+        self.owned = not hasattr(target,'write')
+        self.file = open(target,'wb') if self.owned else target
+        self.text = isinstance(self.file,io.TextIOBase)
+        self.nbytes = 0
+
+    def write(self,data):
+        self.nbytes += len(data)
+        self.file.write(data.decode('ascii') if self.text else data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exception):
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+#
+# lines(out,tag,values,block=BLOCK,base=0)
+#
+# Writes .obj records of a tag followed by the values of each row of
+# a 2-D array, plus base, a block of rows at a time.  Floats are
+# written with 17 significant digits, enough to read back the same
+# doubles.
+#
+def lines(out,tag,values,block=BLOCK,base=0):
+    if len(values) == 0:
+        return
+    width = values.shape[1]
+    number = '%d' if values.dtype.kind in 'iu' else '%.17g'
+    for i in range(0,len(values),block):
+        rows = values[i:i+block] + base if base else values[i:i+block]
+        record = tag + (' ' + number) * width + '\n'
+        out.write(((record * len(rows)) % tuple(rows.ravel().tolist())).encode('ascii'))
+
+#
+# write_obj(target,position,triangles,normal=None)
+#
+# Writes a mesh to an .obj file, given as a file name or a file-like
+# object.  With normals, each corner of a face names both its vertex
+# and its vertex normal.  Returns a written instance.
+#
+def write_obj(target,position,triangles,normal=None,block=BLOCK):
+    start = time.perf_counter()
+    with sink(target) as out:
+        lines(out,'v',np.asarray(position,dtype=np.float64),block)
+        if normal is not None:
+            lines(out,'vn',np.asarray(normal,dtype=np.float64),block)
+            for i in range(0,len(triangles),block):
+                rows = np.asarray(triangles[i:i+block],dtype=np.int64) + 1
+                out.write((('f %d//%d %d//%d %d//%d\n' * len(rows))
+                           % tuple(np.repeat(rows,2,axis=1).ravel().tolist())).encode('ascii'))
+        else:
+            lines(out,'f',triangles,block,1)
+    return written(out.nbytes,time.perf_counter() - start)
+
+#
+# write_ply(target,position,triangles,normal=None)
+#
+# Writes a mesh to a binary little-endian .ply file, given as a file
+# name or a binary file-like object.  Positions and normals are kept
+# as single precision floats, and each face as a count of 3 followed
+# by three 32-bit vertex indices.  Returns a written instance.
+#
+def write_ply(target,position,triangles,normal=None,block=BLOCK):
+    start = time.perf_counter()
+    fields = [('x','<f4'),('y','<f4'),('z','<f4')]
+    if normal is not None:
+        fields += [('nx','<f4'),('ny','<f4'),('nz','<f4')]
+    header = ['ply','format binary_little_endian 1.0',
+              'element vertex %d' % len(position)]
+    header += ['property float %s' % name for name,_ in fields]
+    header += ['element face %d' % len(triangles),
+               'property list uchar int vertex_indices','end_header','']
+
+    vertices = np.dtype(fields)
+    faces = np.dtype([('n','u1'),('corner','<i4',(3,))])
+    with sink(target) as out:
+        out.write('\n'.join(header).encode('ascii'))
+        for i in range(0,len(position),block):
+            records = np.empty(min(block,len(position) - i),dtype=vertices)
+            P = position[i:i+block]
+            records['x'], records['y'], records['z'] = P[:,0], P[:,1], P[:,2]
+            if normal is not None:
+                N = normal[i:i+block]
+                records['nx'], records['ny'], records['nz'] = N[:,0], N[:,1], N[:,2]
+            out.write(records.tobytes())
+        for i in range(0,len(triangles),block):
+            records = np.empty(min(block,len(triangles) - i),dtype=faces)
+            records['n'] = 3
+            records['corner'] = triangles[i:i+block]
+            out.write(records.tobytes())
+    return written(out.nbytes,time.perf_counter() - start)
+
+#
+# WRITERS
+#
+# The writers, by file extension.
+#
+WRITERS = {'.obj': write_obj, '.ply': write_ply}
+
+#
+# kind_of(target,kind=None)
+#
+# The kind of file to write, '.obj' or '.ply': the one given, or else
+# the extension of the target's name.
+#
+def kind_of(target,kind=None):
+    if kind is None:
+        name = getattr(target,'name','') if hasattr(target,'write') else target
+        kind = os.path.splitext(str(name))[1].lower()
+    if kind not in WRITERS:
+        raise ValueError('unknown kind of file: %r' % kind)
+    return kind
+
+#
+# save(target,mesh,normals=False,kind=None)
+#
+# Writes a we.py object or a hemesh to a file, as positions,
+# triangles, and, if asked, vertex normals.  Any normals the mesh
+# lacks are computed.  The kind of file, '.obj' or '.ply', comes from
+# the name of the target unless given.  Returns a written instance.
+#
+def save(target,mesh,normals=False,kind=None):
+    writer = WRITERS[kind_of(target,kind)]
+    if not isinstance(mesh,hemesh):
+        if normals:
+            mesh.normals()
+        mesh = hemesh.from_object(mesh,normals)
+    normal = None
+    if normals:
+        normal = mesh.normal if mesh.normal is not None else mesh.normals()
+    return writer(target,mesh.position,mesh.triangles(),normal)
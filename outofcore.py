@@ -0,0 +1,458 @@
+#
+# outofcore.py
+#
+# Loop refinement of meshes too large to hold in memory.  Each level
+# is kept as a directory of .npy files, one per array of its hemesh
+# (see hemesh.ARRAYS), laid out just as a level of a meshcache entry:
+#
+#   <directory>/position.npy, source.npy, next.npy, ...
+#
+# The arrays are opened memory-mapped, so the operating system pages
+# them in and out as they are touched.  The refinement works through
+# the faces of the coarser level a tile of TILE faces at a time, and
+# writes the connectivity and the positions of the finer level
+# straight into its files.  Apart from the tile being worked on,
+# little is held in memory but a count of faces per cell of a coarse
+# grid, so memory use stays bounded however large the level.
+#
+# The tiles are spatially coherent: the faces are ordered by the cell
+# of a grid over the bounding box that their centroid falls in, with
+# the cells taken along a Morton curve, and each run of TILE faces in
+# that order is a tile.  The positions that a tile reads, and the
+# rows of the finer level that it adds to, then lie close together,
+# so that the pages a tile touches tend to be touched by the next.
+#
+# The result has the same vertices and faces, numbered the same way,
+# as loop.refine, and its positions are the same to rounding.  As in
+# lattice.assemble, the twins are read off the coarser level rather
+# than found by sorting.
+#
+# Use estimate(m) before refining to see what the next level will
+# cost, and fits(m) to see whether refining it in memory would fit in
+# the memory that is free.
+#
+# To refine a file three times, out of core, and write it out:
+#
+#    python3 outofcore.py objs/stell.obj 3 scratch stell-3.ply
+#
+
+import os
+import shutil
+import sys
+import numpy as np
+from hemesh import hemesh, made, layout, ARRAYS
+from loop import beta
+import objio
+import tracing
+
+#
+# How many faces to work on at a time.
+#
+TILE = 1 << 16
+
+#
+# The most cells along each side of the grid that orders the faces.
+# Each coordinate of a cell fits in BITS bits of its Morton code.
+#
+BITS = 7
+
+#
+# Bytes of working memory that loop.refine uses, beyond the mesh it
+# refines and the mesh it makes, for each half-edge of the latter, as
+# measured with lattice.measure.
+#
+WORK = 96
+
+#
+# The six half-edges, of the twelve in the four children of a face
+# (see loop.split), that lie inside the face, each with its twin.
+#
+INNER = np.array([1,11,4,9,7,10])
+INNER_TWIN = np.array([11,1,9,4,10,7])
+
+#
+# For each side q of a face, the child half-edges along its first and
+# second halves: the one from corner q to the midpoint of side q, and
+# the one from that midpoint to corner q+1.
+#
+FIRST = np.array([0,3,6])
+SECOND = np.array([5,8,2])
+
+#
+# class footprint
+#
+# What a level of refinement will cost.
+#
+#  * vertices, faces, halfedges: its sizes
+#  * mesh: the bytes of its hemesh's arrays, normals aside
+#  * normals: the bytes of its vertex normals, once asked for
+#  * peak: the most bytes held while loop.refine makes it in memory,
+#    counting the level it is made from
+#
+class footprint:
+
+    def __init__(self,vertices,faces,halfedges,mesh,normals,peak):
+        self.vertices = vertices
+        self.faces = faces
+        self.halfedges = halfedges
+        self.mesh = mesh
+        self.normals = normals
+        self.peak = peak
+
+    def __str__(self):
+        return ('%d vertices, %d faces: %.1f MB, %.1f MB more with normals, %.1f MB at peak'
+                % (self.vertices,self.faces,self.mesh / 2**20,self.normals / 2**20,
+                   self.peak / 2**20))
+
+#
+# size(V,F,H)
+#
+# Bytes held by the arrays of a hemesh with V vertices, F faces, and
+# H half-edges, normals aside.
+#
+def size(V,F,H):
+    return V * (3*8 + 4) + H * 4*4 + F * 4
+
+#
+# estimate(m,levels=1)
+#
+# The footprint of the mesh made by refining m the given number of
+# times.  Only the sizes of m and the number of its boundary edges
+# are needed, so the estimate costs one pass over its twins.
+#
+def estimate(m,levels=1):
+    V, F, H = len(m.position), len(m.side), len(m.source)
+    B = sum(int(np.count_nonzero(m.twin[i:i+TILE] < 0)) for i in range(0,H,TILE))
+    before = size(V,F,H)
+    for _ in range(levels):
+        before = size(V,F,H)
+        V, F, H, B = V + (H + B) // 2, 4 * F, 4 * H, 2 * B
+    mesh = size(V,F,H)
+    return footprint(V,F,H,mesh,V * 3*8,before + mesh + WORK * H)
+
+#
+# available()
+#
+# The bytes of physical memory that are free, or None if that can't
+# be told.
+#
+def available():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError,OSError,AttributeError):
+        return None
+
+#
+# fits(m,levels=1,budget=None)
+#
+# Whether refining m the given number of times in memory would stay
+# within 'budget' bytes, by default the memory that is free.
+#
+def fits(m,levels=1,budget=None):
+    if budget is None:
+        budget = available()
+    return budget is None or estimate(m,levels).peak <= budget
+
+#
+# create(directory,name,dtype,shape)
+#
+# A new array of zeros in the file <directory>/<name>.npy, opened
+# memory-mapped for writing.
+#
+def create(directory,name,dtype,shape):
+    return np.lib.format.open_memmap(os.path.join(directory,name + '.npy'),
+                                     mode='w+',dtype=dtype,shape=shape)
+
+#
+# load(directory)
+#
+# Opens the level kept in a directory, memory-mapped and read only.
+#
+def load(directory):
+    arrays = {}
+    for name in ARRAYS:
+        path = os.path.join(directory,name + '.npy')
+        if os.path.exists(path):
+            arrays[name] = np.load(path,mmap_mode='r')
+    return hemesh.of_arrays(arrays)
+
+#
+# corners(m,f)
+#
+# The three sides of each face f of m, and their source vertices.
+#
+def corners(m,f):
+    e0 = m.side[f]
+    e1 = m.next[e0]
+    e2 = m.next[e1]
+    return (e0,e1,e2), (m.source[e0],m.source[e1],m.source[e2])
+
+#
+# spread(x)
+#
+# Spaces the low BITS bits of each x three apart, for a Morton code.
+#
+def spread(x):
+    y = np.zeros_like(x)
+    for b in range(BITS):
+        y |= ((x >> b) & 1) << (3 * b)
+    return y
+
+#
+# tiles(m,scratch,tile)
+#
+# Orders the faces of m so that each run of 'tile' faces is spatially
+# coherent.  The face ids are counting-sorted by the Morton code of
+# their grid cell, in two passes over the faces, into an array kept
+# in 'scratch'.
+#
+def tiles(m,scratch,tile):
+    nf = len(m.side)
+    nv = len(m.position)
+    lo = np.full(3,np.inf)
+    hi = np.full(3,-np.inf)
+    for i in range(0,nv,tile):
+        P = np.asarray(m.position[i:i+tile])
+        lo = np.minimum(lo,P.min(axis=0))
+        hi = np.maximum(hi,P.max(axis=0))
+
+    # Enough cells that each holds about a tile of a surface.
+    g = int(min(1 << BITS,max(1,np.sqrt(nf / tile))))
+    width = np.maximum(hi - lo,1e-30) / g
+
+    code = create(scratch,'code',np.int32,(nf,))
+    counts = np.zeros(1 << (3 * BITS),dtype=np.int64)
+    for i in range(0,nf,tile):
+        f = np.arange(i,min(i + tile,nf))
+        _, (a,b,c) = corners(m,f)
+        center = (m.position[a] + m.position[b] + m.position[c]) / 3.0
+        cell = np.clip(((center - lo) / width).astype(np.int64),0,g - 1)
+        code[i:i+len(f)] = spread(cell[:,0]) | (spread(cell[:,1]) << 1) | (spread(cell[:,2]) << 2)
+        u, n = np.unique(code[i:i+len(f)],return_counts=True)
+        counts[u] += n
+
+    start = np.concatenate([[0],np.cumsum(counts)[:-1]])
+    order = create(scratch,'order',np.int32,(nf,))
+    for i in range(0,nf,tile):
+        c = np.asarray(code[i:i+tile])
+        by = np.argsort(c,kind='stable')
+        u, first, n = np.unique(c[by],return_index=True,return_counts=True)
+        rank = np.arange(len(c)) - np.repeat(first,n)
+        order[start[c[by]] + rank] = i + by
+        start[u] += n
+    return order
+
+#
+# edges(m,scratch,tile)
+#
+# Numbers the undirected edges of m just as loop.edge_ids does, a
+# chunk of half-edges at a time.  Returns the number of edges and the
+# edge number of each half-edge, kept in 'scratch'.
+#
+def edges(m,scratch,tile):
+    nh = len(m.source)
+    eid = create(scratch,'eid',np.int32,(nh,))
+    ne = 0
+    for i in range(0,nh,tile):
+        h = np.arange(i,min(i + tile,nh),dtype=np.int64)
+        twin = np.asarray(m.twin[i:i+len(h)])
+        first = (twin < 0) | (h < twin)
+        count = int(np.count_nonzero(first))
+        ids = np.empty(len(h),dtype=np.int32)
+        ids[first] = np.arange(ne,ne + count,dtype=np.int32)
+        eid[i:i+len(h)] = ids
+
+        # A second half-edge's twin comes before it, so is numbered.
+        later = np.nonzero(~first)[0]
+        eid[i + later] = eid[twin[later]]
+        ne += count
+    return ne, eid
+
+#
+# fans(m,scratch,tile)
+#
+# The valence of each vertex of m, and whether it lies on the
+# boundary, kept in 'scratch'.
+#
+def fans(m,scratch,tile):
+    nv = len(m.position)
+    nh = len(m.source)
+    valence = create(scratch,'valence',np.int32,(nv,))
+    on = create(scratch,'on',np.bool_,(nv,))
+    for i in range(0,nh,tile):
+        u, n = np.unique(m.source[i:i+tile],return_counts=True)
+        valence[u] += n.astype(np.int32)
+        border = i + np.nonzero(m.twin[i:i+tile] < 0)[0]
+        on[m.source[border]] = True
+        on[m.source[m.next[border]]] = True
+    return valence, on
+
+#
+# add(Q,rows,values)
+#
+# Adds each row of the K x 3 array 'values' into row rows[k] of Q,
+# summing those that go to the same row first.
+#
+def add(Q,rows,values):
+    u, inverse = np.unique(rows,return_inverse=True)
+    Q[u] += np.stack([np.bincount(inverse,values[:,k],minlength=len(u)) for k in range(3)],axis=1)
+
+#
+# connect(m,f,eid,nv,arrays)
+#
+# Writes the sources and twins of the children of the faces f of m,
+# and the out-edges they give their vertices, into the arrays of the
+# refined level.
+#
+def connect(m,f,eid,nv,arrays):
+    (e0,e1,e2), (v0,v1,v2) = corners(m,f)
+    m0, m1, m2 = nv + eid[e0], nv + eid[e1], nv + eid[e2]
+    source = np.stack([v0,m0,m2, v1,m1,m0, v2,m2,m1, m0,m1,m2],axis=1).astype(np.int32)
+    base = 12 * f.astype(np.int64)[:,None]
+
+    twin = np.empty(source.shape,dtype=np.int64)
+    twin[:,INNER] = base + INNER_TWIN
+    for q,e in enumerate((e0,e1,e2)):
+        tw = m.twin[e]
+        g, l = m.seats(np.maximum(tw,0))
+        across = 12 * g.astype(np.int64)
+        twin[:,FIRST[q]] = np.where(tw >= 0,across + SECOND[l],-1)
+        twin[:,SECOND[q]] = np.where(tw >= 0,across + FIRST[l],-1)
+
+    arrays['source'].reshape(-1,12)[f] = source
+    arrays['twin'].reshape(-1,12)[f] = twin
+
+    # Each vertex's out-edge is its last, as hemesh.link leaves it
+    # before seeing to the boundary.
+    h = (base + np.arange(12)).reshape(-1)
+    s = source.reshape(-1)
+    by = np.lexsort((h,s))
+    last = np.r_[s[by][1:] != s[by][:-1],True]
+    v, h = s[by][last], h[by][last]
+    out = arrays['out']
+    out[v] = np.maximum(out[v],h)
+
+#
+# place(m,f,eid,valence,on,Q)
+#
+# Adds what the half-edges of the faces f of m give to the positions
+# Q of the refined level, by Loop's weights (see loop.weights).  The
+# centers of the even vertices are added by centers().
+#
+def place(m,f,eid,valence,on,Q):
+    nv = len(m.position)
+    (e0,e1,e2), _ = corners(m,f)
+    h = np.concatenate([e0,e1,e2])
+    a = m.source[h]
+    b = m.source[m.next[h]]
+    c = m.source[m.next[m.next[h]]]
+    A, B, C = m.position[a], m.position[b], m.position[c]
+    odd = nv + eid[h].astype(np.int64)
+    border = m.twin[h] < 0
+    inside = ~border
+
+    rows = [odd[inside],odd[border],a[border],b[border]]
+    values = [3.0/16.0 * (A[inside] + B[inside]) + 1.0/8.0 * C[inside],
+              1.0/2.0 * (A[border] + B[border]),
+              1.0/8.0 * B[border],
+              1.0/8.0 * A[border]]
+
+    spokes = ~on[a]
+    rows.append(a[spokes])
+    values.append(beta(valence[a[spokes]])[:,None] * B[spokes])
+    add(Q,np.concatenate(rows).astype(np.int64),np.concatenate(values))
+
+#
+# centers(m,valence,on,Q,tile)
+#
+# Adds the weight of each even vertex of m on its own position.
+#
+def centers(m,valence,on,Q,tile):
+    nv = len(m.position)
+    for i in range(0,nv,tile):
+        n = np.asarray(valence[i:i+tile])
+        w = np.where(n > 0,1.0 - n * beta(n),1.0)
+        w = np.where(on[i:i+tile],3.0/4.0,w)
+        Q[i:i+len(n)] += w[:,None] * m.position[i:i+len(n)]
+
+#
+# refine(m,directory,tile=TILE)
+#
+# Refines m once, writing the result into 'directory', and returns it
+# opened from there.  Scratch arrays are kept in a subdirectory while
+# the refinement runs.
+#
+@tracing.timed('outofcore.refine',made)
+def refine(m,directory,tile=TILE):
+    nv, nf = len(m.position), len(m.side)
+    scratch = os.path.join(directory,'scratch')
+    shutil.rmtree(scratch,ignore_errors=True)
+    os.makedirs(scratch)
+
+    with tracing.span('tiles'):
+        order = tiles(m,scratch,tile)
+    ne, eid = edges(m,scratch,tile)
+    valence, on = fans(m,scratch,tile)
+
+    n, nh = nv + ne, 12 * nf
+    arrays = {'position': create(directory,'position',np.float64,(n,3)),
+              'source': create(directory,'source',np.int32,(nh,)),
+              'next': create(directory,'next',np.int32,(nh,)),
+              'twin': create(directory,'twin',np.int32,(nh,)),
+              'face': create(directory,'face',np.int32,(nh,)),
+              'out': create(directory,'out',np.int32,(n,)),
+              'side': create(directory,'side',np.int32,(4 * nf,))}
+    for i in range(0,n,tile):
+        arrays['out'][i:i+tile] = -1
+
+    for i in range(0,nf,tile):
+        with tracing.span('tile',faces=min(tile,nf - i)):
+            f = np.sort(order[i:i+tile]).astype(np.int64)
+            connect(m,f,eid,nv,arrays)
+            place(m,f,eid,valence,on,arrays['position'])
+    centers(m,valence,on,arrays['position'],tile)
+    for i in range(0,nh,3*tile):
+        layout(arrays,i,min(i + 3*tile,nh))
+
+    for a in arrays.values():
+        a.flush()
+    del arrays, order, eid, valence, on
+    shutil.rmtree(scratch,ignore_errors=True)
+    return load(directory)
+
+#
+# refine_to(m,levels,directory,tile=TILE,keep=False)
+#
+# Refines m the given number of times, keeping level k in the
+# subdirectory k of 'directory'.  Each level is deleted once the next
+# is made from it, unless keep is True.  Returns the last level.
+#
+def refine_to(m,levels,directory,tile=TILE,keep=False):
+    for k in range(1,levels + 1):
+        below = os.path.join(directory,str(k - 1))
+        m = refine(m,os.path.join(directory,str(k)),tile)
+        if not keep and k > 1:
+            shutil.rmtree(below,ignore_errors=True)
+    return m
+
+#
+# save(target,m,kind=None)
+#
+# Streams a level made here to an .obj or a binary .ply file, a block
+# at a time, without gathering its triangles in memory: its half-edges
+# are laid out face by face, so its sources are its triangles.
+#
+def save(target,m,kind=None):
+    return objio.WRITERS[objio.kind_of(target,kind)](target,m.position,m.source.reshape(-1,3))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print('usage: python3 outofcore.py file.obj levels directory output')
+        sys.exit(1)
+    m = objio.load(sys.argv[1])
+    levels = int(sys.argv[2])
+    print('level %d: %s' % (levels,estimate(m,levels)))
+    print('fits in memory:',fits(m,levels))
+    m = refine_to(m,levels,sys.argv[3])
+    print('wrote',save(sys.argv[4],m))
@@ -0,0 +1,331 @@
+#
+# parallel.py
+#
+# Loop subdivision of a hemesh spread over a pool of worker processes.
+#
+# The parent process numbers the edges of the mesh (see loop.edge_ids),
+# and puts the mesh's arrays, along with a few tables derived from
+# them, into shared memory.  The work is then cut into ranges, and
+# each worker fills in its own slice of the refined mesh's arrays,
+# which are shared too:
+#
+#   * a range of faces: the corners of their four children, and the
+#     twins of those children's half-edges;
+#   * a range of vertices: their new (even) positions;
+#   * a range of edges: the positions of their new (odd) vertices.
+#
+# An edge's odd vertex is numbered and placed once, by the range
+# holding that edge, and the faces on either side of it just refer to
+# it by its number, so nothing needs stitching afterwards.  Each
+# vertex's weighted sum is added up in the same order as by
+# loop.apply, and the children's twins are read off from those of
+# their parents rather than found by matching, so the result is the
+# same, bit for bit, as loop.refine's, however the work is divided.
+#
+# To measure how the time scales with the number of workers:
+#
+#    python3 parallel.py objs/stell.obj 4 8
+#
+# refines stell.obj four times, and then times its next refinement
+# with 1 through 8 workers.
+#
+
+import os
+import sys
+import time
+import numpy as np
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from hemesh import hemesh, made, laid_out
+import loop
+import tracing
+
+#
+# How many ranges to cut each kind of work into, per worker.
+#
+PIECES = 4
+
+#
+# The shared arrays a worker process has attached, by name, and the
+# blocks of shared memory behind them.
+#
+arrays = {}
+blocks = []
+
+#
+# class shared
+#
+# Numpy arrays in blocks of shared memory, made by the parent and
+# attached by the workers.
+#
+class shared:
+
+    def __init__(self):
+        self.blocks = []
+        self.arrays = {}
+        self.specs = {}
+
+    #
+    # S.put(name,array)
+    #
+    # Copies an array into a new shared block.
+    #
+    def put(self,name,array):
+        array = np.ascontiguousarray(array)
+        a = self.make(name,array.shape,array.dtype)
+        a[...] = array
+        return a
+
+    #
+    # S.make(name,shape,dtype)
+    #
+    # Makes a new shared array, not filled in.
+    #
+    def make(self,name,shape,dtype):
+        dtype = np.dtype(dtype)
+        size = max(1,int(np.prod(shape)) * dtype.itemsize)
+        block = SharedMemory(create=True,size=size)
+        self.blocks.append(block)
+        self.arrays[name] = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+        self.specs[name] = (block.name,shape,dtype.str)
+        return self.arrays[name]
+
+    #
+    # S.close()
+    #
+    # Frees the shared blocks.  The arrays must not be used after.
+    #
+    def close(self):
+        self.arrays.clear()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+#
+# attach(specs)
+#
+# Sets up a worker process with the shared arrays described by specs.
+#
+def attach(specs):
+    for name,(block_name,shape,dtype) in specs.items():
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape,dtype=np.dtype(dtype),buffer=block.buf)
+
+#
+# faces(A,lo,hi)
+#
+# Splits faces lo through hi-1.  The children of face f are laid out
+# as by loop.split, so that the half-edges of child j are 12f+3j+k.
+# The child half-edges along a parent half-edge 3f+k have as twins
+# the child half-edges along its parent's twin, 3g+l: the first half
+# of one runs against the second half of the other.
+#
+def faces(A,lo,hi):
+    nv = len(A['position'])
+    eid = A['eid']
+    twin = A['twin']
+    v = A['source'][3*lo:3*hi].reshape(-1,3)
+    mid = nv + eid[3*lo:3*hi].reshape(-1,3)
+    v0, v1, v2 = v.T
+    m0, m1, m2 = mid.T
+    children = np.stack([v0,m0,m2, v1,m1,m0, v2,m2,m1, m0,m1,m2],axis=1)
+    A['triangles'][4*lo:4*hi] = children.reshape(-1,3)
+
+    h = np.arange(3*lo,3*hi)
+    f, k = h // 3, h % 3
+    t = twin[h]
+    g, l = t // 3, t % 3
+    first = 12*f + 3*k
+    second = 12*f + 3*((k+1) % 3) + 2
+    out = A['twin2']
+    out[first] = np.where(t >= 0,12*g + 3*((l+1) % 3) + 2,-1)
+    out[second] = np.where(t >= 0,12*g + 3*l,-1)
+
+    # The half-edges inside each parent face pair up with those of
+    # its middle child.
+    base = 12*np.arange(lo,hi)
+    for j in range(3):
+        inner = base + 3*j + 1
+        middle = base + 9 + (j + 2) % 3
+        out[inner] = middle
+        out[middle] = inner
+
+#
+# evens(A,lo,hi)
+#
+# Places the refined even vertices lo through hi-1.  The weights of
+# each are gathered in the same order as by loop.weights.
+#
+def evens(A,lo,hi):
+    P = A['position']
+    source = A['source']
+    target = A['target']
+    on = A['on']
+    offsets = A['offsets']
+    rim = A['rim']
+
+    vs = np.arange(lo,hi)
+    valence = offsets[lo+1:hi+1] - offsets[lo:hi]
+    bs = loop.beta(valence)
+    inner = ~on[lo:hi]
+
+    rows = []
+    cols = []
+    vals = []
+
+    # Even vertices in the interior.
+    centers = vs[inner]
+    rows.append(centers)
+    cols.append(centers)
+    vals.append(np.where(valence[inner] > 0,1.0 - valence[inner]*bs[inner],1.0))
+    spokes = A['order'][offsets[lo]:offsets[hi]]
+    spokes = spokes[~on[source[spokes]]]
+    rows.append(source[spokes])
+    cols.append(target[spokes])
+    vals.append(bs[source[spokes] - lo])
+
+    # Even vertices on the boundary.
+    centers = vs[~inner]
+    rows.append(centers)
+    cols.append(centers)
+    vals.append(np.full(len(centers),3.0/4.0))
+    a, b = source[rim], target[rim]
+    ina = (a >= lo) & (a < hi)
+    inb = (b >= lo) & (b < hi)
+    rows.append(np.concatenate([a[ina],b[inb]]))
+    cols.append(np.concatenate([b[ina],a[inb]]))
+    vals.append(np.full(np.count_nonzero(ina) + np.count_nonzero(inb),1.0/8.0))
+
+    rows = np.concatenate(rows).astype(np.int64) - lo
+    A['position2'][lo:hi] = loop.apply(rows,np.concatenate(cols).astype(np.int64),
+                                       np.concatenate(vals),hi-lo,P)
+
+#
+# odds(A,lo,hi)
+#
+# Places the odd vertices of edges lo through hi-1.  Each edge's
+# weights are gathered in the same order as by loop.weights.
+#
+def odds(A,lo,hi):
+    P = A['position']
+    source = A['source']
+    target = A['target']
+    nv = len(P)
+
+    h1 = A['firsts'][lo:hi]
+    h2 = A['twin'][h1]
+    es = np.arange(hi-lo)
+    inside = h2 >= 0
+    ei, i1, i2 = es[inside], h1[inside], h2[inside]
+    eb, ib = es[~inside], h1[~inside]
+    opposite = lambda h: source[A['next'][A['next'][h]]]
+
+    rows = np.concatenate([ei,ei,ei,ei,ei,ei,eb,eb])
+    cols = np.concatenate([source[i1],source[i2],target[i1],target[i2],
+                           opposite(i1),opposite(i2),source[ib],target[ib]])
+    vals = np.concatenate([np.full(4*len(ei),3.0/16.0),np.full(2*len(ei),1.0/8.0),
+                           np.full(2*len(eb),1.0/2.0)])
+    A['position2'][nv+lo:nv+hi] = loop.apply(rows,cols.astype(np.int64),vals,hi-lo,P)
+
+#
+# work(task)
+#
+# Runs one task, (kind,lo,hi), on the arrays of this process.
+#
+def work(task):
+    kind, lo, hi = task
+    {'faces': faces, 'evens': evens, 'odds': odds}[kind](arrays,lo,hi)
+
+#
+# ranges(kind,n,pieces)
+#
+# Cuts n items into at most 'pieces' tasks of the given kind.
+#
+def ranges(kind,n,pieces):
+    cuts = np.linspace(0,n,max(1,min(pieces,n))+1).astype(np.int64)
+    return [(kind,int(lo),int(hi)) for lo,hi in zip(cuts[:-1],cuts[1:]) if hi > lo]
+
+#
+# refine(m,workers=None)
+#
+# Returns the same hemesh as loop.refine(m), computed by the given
+# number of worker processes (by default, one per processor).  With
+# one worker the tasks are run in this process.  A mesh with badly
+# oriented faces is refined by loop.refine instead.
+#
+@tracing.timed('parallel.refine',made)
+def refine(m,workers=None):
+    workers = workers or os.cpu_count() or 1
+    if len(m.bad) > 0:
+        return loop.refine(m)
+
+    nv = len(m.position)
+    nf = len(m.side)
+    ne, eid = loop.edge_ids(m)
+    h = np.arange(len(m.source))
+    order = np.argsort(m.source,kind='stable')
+    offsets = np.zeros(nv+1,dtype=np.int64)
+    np.cumsum(np.bincount(m.source,minlength=nv),out=offsets[1:])
+
+    S = shared()
+    try:
+        for name,a in (('position',m.position),('source',m.source),('next',m.next),
+                       ('twin',m.twin),('target',m.target()),('eid',eid),
+                       ('on',loop.boundary(m)),('order',order),('offsets',offsets),
+                       ('rim',np.nonzero(m.twin < 0)[0]),
+                       ('firsts',np.nonzero((m.twin < 0) | (h < m.twin))[0])):
+            S.put(name,a)
+        S.make('position2',(nv+ne,3),np.float64)
+        S.make('triangles',(4*nf,3),np.int32)
+        S.make('twin2',(12*nf,),np.int32)
+
+        pieces = PIECES * workers
+        tasks = ranges('faces',nf,pieces) + ranges('evens',nv,pieces) \
+            + ranges('odds',ne,pieces)
+        if workers == 1:
+            for kind,lo,hi in tasks:
+                globals()[kind](S.arrays,lo,hi)
+        else:
+            with get_context().Pool(workers,initializer=attach,initargs=(S.specs,)) as pool:
+                pool.map(work,tasks,chunksize=1)
+
+        triangles = S.arrays['triangles'].copy()
+        arrays = {'position': S.arrays['position2'].copy(),
+                  'source': triangles.reshape(-1),
+                  'twin': S.arrays['twin2'].copy()}
+    finally:
+        S.close()
+
+    # The rest of the connectivity is laid out as by hemesh.link.
+    return hemesh.of_arrays(laid_out(arrays,nv+ne))
+
+#
+# scaling(m,most)
+#
+# Times refine(m,k) for k = 1 to 'most' workers, along with
+# loop.refine(m).  Returns a list of (workers,seconds), with the
+# serial time given as 0 workers.
+#
+def scaling(m,most):
+    times = []
+    start = time.time()
+    loop.refine(m)
+    times.append((0,time.time() - start))
+    for k in range(1,most+1):
+        start = time.time()
+        refine(m,k)
+        times.append((k,time.time() - start))
+    return times
+
+
+if __name__ == '__main__':
+    import objio
+    m = objio.load(sys.argv[1] if len(sys.argv) > 1 else 'objs/stell.obj')
+    for _ in range(int(sys.argv[2]) if len(sys.argv) > 2 else 4):
+        m = loop.refine(m)
+    most = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    print('%d faces, %d processors' % (len(m.side),os.cpu_count()))
+    for k,seconds in scaling(m,most):
+        print('%8s: %.3f s' % ('serial' if k == 0 else '%d' % k,seconds))
@@ -19,6 +19,8 @@ from OpenGL.GL import *
 #
 class quat:
 
+    __slots__ = ('re','iv')
+
     def __init__(self,real,imagv):
         """ Constructs a new quat instance from the following:
               re: the scalar value of the quaternion
@@ -18,7 +18,8 @@ void main() {
 	       || bcoord[1] < diff[1]*0.5 
 	       || bcoord[2] < diff[2]*0.5);
 
-  if (wires==1 && edge) {
+  // wires==2 when drawing the wireframe as lines.
+  if ((wires==1 && edge) || wires==2) {
 
     gl_FragColor = vec4(0.8,0.8,0.3,1.0);
 
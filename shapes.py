@@ -0,0 +1,126 @@
+#
+# shapes.py
+#
+# Procedural triangle meshes, for testing and benchmarking at sizes
+# well beyond those of the sample .obj files.  Each generator takes a
+# target number of faces and returns a V x 3 array of positions and an
+# F x 3 array of counterclockwise corners, with F near the target:
+#
+#   icosphere(faces):  a closed sphere, by splitting an icosahedron
+#   torus(faces):      a closed torus, every vertex of valence 6
+#   grid(faces):       an open, wavy square sheet, with a boundary
+#   fan(faces):        a double cone whose two tips have very high
+#                      valence
+#
+# save(filename,P,F) writes one out as an .obj file.
+#
+
+import numpy as np
+from math import pi, sqrt
+from hemesh import hemesh
+from loop import split, edge_ids
+from objio import write_obj
+
+#
+# icosphere(faces)
+#
+# The unit sphere, made by splitting the 20 faces of an icosahedron
+# four ways as often as brings it nearest to 'faces' faces, pushing
+# each new vertex out onto the sphere.
+#
+def icosphere(faces):
+    t = (1.0 + sqrt(5.0)) / 2.0
+    P = np.array([[-1,t,0],[1,t,0],[-1,-t,0],[1,-t,0],
+                  [0,-1,t],[0,1,t],[0,-1,-t],[0,1,-t],
+                  [t,0,-1],[t,0,1],[-t,0,-1],[-t,0,1]],dtype=np.float64)
+    F = np.array([[0,11,5],[0,5,1],[0,1,7],[0,7,10],[0,10,11],
+                  [1,5,9],[5,11,4],[11,10,2],[10,7,6],[7,1,8],
+                  [3,9,4],[3,4,2],[3,2,6],[3,6,8],[3,8,9],
+                  [4,9,5],[2,4,11],[6,2,10],[8,6,7],[9,8,1]])
+    P /= np.linalg.norm(P,axis=1)[:,None]
+    while abs(4 * len(F) - faces) < abs(len(F) - faces):
+        m = hemesh(P,F)
+        ne, eid = edge_ids(m)
+        first = np.nonzero((m.twin < 0) | (np.arange(len(m.source)) < m.twin))[0]
+        mid = (P[m.source[first]] + P[m.target()[first]]) / 2.0
+        P = np.concatenate([P,mid / np.linalg.norm(mid,axis=1)[:,None]])
+        F, _ = split(m)
+    return P, F
+
+#
+# torus(faces,ratio=0.35)
+#
+# A torus of major radius 1 and minor radius 'ratio', lying in the
+# xz-plane.  Its n x k quads, with n about 3k, are each split in two.
+#
+def torus(faces,ratio=0.35):
+    k = max(3,int(round(sqrt(faces / 6.0))))
+    n = max(3,int(round(faces / (2.0 * k))))
+    u = 2.0 * pi * np.arange(n) / n
+    v = 2.0 * pi * np.arange(k) / k
+    U, V = np.meshgrid(u,v,indexing='ij')
+    r = 1.0 + ratio * np.cos(V)
+    P = np.stack([r * np.cos(U),ratio * np.sin(V),-r * np.sin(U)],axis=-1).reshape(-1,3)
+    return P, quads(n,k,True,True)
+
+#
+# grid(faces)
+#
+# An open n x n sheet of quads, each split in two, rippled in y so
+# that it isn't flat.  Its border is a boundary.
+#
+def grid(faces):
+    n = max(1,int(round(sqrt(faces / 2.0))))
+    x = np.linspace(-1.0,1.0,n+1)
+    X, Z = np.meshgrid(x,x,indexing='ij')
+    Y = 0.1 * np.sin(3.0 * X) * np.cos(2.0 * Z)
+    P = np.stack([Z,Y,X],axis=-1).reshape(-1,3)
+    return P, quads(n+1,n+1,False,False)
+
+#
+# fan(faces)
+#
+# A double cone: a ring of faces/2 vertices around the equator, each
+# joined to a tip above and a tip below.  Both tips have valence
+# faces/2.
+#
+def fan(faces):
+    n = max(3,faces // 2)
+    a = 2.0 * pi * np.arange(n) / n
+    ring = np.stack([np.cos(a),np.zeros(n),-np.sin(a)],axis=1)
+    P = np.concatenate([ring,[[0.0,1.0,0.0],[0.0,-1.0,0.0]]])
+    i = np.arange(n)
+    j = (i + 1) % n
+    top = np.stack([i,j,np.full(n,n)],axis=1)
+    bottom = np.stack([j,i,np.full(n,n+1)],axis=1)
+    return P, np.concatenate([top,bottom])
+
+#
+# quads(n,k,wrap_n,wrap_k)
+#
+# The triangles of an n x k array of vertices, numbered row by row,
+# two to each quad.  The rows (or columns) wrap around if asked.
+#
+def quads(n,k,wrap_n,wrap_k):
+    rows = n if wrap_n else n - 1
+    cols = k if wrap_k else k - 1
+    I, J = np.meshgrid(np.arange(rows),np.arange(cols),indexing='ij')
+    I, J = I.reshape(-1), J.reshape(-1)
+    a = I * k + J
+    b = ((I + 1) % n) * k + J
+    c = ((I + 1) % n) * k + (J + 1) % k
+    d = I * k + (J + 1) % k
+    return np.concatenate([np.stack([a,b,c],axis=1),np.stack([a,c,d],axis=1)])
+
+#
+# The generators, by name.
+#
+GENERATORS = {'icosphere': icosphere, 'torus': torus, 'grid': grid, 'fan': fan}
+
+#
+# save(filename,P,F)
+#
+# Writes a mesh to an .obj file.
+#
+def save(filename,P,F):
+    write_obj(filename,P,F)
@@ -0,0 +1,209 @@
+#
+# stencil.py
+#
+# Precomputed subdivision stencils.  Loop subdivision is linear in the
+# vertex positions, so for a fixed control mesh topology every vertex
+# of its level-N refinement is a fixed weighted sum of the control
+# vertices.  A stencil table holds those weights as a sparse matrix,
+# so that re-evaluating the refined mesh for new control positions
+# (a deformation, a tweak) is a single sparse multiply rather than a
+# chain of refine() calls.
+#
+# Tables are cached by a hash of the control connectivity and the
+# number of levels.  Only the CACHED most recently used tables are
+# kept:
+#
+#   S = table(m,3)              # build, or fetch from the cache
+#   P3 = S.evaluate(P0)         # V x 3 -> n x 3
+#   P3s = S.evaluate(poses)     # N x V x 3 -> N x n x 3
+#   m3 = S.mesh(P0)             # a hemesh for the level 3 mesh
+#
+# or, in one go, evaluate(m,poses,3).
+#
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from hemesh import hemesh
+from loop import split, weights
+
+#
+# The cached tables, by the key given by key(triangles,nv,levels),
+# least recently used first, and how many of them are kept.
+#
+tables = OrderedDict()
+CACHED = 8
+
+#
+# How many bytes of gathered weights evaluate() works through at once.
+#
+CHUNK = 1 << 26
+
+#
+# class stencil
+#
+# A sparse matrix in compressed row form, mapping the positions of
+# the control vertices to those of a refined mesh.  Row i holds the
+# weights for refined vertex i:
+#
+#   columns[offsets[i]:offsets[i+1]]: the control vertices
+#   weights[offsets[i]:offsets[i+1]]: their weights
+#
+# The refined mesh's faces are kept in 'triangles'.
+#
+class stencil:
+
+    def __init__(self,offsets,columns,weights,ncontrol,triangles):
+        self.offsets = offsets
+        self.columns = columns
+        self.weights = weights
+        self.ncontrol = ncontrol
+        self.triangles = triangles
+
+    #
+    # stencil.identity(n,triangles)
+    #
+    # The table that leaves n control vertices where they are.
+    #
+    @classmethod
+    def identity(cls,n,triangles):
+        return cls(np.arange(n+1,dtype=np.int64),
+                   np.arange(n,dtype=np.int64),
+                   np.ones(n),n,triangles)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    #
+    # S.compose(rows,cols,vals,n,triangles)
+    #
+    # Returns the table for the sparse weights (rows,cols,vals) from
+    # loop.weights applied after this table.  It has n rows, and the
+    # faces given by triangles.
+    #
+    def compose(self,rows,cols,vals,n,triangles):
+        # Expand each weight into the row of this table it scales.
+        starts = self.offsets[cols]
+        counts = self.offsets[cols+1] - starts
+        total = int(counts.sum())
+        ends = np.cumsum(counts)
+        at = np.arange(total,dtype=np.int64) \
+            - np.repeat(ends - counts,counts) + np.repeat(starts,counts)
+        r = np.repeat(rows,counts)
+        c = self.columns[at]
+        w = np.repeat(vals,counts) * self.weights[at]
+
+        # Sum the repeated (row,column) pairs.
+        keys, where = np.unique(r * self.ncontrol + c,return_inverse=True)
+        w = np.bincount(where.reshape(-1),w)
+        r = keys // self.ncontrol
+        c = keys % self.ncontrol
+        offsets = np.zeros(n+1,dtype=np.int64)
+        np.cumsum(np.bincount(r,minlength=n),out=offsets[1:])
+        return stencil(offsets,c,w,self.ncontrol,triangles)
+
+    #
+    # S.evaluate(P)
+    #
+    # Applies the table to control positions P, either one V x 3
+    # array or a batch of N poses as an N x V x 3 array.  Returns
+    # the refined positions with the same leading shape.
+    #
+    def evaluate(self,P):
+        P = np.asarray(P,dtype=np.float64)
+        if P.ndim == 2:
+            return self.evaluate(P[None])[0]
+
+        poses = len(P)
+        columns = np.ascontiguousarray(P.transpose(1,0,2)).reshape(self.ncontrol,-1)
+        result = np.empty((len(self),poses*3))
+        width = max(1,len(self.columns) // max(1,len(self)))
+        step = max(1,CHUNK // (24*poses*width))
+        for lo in range(0,len(self),step):
+            hi = min(lo+step,len(self))
+            a, b = self.offsets[lo], self.offsets[hi]
+            terms = columns[self.columns[a:b]] * self.weights[a:b,None]
+            result[lo:hi] = np.add.reduceat(terms,self.offsets[lo:hi]-a,axis=0)
+        return result.reshape(len(self),poses,3).transpose(1,0,2)
+
+    #
+    # S.mesh(P)
+    #
+    # The refined hemesh for control positions P.
+    #
+    def mesh(self,P):
+        return hemesh(self.evaluate(P),self.triangles)
+
+    #
+    # S.nbytes
+    #
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.columns.nbytes \
+            + self.weights.nbytes + self.triangles.nbytes
+
+#
+# key(triangles,nv,levels)
+#
+# The cache key for a control mesh with nv vertices and the given
+# faces, refined the given number of times.
+#
+def key(triangles,nv,levels):
+    h = hashlib.sha1(np.ascontiguousarray(triangles,dtype=np.int32).tobytes())
+    h.update(b'%d:%d' % (nv,levels))
+    return h.hexdigest()
+
+#
+# build(m,levels)
+#
+# Computes the stencil table taking the vertices of hemesh m to those
+# of its level-'levels' Loop refinement.
+#
+def build(m,levels):
+    nv = len(m.position)
+    S = stencil.identity(nv,m.triangles())
+    level = hemesh(np.zeros((nv,3)),S.triangles)
+    for k in range(levels):
+        rows, cols, vals = weights(level)
+        triangles, n = split(level)
+        S = S.compose(rows,cols,vals,n,triangles)
+        if k < levels - 1:
+            level = hemesh(np.zeros((n,3)),triangles)
+    return S
+
+#
+# table(m,levels)
+#
+# The stencil table for control mesh m, which is either a hemesh or a
+# we.py object, refined the given number of times.  Tables are built
+# once per control topology and then served from the cache, which
+# drops the least recently used table once it holds more than CACHED.
+#
+def table(m,levels):
+    if not isinstance(m,hemesh):
+        m = hemesh.from_object(m)
+    k = key(m.triangles(),len(m.position),levels)
+    if k in tables:
+        tables.move_to_end(k)
+    else:
+        tables[k] = build(m,levels)
+        while len(tables) > CACHED:
+            tables.popitem(last=False)
+    return tables[k]
+
+#
+# evaluate(m,poses,levels)
+#
+# The level-'levels' positions for each of the given control poses
+# (V x 3, or N x V x 3) of control mesh m.
+#
+def evaluate(m,poses,levels):
+    return table(m,levels).evaluate(poses)
+
+#
+# forget()
+#
+# Empties the cache.
+#
+def forget():
+    tables.clear()
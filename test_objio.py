@@ -0,0 +1,71 @@
+#
+# test_objio.py
+#
+# Checks of the bulk .obj parser, run with pytest.
+#
+
+import numpy as np
+import objio
+
+#
+# test_parse_skips_degenerate_faces(tmp_path)
+#
+# Face records with fewer than three corners make no triangles, as
+# they made none for the line-by-line reader.
+#
+def test_parse_skips_degenerate_faces(tmp_path):
+    path = tmp_path / 'degenerate.obj'
+    path.write_text('v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\n'
+                    'f 1 2 3\nf 1 2\nf 2 4 3\nf 4\n')
+    c = objio.parse(str(path))
+    assert len(c.position) == 4
+    assert np.array_equal(c.triangles,[[0,1,2],[1,3,2]])
+
+    path.write_text('v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\n'
+                    'f 1/1 2/2 3/3\nf 1/1 2/2\nf 2/2 4/4 3/3\n')
+    c = objio.parse(str(path))
+    assert np.array_equal(c.triangles,[[0,1,2],[1,3,2]])
+
+#
+# test_obj_round_trip(tmp_path)
+#
+# Positions written to an .obj file read back as the same doubles.
+#
+def test_obj_round_trip(tmp_path):
+    position = np.random.default_rng(1).random((50,3)) * 1e3 - 500.0
+    triangles = np.arange(48).reshape(-1,3)
+    path = str(tmp_path / 'round.obj')
+    objio.write_obj(path,position,triangles)
+    c = objio.parse(path)
+    assert np.array_equal(c.position,position)
+    assert np.array_equal(c.triangles,triangles)
+
+#
+# test_parse_mixed_polygons(tmp_path)
+#
+# Records of different sizes are split into fans record by record,
+# even when their corners add up to a multiple of three.
+#
+def test_parse_mixed_polygons(tmp_path):
+    path = tmp_path / 'mixed.obj'
+    path.write_text('v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n'
+                    'f 1 2 3 4\nf 1 2\n')
+    assert np.array_equal(objio.parse(str(path)).triangles,[[0,1,2],[0,2,3]])
+
+    path.write_text('v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n'
+                    'f 1/1 2/2 3/3 4/4\nf 1/1 2/2\n')
+    assert np.array_equal(objio.parse(str(path)).triangles,[[0,1,2],[0,2,3]])
+
+#
+# test_parse_indented_records(tmp_path)
+#
+# Blanks at the start of a line are ignored, so no vertex is lost and
+# the faces after it keep their meaning.
+#
+def test_parse_indented_records(tmp_path):
+    path = tmp_path / 'indented.obj'
+    path.write_text('v 0 0 0\n  v 1 0 0\n\tv 0 1 0\nv 1 1 0\n'
+                    ' f 1 2 3\nf 2 4 3\n')
+    c = objio.parse(str(path))
+    assert np.array_equal(c.position,[[0,0,0],[1,0,0],[0,1,0],[1,1,0]])
+    assert np.array_equal(c.triangles,[[0,1,2],[1,3,2]])
@@ -0,0 +1,127 @@
+#
+# test_refine.py
+#
+# Checks that the ways of refining a mesh agree with loop.refine, run
+# with pytest.  Each is tried on small meshes from shapes.py: an open
+# grid, which has a boundary, a double cone with two tips of high
+# valence, and an icosphere.
+#
+
+import numpy as np
+import pytest
+import loop
+import lattice
+import outofcore
+import stencil
+from hemesh import hemesh
+from shapes import GENERATORS
+
+SHAPES = [('grid',32),('fan',14),('icosphere',80)]
+
+#
+# shape(name,faces)
+#
+# The hemesh of one of the shapes of shapes.py.
+#
+def shape(name,faces):
+    return hemesh(*GENERATORS[name](faces))
+
+#
+# refined(m,levels)
+#
+# m refined by loop.refine the given number of times.
+#
+def refined(m,levels):
+    for k in range(levels):
+        m = loop.refine(m)
+    return m
+
+#
+# canonical(m)
+#
+# The faces of m as rows of positions, each row started at its
+# least corner and the rows sorted, so that meshes numbered
+# differently can be compared.
+#
+def canonical(m):
+    P = np.round(m.position,9)
+    T = m.triangles()
+    rank = np.empty(len(P),dtype=np.int64)
+    rank[np.lexsort(P.T[::-1])] = np.arange(len(P))
+    R = rank[T]
+    turn = np.argmin(R,axis=1)
+    R = np.stack([R[np.arange(len(R)),(turn + i) % 3] for i in range(3)],axis=1)
+    R = R[np.lexsort(R.T[::-1])]
+    return P[np.lexsort(P.T[::-1])], R
+
+#
+# test_batched_matches_serial(name,faces)
+#
+# we.py's refine gives the same vertices, in the same order, and the
+# same faces whether it walks the linked structure or the arrays.
+#
+@pytest.mark.parametrize('name,faces',SHAPES)
+def test_batched_matches_serial(name,faces):
+    o = shape(name,faces).to_object()
+    a = hemesh.from_object(o.refine(batched=False))
+    b = hemesh.from_object(o.refine())
+    assert np.allclose(a.position,b.position)
+    assert np.array_equal(a.triangles(),b.triangles())
+
+#
+# test_workers_match_serial(name,faces)
+#
+# Spreading refine() over worker processes changes nothing.
+#
+@pytest.mark.parametrize('name,faces',SHAPES)
+def test_workers_match_serial(name,faces):
+    o = shape(name,faces).to_object()
+    a = hemesh.from_object(o.refine())
+    b = hemesh.from_object(o.refine(workers=2))
+    assert np.array_equal(a.position,b.position)
+    assert np.array_equal(a.triangles(),b.triangles())
+
+#
+# test_refine_to_matches_repeated_refine(name,faces)
+#
+# lattice.refine_to numbers its vertices differently, but makes the
+# same mesh as refining level by level.
+#
+@pytest.mark.parametrize('name,faces',SHAPES)
+def test_refine_to_matches_repeated_refine(name,faces):
+    m = shape(name,faces)
+    for levels in (1,3):
+        Pa, Ta = canonical(lattice.refine_to(m,levels))
+        Pb, Tb = canonical(refined(m,levels))
+        assert np.allclose(Pa,Pb)
+        assert np.array_equal(Ta,Tb)
+
+#
+# test_stencil_matches_refine(name,faces)
+#
+# A stencil table gives the refined positions for new control
+# positions, in loop.refine's order.
+#
+@pytest.mark.parametrize('name,faces',SHAPES)
+def test_stencil_matches_refine(name,faces):
+    m = shape(name,faces)
+    moved = m.position + np.random.default_rng(2).normal(scale=0.05,size=m.position.shape)
+    S = stencil.table(m,2)
+    expected = refined(hemesh(moved,m.triangles()),2)
+    assert np.allclose(S.evaluate(moved),expected.position)
+    assert np.array_equal(S.mesh(moved).triangles(),expected.triangles())
+
+#
+# test_out_of_core_matches_refine(tmp_path,name,faces)
+#
+# Refining into memory-mapped files, a few faces at a time, gives
+# the same arrays as refining in memory.
+#
+@pytest.mark.parametrize('name,faces',SHAPES)
+def test_out_of_core_matches_refine(tmp_path,name,faces):
+    m = shape(name,faces)
+    a = outofcore.refine_to(m,2,str(tmp_path),tile=7)
+    b = refined(m,2)
+    assert np.allclose(a.position,b.position)
+    for array in ('source','next','twin','face','out','side'):
+        assert np.array_equal(getattr(a,array),getattr(b,array))
@@ -0,0 +1,230 @@
+#
+# tracing.py
+#
+# Timing spans and counters for the hot paths: reading, refining,
+# compiling, uploading, and drawing.  Tracing is off until enable() is
+# called, and while off every span and counter is a test of one flag,
+# so the instrumented code runs at full speed.
+#
+# A span times a named stretch of code, either as a block
+#
+#    with tracing.span('draw'):
+#        ...
+#
+# or as a whole function, by decorating it with @tracing.timed('read').
+# A counter adds up a quantity, like the faces a refinement made or
+# the bytes sent to the GPU, and a gauge records a value as it
+# changes, like the frame time or the level being viewed:
+#
+#    tracing.count('bytes uploaded',array.nbytes)
+#    tracing.gauge('level',k)
+#
+# What was recorded can be summarized, saved as JSON, or saved as a
+# Chrome trace-event file, which chrome://tracing and ui.perfetto.dev
+# show as a timeline, spans nested by thread, counters as graphs.
+#
+
+import functools
+import json
+import os
+import threading
+import time
+
+#
+# How many spans and samples are kept for the timeline.  Past this,
+# they are still summed into the totals, but their events are dropped.
+#
+LIMIT = 1 << 20
+
+on = False        # Is tracing enabled?
+origin = 0.0      # When tracing was enabled, in perf_counter seconds.
+events = []       # (kind,name,start,seconds or value,thread,args)
+totals = {}       # Span name -> [calls,seconds,longest]
+counters = {}     # Counter or gauge name -> current value
+dropped = 0       # Events past LIMIT, not kept.
+
+#
+# enable(), disable()
+#
+# Switch tracing on and off.  Enabling clears what was recorded.
+#
+def enable():
+    global on
+    reset()
+    on = True
+
+def disable():
+    global on
+    on = False
+
+#
+# reset()
+#
+# Forgets everything recorded.
+#
+def reset():
+    global origin, events, totals, counters, dropped
+    origin = time.perf_counter()
+    events = []
+    totals = {}
+    counters = {}
+    dropped = 0
+
+#
+# record(kind,name,start,value,args)
+#
+# Keeps one event for the timeline, unless there are already too many.
+#
+def record(kind,name,start,value,args):
+    global dropped
+    if len(events) < LIMIT:
+        events.append((kind,name,start,value,threading.get_ident(),args))
+    else:
+        dropped += 1
+
+#
+# class timer
+#
+# A span being timed.  Made by span() when tracing is on.
+#
+class timer:
+
+    def __init__(self,name,args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exception):
+        seconds = time.perf_counter() - self.start
+        total = totals.get(self.name)
+        if total is None:
+            totals[self.name] = [1,seconds,seconds]
+        else:
+            total[0] += 1
+            total[1] += seconds
+            total[2] = max(total[2],seconds)
+        record('span',self.name,self.start - origin,seconds,self.args)
+
+#
+# class idle
+#
+# The span handed out when tracing is off.  Does nothing.
+#
+class idle:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exception):
+        pass
+
+IDLE = idle()
+
+#
+# span(name,**args)
+#
+# A context manager timing the code it surrounds.  Any keyword
+# arguments are kept with the span, and shown with it in the timeline.
+#
+def span(name,**args):
+    if not on:
+        return IDLE
+    return timer(name,args)
+
+#
+# timed(name,counts=None)
+#
+# A decorator timing every call of a function as a span.  If given,
+# counts(result) gives a dictionary of counter increments for what
+# the call returned.
+#
+def timed(name,counts=None):
+    def decorate(f):
+        @functools.wraps(f)
+        def traced(*args,**kwargs):
+            if not on:
+                return f(*args,**kwargs)
+            with timer(name,{}):
+                result = f(*args,**kwargs)
+            if counts is not None:
+                for counter,n in counts(result).items():
+                    count(counter,n)
+            return result
+        return traced
+    return decorate
+
+#
+# count(name,n=1)
+#
+# Adds n to a counter.
+#
+def count(name,n=1):
+    if not on:
+        return
+    counters[name] = counters.get(name,0) + n
+    record('counter',name,time.perf_counter() - origin,counters[name],None)
+
+#
+# gauge(name,value)
+#
+# Sets a gauge to a value.
+#
+def gauge(name,value):
+    if not on:
+        return
+    counters[name] = value
+    record('counter',name,time.perf_counter() - origin,value,None)
+
+#
+# summary()
+#
+# A printable table of the spans, longest total first, and the
+# counters.
+#
+def summary():
+    lines = ['%-20s %8s %11s %11s %11s' % ('span','calls','total ms','mean ms','max ms')]
+    for name,(calls,seconds,longest) in sorted(totals.items(),key=lambda t: -t[1][1]):
+        lines.append('%-20s %8d %11.3f %11.3f %11.3f'
+                     % (name,calls,1000*seconds,1000*seconds/calls,1000*longest))
+    for name,value in sorted(counters.items()):
+        lines.append('%-20s %8s' % (name,value if isinstance(value,int) else '%.3f' % value))
+    if dropped:
+        lines.append('(%d events past the limit of %d were dropped)' % (dropped,LIMIT))
+    return '\n'.join(lines)
+
+#
+# save_json(filename)
+#
+# Writes the totals, the counters, and every kept event as JSON.
+# Times are in seconds since tracing was enabled.
+#
+def save_json(filename):
+    spans = {name: {'calls': calls,'seconds': seconds,'longest': longest}
+             for name,(calls,seconds,longest) in totals.items()}
+    kept = [{'kind': kind,'name': name,'at': start,'value': value,'thread': thread,'args': args}
+            for kind,name,start,value,thread,args in events]
+    with open(filename,'w') as f:
+        json.dump({'spans': spans,'counters': counters,'dropped': dropped,'events': kept},f)
+
+#
+# save_chrome(filename)
+#
+# Writes the kept events in the Chrome trace-event format: spans as
+# complete ('X') events and counter values as counter ('C') events,
+# with times in microseconds.
+#
+def save_chrome(filename):
+    pid = os.getpid()
+    trace = []
+    for kind,name,start,value,thread,args in events:
+        if kind == 'span':
+            trace.append({'name': name,'cat': 'mesh','ph': 'X','pid': pid,'tid': thread,
+                          'ts': 1e6 * start,'dur': 1e6 * value,'args': args or {}})
+        else:
+            trace.append({'name': name,'ph': 'C','pid': pid,'tid': thread,
+                          'ts': 1e6 * start,'args': {name: value}})
+    with open(filename,'w') as f:
+        json.dump({'traceEvents': trace,'displayTimeUnit': 'ms'},f)
@@ -25,9 +25,12 @@
 #         three border half-edges.  
 
 from constants import *
-from geometry import vector, point, ORIGIN
+from geometry import vector, point, vectors, points, ORIGIN
 from math import sqrt,cos,pi
+from array import array
+import numpy as np
 import sys
+import tracing
 
 #
 # class fan
@@ -38,6 +41,8 @@ import sys
 # 
 class fan:
 
+	__slots__ = ('vertex','which')
+
 	#
 	# The fan instance attributes:
 	#
@@ -101,6 +106,8 @@ class fan:
 #
 class vertex:
 
+	__slots__ = ('position','edge','id','vn')
+
 	# vertex(P,o):
 	#
 	# (Creates and) initializes a new vertex at position P as part of
@@ -126,17 +133,23 @@ class vertex:
 	#
 	# Returns the surface normal at this vertex.  Computes 
 	# a normal from the fan of faces around the vertex, were
-	# no normal computed yet.
+	# no normal computed yet.  Each face counts in proportion
+	# to its area.  (See object.normals for computing all of
+	# them at once.)
 	#
 	def normal(self):
 			# If there's no normal, compute one.
-			if not self.vn:
-					# Sum the incident face normals.
-					ns = vector(0.0,0.0,0.0)
+			if self.vn is None:
+					# Sum the incident face normals, scaled by area.
+					nx = ny = nz = 0.0
 					for e in self.around():
-							ns = ns + e.face.normal()
+							u = e.vector()
+							v = e.next.vector()
+							nx += u.dy*v.dz - u.dz*v.dy
+							ny += u.dz*v.dx - u.dx*v.dz
+							nz += u.dx*v.dy - u.dy*v.dx
 					# Normalize that sum.
-					self.set_normal(ns.unit())
+					self.set_normal(vector(nx,ny,nz).unit())
 
 			# Return the normal attribute.
 			return self.vn
@@ -147,7 +160,7 @@ class vertex:
 	# Returns the material color of this vertex.  For now,
 	# we'll just hardwire the color to a medium slate blue.
 	def color(self):
-			return vector(0.5,0.45,0.57)
+			return vector(*COLOR)
 
 	# self.around()
 	#
@@ -173,12 +186,15 @@ class vertex:
 	def set_first_edge(self):
 			e = self.edge
 			while e != None \
-						and e.twin != None \
-						and e != self.edge:
+						and e.twin != None:
 			
 					# If not, then we work backwards to the prior edge.
 					e = e.twin.next
 
+					# Stop should we come all the way around a cone.
+					if e == self.edge:
+							break
+
 			# Otherwise, let's have this be the first out edge.
 			self.edge = e
 
@@ -195,6 +211,8 @@ class vertex:
 #
 class edge:
 
+	__slots__ = ('source','face','next','twin','id')
+
 	#
 	# edge(V1,V2,f):
 	#
@@ -206,7 +224,7 @@ class edge:
 	#  * face: left face bordered by this edge
 	#  * next: next edge bordering the same face
 	#  * twin: the twin edge to this edge
-	#  * o: the object that has this edge
+	#  * id: integer id, its place in the object's edge map
 	#
 	def __init__(self,V1,V2,f,o):
 
@@ -216,19 +234,10 @@ class edge:
 
 			self.next = None  # Will be set later.
 
-			# Register this edge.
-			iv1 = V1.id
-			iv2 = V2.id
-			if (iv1,iv2) in o.edge:
-					print('Bad orientation for face ',f, iv1, iv2)
-			o.edge[(iv1,iv2)] = self
-
-			# Check if this edge has a twin yet.
+			# Register this edge.  Its twin is found, along with
+			# all the others, when the object is finished.
 			self.twin = None
-			if (iv2,iv1) in o.edge:
-					# Update the twin info of its twin.
-					self.twin = o.edge[(iv2,iv1)]
-					self.twin.twin = self
+			o.edge.add(self,V1.id,V2.id)
 	
 	# 
 	# self.vertex(i):
@@ -272,6 +281,8 @@ class edge:
 #
 class face:
 
+	__slots__ = ('side','id','fn')
+
 	#
 	# face(V1,V2,V3,o):
 	#
@@ -302,14 +313,14 @@ class face:
 	#
 	# self.normal():
 	#
-	# Returns the surface normal at this vertex.  Computes 
+	# Returns the unit surface normal of this face.  Computes 
 	# a normal if it hasn't been computed yet.
 	#
 	def normal(self):
-			if not self.fn:
-					e0 = self.edge(0).direction()
-					e1 = self.edge(1).direction()
-					self.fn = e0.cross(e1)
+			if self.fn is None:
+					e0 = self.edge(0).vector()
+					e1 = self.edge(1).vector()
+					self.fn = e0.cross(e1).unit()
 
 			return self.fn
 
@@ -346,6 +357,248 @@ class face:
 			else:
 					return None
 
+#
+# class edgemap:
+#
+# The half-edges of an object, looked up by the ids of their two
+# vertices as o.edge[(i,j)].  Rather than a dictionary with a tuple
+# key per half-edge, it keeps the half-edges in a list and their
+# (source,target) pairs packed into 64-bit integers in an array.
+# Lookups search a sorted copy of the keys, made when first needed,
+# and twins are matched all at once by link(), which finish() calls.
+#
+# Half-edges sharing their directed key with another, from a badly
+# oriented or non-manifold face, are left without a twin and listed
+# in 'bad'.
+#
+class edgemap:
+
+	def __init__(self):
+			self.edges = []            # Every half-edge, in order made.
+			self.keys = array('q')     # The packed key of each.
+			self.sorted = None         # The keys, sorted, once needed,
+			self.order = None          # and the half-edge of each.
+			self.twins = None          # The id of each twin, or -1.
+			self.bad = []
+			self.changes = 0           # Bumped whenever edges change.
+
+	#
+	# self.add(e,i,j):
+	#
+	# Registers half-edge e, from vertex i to vertex j.
+	#
+	def add(self,e,i,j):
+			e.id = len(self.edges)
+			self.edges.append(e)
+			self.keys.append((i << 32) | j)
+			self.sorted = None
+			self.changes += 1
+
+	#
+	# self.index():
+	#
+	# Sorts the keys for searching, if any were added since.
+	#
+	def index(self):
+			if self.sorted is None:
+					keys = np.frombuffer(self.keys,dtype=np.int64) if self.keys else np.zeros(0,dtype=np.int64)
+					self.order = np.argsort(keys,kind='stable')
+					self.sorted = keys[self.order]
+
+	#
+	# self.link():
+	#
+	# Sets the twin of every half-edge, or None where there is none,
+	# and lists the bad half-edges.
+	#
+	def link(self):
+			from hemesh import match
+			keys = np.frombuffer(self.keys,dtype=np.int64) if self.keys else np.zeros(0,dtype=np.int64)
+			twins, bad = match(keys >> 32,keys & MASK,1 << 32)
+			self.twins = twins
+			self.changes += 1
+			es = self.edges
+			for e,t in zip(es,twins.tolist()):
+					e.twin = es[t] if t >= 0 else None
+			self.bad = [es[h] for h in bad.tolist()]
+			if self.bad:
+					print('Bad orientation for %d half-edges, left without twins' % len(self.bad))
+
+	#
+	# self.find(i,j):
+	#
+	# The position of the half-edge from i to j in self.edges, or -1.
+	#
+	def find(self,i,j):
+			self.index()
+			key = (i << 32) | j
+			at = int(np.searchsorted(self.sorted,key))
+			if at < len(self.sorted) and self.sorted[at] == key:
+					return int(self.order[at])
+			return -1
+
+	def __getitem__(self,ij):
+			h = self.find(*ij)
+			if h < 0:
+					raise KeyError(ij)
+			return self.edges[h]
+
+	def get(self,ij,default=None):
+			h = self.find(*ij)
+			return self.edges[h] if h >= 0 else default
+
+	def __contains__(self,ij):
+			return self.find(*ij) >= 0
+
+	def __len__(self):
+			return len(self.edges)
+
+	def __iter__(self):
+			for key in self.keys:
+					yield (key >> 32, key & MASK)
+
+	def values(self):
+			return iter(self.edges)
+
+	def items(self):
+			for key,e in zip(self.keys,self.edges):
+					yield (key >> 32, key & MASK), e
+
+	#
+	# self.nbytes():
+	#
+	# The bytes held by the table, not counting the half-edges.
+	#
+	def nbytes(self):
+			n = sys.getsizeof(self.edges) + self.keys.buffer_info()[1] * self.keys.itemsize
+			if self.sorted is not None:
+					n += self.sorted.nbytes + self.order.nbytes
+			return n
+
+#
+# The low 32 bits of a packed key, the target vertex.
+#
+MASK = (1 << 32) - 1
+
+#
+# class rings:
+#
+# The one-ring of every vertex of a finished object, laid out in
+# compressed sparse rows.  The out edges of vertex v, in the order its
+# fan visits them (see class fan), are
+#
+#    R.edges[R.offsets[v]:R.offsets[v+1]]
+#
+# and its neighbors, as vertex ids, are
+#
+#    R.neighbors[R.starts[v]:R.starts[v+1]]
+#
+# which is one more than its out edges on the boundary, where the
+# ring is open and ends with the source of the last face's last edge.
+# R.border[v] tells whether it is.  Built by object.rings(), which
+# makes a new one whenever the object's edges or its number of
+# vertices have changed.
+#
+class rings:
+
+	def __init__(self,o):
+			es = o.edge
+			nv = len(o.vertex)
+			n = len(es)
+			self.changes = es.changes
+			self.nvertices = nv
+
+			keys = np.frombuffer(es.keys,dtype=np.int64) if n > 0 else np.zeros(0,dtype=np.int64)
+			source = keys >> 32
+			target = keys & MASK
+			twin = es.twins if es.twins is not None else np.full(n,-1)
+			h = np.arange(n)
+			prev = h - h % 3 + (h + 2) % 3
+			out = np.array([-1 if V.edge is None else V.edge.id for V in o.vertex],dtype=np.int64)
+
+			# Walk every fan at once, one edge a step, writing each
+			# vertex's edges into the slots given by its out-degree.
+			room = np.zeros(nv+1,dtype=np.int64)
+			np.cumsum(np.bincount(source,minlength=nv),out=room[1:])
+			slots = np.full(n,-1,dtype=np.int64)
+			count = np.zeros(nv,dtype=np.int64)
+			border = np.zeros(nv,dtype=bool)
+			walking = np.nonzero(out >= 0)[0]
+			at = out[walking]
+			while len(walking) > 0:
+					slots[room[walking] + count[walking]] = at
+					count[walking] += 1
+					after = twin[prev[at]]
+					border[walking[after < 0]] = True
+					going = (after >= 0) & (after != out[walking])
+					walking = walking[going]
+					at = after[going]
+
+			self.offsets = np.zeros(nv+1,dtype=np.int64)
+			np.cumsum(count,out=self.offsets[1:])
+			half = slots[slots >= 0]
+			self.half = half
+			self.edges = [es.edges[i] for i in half.tolist()]
+			self.border = border
+
+			# The neighbors: the target of each edge, and the closing
+			# neighbor of each open ring.
+			self.starts = self.offsets + np.concatenate([[0],np.cumsum(border)])
+			self.neighbors = np.empty(self.starts[-1],dtype=np.int64)
+			place = np.arange(len(half)) + np.repeat(self.starts[:-1] - self.offsets[:-1],count)
+			self.neighbors[place] = target[half]
+			ends = np.nonzero(border)[0]
+			self.neighbors[self.starts[ends+1] - 1] = source[prev[half[self.offsets[ends+1] - 1]]]
+
+	#
+	# R.count(v):
+	#
+	# The number of out edges of v, a vertex or its id.
+	#
+	def count(self,v):
+			i = v if isinstance(v,int) else v.id
+			return int(self.offsets[i+1] - self.offsets[i])
+
+	#
+	# R.valence(v):
+	#
+	# The number of neighbors of v, a vertex or its id.
+	#
+	def valence(self,v):
+			i = v if isinstance(v,int) else v.id
+			return int(self.starts[i+1] - self.starts[i])
+
+	#
+	# R.around(v):
+	#
+	# The out edges of v, a vertex or its id, as a list in fan order.
+	#
+	def around(self,v):
+			i = v if isinstance(v,int) else v.id
+			return self.edges[self.offsets[i]:self.offsets[i+1]]
+
+	#
+	# R.ring(v):
+	#
+	# The neighbor ids of v, a vertex or its id, as an array.
+	#
+	def ring(self,v):
+			i = v if isinstance(v,int) else v.id
+			return self.neighbors[self.starts[i]:self.starts[i+1]]
+
+	#
+	# R.sums(values):
+	#
+	# For an array with a row per vertex, the sum over each vertex's
+	# neighbors of their rows.
+	#
+	def sums(self,values):
+			values = np.asarray(values)
+			total = np.zeros((len(self.border),) + values.shape[1:],dtype=values.dtype)
+			owner = np.repeat(np.arange(len(self.border)),np.diff(self.starts))
+			np.add.at(total,owner,values[self.neighbors])
+			return total
+
 #
 # class object:
 #
@@ -355,8 +608,10 @@ class object:
 
 	def __init__(self):
 			self.vertex = []
-			self.edge = {}
+			self.edge = edgemap()
 			self.face = []
+			self.ring_index = None
+			self.normal_cache = None
 
 	#
 	# o.read(f)
@@ -366,59 +621,47 @@ class object:
 	# of the object described.
 	#
 	# The end result is a linked data structure, referencable
-	# by a vertex list 'o.vertex', an edge index pair dictionary
-	# 'o.edge', and a face list 'o.face'.  
+	# by a vertex list 'o.vertex', an edge map 'o.edge' indexed by
+	# vertex id pairs, and a face list 'o.face'.
 	#
+	@tracing.timed('read')
 	def read(self,filename):
+		from objio import parse
 
-		obj_file = open(filename,'r')
-		normali = 0
-
-		for line in obj_file:
-
-			# Parse a line.
-			parts = line[:-1].split()
-			if len(parts) > 0:
-
-				# Read a vertex description line.
-				if parts[0] == 'v': 
-					x = float(parts[1])
-					y = float(parts[2])
-					z = float(parts[3])
-					P = point(x,y,z)
-					vertex(P,self)
-
-				# Read a vertex normal description line.
-				elif parts[0] == 'vn': 
-					dx = float(parts[1])
-					dy = float(parts[2])
-					dz = float(parts[3])
-					vn = vector(dx,dy,dz).unit()
-					self.vertex[normali].set_normal(vn)
-					normali += 1
-
-				# Read a face/fan description line.
-				elif parts[0] == 'f': 
+		# Parse the file's vertex, normal, and face records in bulk.
+		contents = parse(filename)
 
-					vi_fan = [int(p.split('/')[0]) - 1 for p in parts[1:]]
+		# Make the vertices.
+		for x,y,z in contents.position.tolist():
+			vertex(point(x,y,z),self)
 
-					vi1 = vi_fan[0]
-					# add the faces of the fan
-					for i in range(1,len(vi_fan)-1):
-						vi2 = vi_fan[i]
-						vi3 = vi_fan[i+1]
+		# Attach the vertex normals, in order.
+		for V,(dx,dy,dz) in zip(self.vertex,contents.normal.tolist()):
+			V.set_normal(vector(dx,dy,dz).unit())
 
-						V1 = self.vertex[vi1]
-						V2 = self.vertex[vi2]
-						V3 = self.vertex[vi3]
-
-						face(V1,V2,V3,self)
+		# Add the faces, with polygons already split into fans.
+		vs = self.vertex
+		for vi1,vi2,vi3 in contents.triangles.tolist():
+			face(vs[vi1],vs[vi2],vs[vi3],self)
 
 		# Wrap up the vertex fans.  Re-chooses each vertex's out edge.
 		self.finish()
 
-		# Rescale and center the points.
-		self.rebox()
+		# Rescale and center the points, using the bounding box
+		# found by the parse.
+		self.rebox(contents.lo,contents.hi)
+
+	#
+	# o.write(target,normals=False)
+	#
+	# Writes the object's positions, faces, and, if asked, vertex
+	# normals to an .obj or a binary .ply file, chosen by the
+	# extension of 'target', a file name or an open file.  See
+	# objio.save.  Returns what was written, with its bytes/sec.
+	#
+	def write(self,target,normals=False,kind=None):
+		from objio import save
+		return save(target,self,normals,kind)
 
 
 	# o.finish()
@@ -428,12 +671,30 @@ class object:
 	# through the edges that have 'V' as a source and, if that
 	# vertex is at the tip of a fan rather than a cone, it
 	# finds the out edge that is first on that fan (in CCW ordering).
+	# Before that, it pairs every edge with its twin (see edgemap).
 	#
 	def finish(self):
+		# pair up the twin edges
+		self.edge.link()
+
 		# set the vertex fan ordering
 		for V in self.vertex:
 				V.set_first_edge()
 
+	#
+	# o.rings()
+	#
+	# The one-ring index of this finished object (see class rings),
+	# built on first use and rebuilt after its edges change or
+	# vertices are added.
+	#
+	def rings(self):
+		R = self.ring_index
+		if R is None or R.changes != self.edge.changes or R.nvertices != len(self.vertex):
+			R = rings(self)
+			self.ring_index = R
+		return R
+
 	# o.rebox()
 	#
 	# This normalizes the vertex positions so that the fit within a
@@ -441,27 +702,57 @@ class object:
 	# do this but I found that, by changing the geometry instead, my
 	# code was much easier to debug.
 	#
-	def rebox(self):
-		max_dims = point(sys.float_info.min,
-										 sys.float_info.min,
-										 sys.float_info.min)
-		min_dims = point(sys.float_info.max,
-										 sys.float_info.max,
-										 sys.float_info.max)
-		for V in self.vertex:
-				max_dims = max_dims.max(V.position)
-				min_dims = min_dims.min(V.position)
+	# The corners of the bounding box can be given as lo and hi,
+	# should they be known already; otherwise they are found here.
+	# The points are moved all at once, as an array of points.
+	#
+	def rebox(self,lo=None,hi=None):
+		if not self.vertex:
+				return
+		ps = points.of([V.position for V in self.vertex])
+		if lo is not None and hi is not None:
+				max_dims = point(hi[0],hi[1],hi[2])
+				min_dims = point(lo[0],lo[1],lo[2])
+		else:
+				max_dims = ps.max()
+				min_dims = ps.min()
 
-		span = max_dims - min_dims
 		center = point((min_dims.x + max_dims.x)/2.0,
 									 min_dims.y,
 									 (min_dims.z + max_dims.z)/2.0)
 		scale = 1.4/abs(max_dims - center)
 
-		for V in self.vertex:
-				V.position = ORIGIN + scale * (V.position-center)
-
-	# o.compile()
+		moved = ORIGIN + scale * (ps - center)
+		for V,P in zip(self.vertex,moved):
+				V.position = P
+
+	# o.normals()
+	#
+	# Gives every vertex that has no normal yet the one that
+	# vertex.normal would compute, but finds them all in a
+	# single batched pass over the mesh's arrays (see hemesh.py)
+	# rather than walking each vertex's fan.
+	#
+	# The batched normals are kept, along with the edge changes
+	# and the vertex positions they were found for, so that they
+	# are only found again once an edge or a vertex has changed.
+	#
+	def normals(self):
+		missing = [V for V in self.vertex if V.vn is None]
+		if not missing:
+			return
+		ps = points.of([V.position for V in self.vertex]).array
+		cached = self.normal_cache
+		if cached is None or cached[0] != self.edge.changes or not np.array_equal(cached[1],ps):
+			from hemesh import hemesh
+			ns = hemesh.from_object(self,normals=False).normals().tolist()
+			cached = (self.edge.changes,ps,ns)
+			self.normal_cache = cached
+		ns = cached[2]
+		for V in missing:
+			V.set_normal(vector(*ns[V.id]))
+
+	# o.compile(indexed=False)
 	#
 	# Produces a triple of lists that are used to build the 
 	# VBOs for rendering this object in hardware.
@@ -470,131 +761,170 @@ class object:
 	# the vertex positions, vertex normal directions, and
 	# the vertex colors.
 	#
-	def compile(self):
-		varray = []
-		narray = []
-		carray = []
+	# With indexed=True, each vertex appears once in those
+	# lists, rather than once for every face corner, and two
+	# lists of vertex ids follow them: the three corners of 
+	# each face, and the two ends of each edge.
+	#
+	# The positions and normals are gathered as arrays (see points
+	# and vectors in geometry.py) and picked out by face corner.
+	#
+	@tracing.timed('compile')
+	def compile(self, indexed=False):
+		self.normals()
+		ps = points.of([v.position for v in self.vertex])
+		ns = vectors.of([v.normal() for v in self.vertex])
+		if indexed:
+			iarray = []
+			for f in self.face:
+				e = f.side
+				iarray.extend((e.source.id, e.next.source.id, e.next.next.source.id))
+			larray = []
+			for (i,j),e in self.edge.items():
+				if e.twin is None or i < j:
+					larray.extend([i,j])
+			varray = ps.array.ravel().tolist()
+			narray = ns.array.ravel().tolist()
+			carray = list(COLOR) * len(self.vertex)
+			return (varray,narray,carray,iarray,larray)
+
+		corners = []
 		for f in self.face:
-			for i in [0,1,2]:
-				varray.extend(f.vertex(i).position.components())
-				narray.extend(f.vertex(i).normal().components())
-				carray.extend(f.vertex(i).color().components())
+			e = f.side
+			corners.extend((e.source.id, e.next.source.id, e.next.next.source.id))
+		varray = ps[corners].array.ravel().tolist()
+		narray = ns[corners].array.ravel().tolist()
+		carray = list(COLOR) * len(corners)
 		return (varray,narray,carray)
 
 	#
-	# o' = o.refine()
-	# refines an object using Loop's subdivision
+	# o' = o.limit()
 	#
-	def refine(self):
-		selfie = object()
-		vclones = {} 
-		vnew = {}
+	# A copy of this object with every vertex moved onto the Loop
+	# limit surface, and given the exact limit surface normal there
+	# (see limit.py).  It can be used on the control mesh or as a
+	# last step after refine(), so that a coarse level is placed and
+	# shaded like a much finer one.
+	#
+	def limit(self):
+		from hemesh import hemesh
+		from limit import project
+		return project(hemesh.from_object(self)).to_object()
 
-		#create four faces: splitting phase
-		for f in self.face:
-			nvpts = []
-			for edge in f.edges():
-				if edge.source not in vclones:
-					vclones[edge.source] = vertex(edge.source.position, selfie)
+	#
+	# o' = o.refine_to(levels)
+	#
+	# The same object as that many calls of refine() would give,
+	# up to the numbering of its vertices and faces, but built
+	# straight from the regular pattern that each face is split
+	# into (see lattice.py), without the levels in between.
+	#
+	def refine_to(self, levels):
+		from hemesh import hemesh
+		from lattice import refine_to
+		return refine_to(hemesh.from_object(self),levels).to_object()
 
-				#make the new vertex
-				nvec = edge.vector().scale(1/2)
-				nvpos = edge.source.position.plus(nvec)
-				nv = vertex(nvpos, selfie)
+	#
+	# o' = o.refine(batched=True)
+	#
+	# Refines an object using Loop's subdivision.  Each face is split
+	# into four, with a new "odd" vertex on each edge, and then every
+	# vertex is placed at a weighted average of the vertices around
+	# it in the original mesh.
+	#
+	# By default the work is done with whole-array operations by
+	# loop.refine on the hemesh form of the object.  Passing
+	# batched=False walks the linked structure instead.  Both build
+	# the same vertices, in the same order, and the same faces.
+	#
+	# Given 'select', a function of a face saying whether it should
+	# be split, only those faces are split, along with the ones
+	# needed to keep the mesh closed up (see adaptive.py).
+	#
+	# Given more than one worker, the batched work is spread over
+	# that many processes by parallel.refine, with the same result.
+	#
+	@tracing.timed('refine')
+	def refine(self, batched=True, select=None, workers=1):
+		if select is not None:
+			from hemesh import hemesh
+			from adaptive import refine
+			chosen = [bool(select(f)) for f in self.face]
+			return refine(hemesh.from_object(self),chosen).to_object()
 
-				if edge.twin is not None and edge.twin in vnew:
-					nvp = vnew[edge.twin]
-					nvpts.append(nvp)
-					selfie.vertex.pop()
-
-				#add the vertex introduced at this edge
-				#the edge is the key, the new vertex is the value
-				elif edge.twin not in vnew:
-					vnew[edge] = nv
-					nvpts.append(vnew[edge])
-				else:
-					print("error")
+		if batched and workers > 1:
+			from hemesh import hemesh
+			from parallel import refine
+			return refine(hemesh.from_object(self),workers).to_object()
 
-			#create the faces
-			for i in range(0,3):
-				face(vclones[f.edge(i).source], nvpts[i], nvpts[(i+2)%3], selfie)
-			face(nvpts[0], nvpts[1], nvpts[2], selfie)
+		if batched:
+			from hemesh import hemesh
+			from loop import refine
+			return refine(hemesh.from_object(self)).to_object()
 
-		selfie.finish()
+		selfie = object()
+		vclones = {} 
+		vnew = {}
+		R = self.rings()
 
-		#Debugging
-		# print ("number of faces in self.face: " + str(len(self.face)))
-		# print ("number of faces in selfie.face: " + str(len(selfie.face)))
-		# print ("number of edges in self.edge: " + str(len(self.edge)))
-		# print ("number of edges in selfie.edge: " + str(len(selfie.edge)))
-		# print ("number of vertices in self.vertex: " + str(len(self.vertex)))
-		# print ("number of vertices in selfie.vertex: " + str(len(selfie.vertex)))
-
-		# averaging phase
-		# recompute the position of all of the vertices that were part of the original shape
-		for v in vclones:
-			sv = vclones[v]
-			ps = [e.vertex(1).position for e in sv.around()]
+		# averaging phase, for the original vertices
+		for v in self.vertex:
+			edges = R.around(v.id)
+			ps = [e.next.source.position for e in edges]
 			count = len(ps)
-			ss = [1.0/count] * count
-			centroid = v.position.combos(ss,ps)
-
-			#we're on a cone 
-			if sv.edge.twin is not None:
-				bn = 5.0/8.0 - (3.0/8.0 + 2.0*cos((2.0*pi)/count)/8.0) ** 2
-				yn = bn / (1.0 - bn)
-				an = (yn/(1.0+yn))
-				dn = (1.0/(1.0+yn))
-				# sve = sv.position.components()
-				fvec = [x*an + y*dn for x,y in zip(sv.position.components(), centroid)]
-				sv.position = point(fvec[0], fvec[1], fvec[2])
-
-			#otherwise, we're on a fan
-			else:
-				vn1 = cur.source.position.minus(ORIGIN).scale(1/8)
-				v0 = sv.edge.vertex(1).position.minus(ORIGIN).scale(1/8)
-				vp = sv.edge.vector().scale(3/4)
-				nvec = vp.plus(v0).plus(vn1)
-				sv.position = point(nvec[0], nvec[1], nvec[2])
-
-		#recompute the position of the vertices that are new
-		for v in vnew.values():
-			e0 = v.edge
-			#case 1: interior edge on boundary
-			if e0.twin is None:
-				fvec = [(1/2)*(x + y) for x,y in zip(v.position.components(), e0.vertex(1).position.components())]
-				v.position = point(fvec[0], fvec[1], fvec[2])
-
-			#case 2: split interior edge
-			else:
-				e1 = e0.twin
-				v1 = e1.source
-				f0 = e0.next.next.source
-				f1 = e1.next.next.source
-				fs = [(1/8) * (x+y) for x, y in zip(f1.position.components(), f0.position.components())]
-				vs = [(3/8) * (x+y) for x, y in zip(v.position.components(), v1.position.components())]
-				fvec = [x + y for x, y in zip(fs, vs)]
-				v.position = point(fvec[0], fvec[1], fvec[2])
-
-		return selfie
-
-
-
-
-
-
-
-
 
+			# we're alone
+			if count == 0:
+				P = v.position
 
+			# we're on a cone
+			elif not R.border[v.id]:
+				bn = (5.0/8.0 - (3.0/8.0 + cos((2.0*pi)/count)/4.0) ** 2) / count
+				P = v.position.combos([bn] * count, ps)
 
+			# otherwise, we're on a fan, between two boundary edges
+			else:
+				b0 = edges[0].vertex(1).position
+				b1 = edges[-1].next.next.source.position
+				P = v.position.combos([1.0/8.0, 1.0/8.0], [b0, b1])
 
+			vclones[v] = vertex(P, selfie)
 
+		# splitting phase: create four faces
+		for f in self.face:
+			nvpts = []
+			for edge in f.edges():
 
+				# the twin already made the vertex introduced at this edge
+				if edge.twin is not None and edge.twin in vnew:
+					nvpts.append(vnew[edge.twin])
+					continue
 
+				v0 = edge.vertex(0).position
+				v1 = edge.vertex(1).position
 
+				# boundary edge: the midpoint
+				if edge.twin is None:
+					P = v0.combo(1.0/2.0, v1)
 
+				# interior edge: also weigh the two opposite corners
+				else:
+					f0 = edge.next.next.source.position
+					f1 = edge.twin.next.next.source.position
+					P = v0.combos([3.0/8.0, 1.0/8.0, 1.0/8.0], [v1, f0, f1])
 
+				# the edge is the key, the new vertex is the value
+				vnew[edge] = vertex(P, selfie)
+				nvpts.append(vnew[edge])
 
+			#create the faces
+			for i in range(0,3):
+				face(vclones[f.edge(i).source], nvpts[i], nvpts[(i+2)%3], selfie)
+			face(nvpts[0], nvpts[1], nvpts[2], selfie)
 
+		selfie.finish()
 
+		tracing.count('faces made',len(selfie.face))
+		tracing.count('half-edges made',len(selfie.edge))
+		tracing.count('vertices made',len(selfie.vertex))
+		return selfie